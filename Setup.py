@@ -117,7 +117,9 @@ setup(
 
     entry_points={
         'console_scripts': [
-            'geofinder = geofinder.GeoFinder:entry'
+            'geofinder = geofinder.GeoFinder:entry',
+            'geofinder-batch = geofinder.BatchGeoFinder:entry',
+            'geofinder-server = geofinder.GeoServer:entry'
         ],
     },
     install_requires=REQUIRED,
@@ -18,11 +18,12 @@
 #   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 
 # The tab separated columns in geoname.org file rows are as follows
+import os
 
-from geofinder import GeodataFiles, GeoKeys, GeoDB
+from geofinder import GeodataFiles, GeoKeys, Prefilter
 from geofinder.FileReader import FileReader
-from geofinder.Loc import Loc
 
+ALT_ID = 0
 ALT_GEOID = 1
 ALT_LANG = 2
 ALT_NAME = 3
@@ -33,7 +34,8 @@ class AlternateNames(FileReader):
     Read in Alternate names file and add appropriate entries to geoname dictionary
     Each row contains a geoname ID, an alternative name for that entity, and the language
     If the lang is in our Config and the ID is in our geonames dictionary, we add this as an alternative name
-    FileReader calls handle_line every time it reads a line
+    FileReader calls handle_line every time it reads a line.  Rows for our languages are gathered in a staging
+    table and then added to DB with a few set based queries (see GeoDB.load_alt_stage)
     """
 
     def __init__(self, directory_name: str, filename: str, progress_bar, geo_files: GeodataFiles, lang_list):
@@ -41,20 +43,61 @@ class AlternateNames(FileReader):
         self.sub_dir = GeoKeys.get_cache_directory(directory_name)
         self.geo_files: GeodataFiles.GeodataFiles = geo_files
         self.lang_list = lang_list
-        self.loc = Loc()
+        self.stage_rows = []
+        self.stage_batch_size = 100000
+        self.cancelled = False
+        self.resumable = False
+        self.checkpoint_pos = 0
 
-    def read(self) -> bool:
-        self.geo_files.geodb.db.begin()
+    def read(self, resumable=False) -> bool:
+        """
+        Read alternate names file.  Staged names are added to DB at each checkpoint
+        :param resumable: Record progress in build_state table and resume from the last checkpoint
+        """
+        geodb = self.geo_files.geodb
+        # Only lines for languages in our list are decoded
+        self.prefilter = Prefilter.altname_pattern(self.lang_list)
+        self.resumable = resumable
+        self.cancelled = False
+        self.start_pos, self.count, done = 0, 0, False
+        if resumable:
+            self.start_pos, self.count, done = geodb.get_build_state(self.fname)
+            if done:
+                return False
+        self.checkpoint_pos = self.start_pos
+
+        geodb.create_alt_stage()
+        geodb.db.begin()
         # Read in file.  This will call handle_line for each file line
         res = super().read()
-        self.geo_files.geodb.db.commit()
+        if res:
+            geodb.db.commit()
+        elif not self.cancelled:
+            self.checkpoint(os.path.getsize(os.path.join(self.directory, self.fname)), done=True)
+            self.logger.info(f'Added {self.count} alternate names')
         return res
 
+    def chunk_done(self, file_pos: int, cancelled: bool):
+        # Commit in bounded transactions
+        if cancelled or file_pos - self.checkpoint_pos >= self.geo_files.checkpoint_size:
+            self.checkpoint(file_pos, done=False)
+            if not cancelled:
+                self.geo_files.geodb.db.begin()
+
+    def checkpoint(self, file_pos, done):
+        # Add the staged names to DB (for the countries we are loading) and commit
+        geodb = self.geo_files.geodb
+        self.flush_stage()
+        self.count += geodb.load_alt_stage(self.geo_files.build_countries_dct)
+        geodb.flush_bulk()
+        if self.resumable:
+            geodb.set_build_state(self.fname, file_pos, self.count, done)
+        geodb.db.commit()
+        self.checkpoint_pos = file_pos
+
     def cancel(self):
-        # User requested cancel
-        # Abort DB build.  Clear out partial DB
-        self.geo_files.geodb.db.commit()
-        self.geo_files.geodb.clear_geoname_data()
+        # User requested cancel.  Names up to the last checkpoint have been committed
+        self.cancelled = True
 
     def handle_line(self, line_num, row):
         # This is called as each line is read
@@ -63,36 +106,14 @@ class AlternateNames(FileReader):
             self.logger.debug(f'Incorrect number of tokens: {alt_tokens} line {line_num}')
             return
 
-        self.loc.georow_list = []
-
         # Alternate names are in multiple languages.  Only add if item is in requested lang list
         if alt_tokens[ALT_LANG] in self.lang_list:
-            # Add this alias to geoname db if there is already an entry (geoname DB is filtered based on feature)
-            # See if item has an entry with same GEOID in Main DB
-            dbid = self.geo_files.geodb.geoid_main_dict.get(alt_tokens[ALT_GEOID])
-            if dbid is not None:
-                self.loc.target = dbid
-                self.geo_files.geodb.lookup_main_dbid(place=self.loc)
-            else:
-                # See if item has an  entry with same GEOID in Admin DB
-                dbid = self.geo_files.geodb.geoid_admin_dict.get(alt_tokens[ALT_GEOID])
-                if dbid is not None:
-                    self.loc.target = dbid
-                    self.geo_files.geodb.lookup_admin_dbid(place=self.loc)
-
-            if len(self.loc.georow_list) > 0:
-                # convert to list  and modify name and add to DB and its soundex
-                lst = list(self.loc.georow_list[0])
-                del lst[-1]
-                lst[GeoDB.Entry.NAME] = GeoKeys.normalize(alt_tokens[ALT_NAME])
-                lst.append(GeoKeys.get_soundex(alt_tokens[ALT_NAME]))
-                new_row = tuple(lst)   # Convert back to tuple
-                if alt_tokens[ALT_LANG] != 'en' or 'ADM' not in lst[GeoDB.Entry.FEAT]:
-                    # Only add if not English or not ADM1/ADM2
-                    self.geo_files.geodb.insert(geo_row=new_row, feat_code=lst[GeoDB.Entry.FEAT])
-                    self.count += 1
+            # Stage this alias.  It is only added if there is an entry with same GEOID in DB
+            # (geoname DB is filtered based on feature)
+            self.stage_rows.append((alt_tokens[ALT_ID], alt_tokens[ALT_GEOID], alt_tokens[ALT_LANG], alt_tokens[ALT_NAME]))
+            if len(self.stage_rows) >= self.stage_batch_size:
+                self.flush_stage()
 
-                # Add name to altnames table
-                if alt_tokens[ALT_LANG] != 'en':
-                    self.geo_files.geodb.insert_alternate_name(alt_tokens[ALT_NAME],
-                                                           alt_tokens[ALT_GEOID], alt_tokens[ALT_LANG])
+    def flush_stage(self):
+        self.geo_files.geodb.insert_alt_stage(self.stage_rows)
+        self.stage_rows.clear()
@@ -19,10 +19,9 @@
 import gzip
 import logging
 import os
-from tkinter import messagebox
 from typing import Union, Tuple
 
-from geofinder import Progress
+from geofinder import Progress, GeoKeys
 
 
 class AncestryFile:
@@ -46,6 +45,8 @@ class AncestryFile:
         self.out_path = self.in_path + '.' + self.out_suffix
         self.geodata = geodata
         self.temp_suffix = '.tmp'
+        # Show message boxes.  False when running with no display (see BatchGeoFinder.py)
+        self.interactive = True
 
         self.more_available = False
 
@@ -135,8 +136,8 @@ class AncestryFile:
             if line == "":
                 # End of File
                 self.logger.info(f'End of file. PLACE COUNT={self.place_total}')
-                if self.place_total < 10:
-                    messagebox.showinfo('File Read', f'File contained {self.place_total} places')
+                if self.place_total < 10 and self.interactive:
+                    GeoKeys.show_message('showinfo', 'File Read', f'File contained {self.place_total} places')
                 return "", True, id
         else:
             line = ''
@@ -184,6 +185,10 @@ class AncestryFile:
     def get_name(self, nam: str, depth: int = 0) -> str:
         return ''
 
+    def get_coord(self):
+        """ Return (lat, lon) the file has for the current place entry, or None """
+        return None
+
     # Derived classes must override these:
 
     def parse_line(self, line: str):
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Rows for the names in a batch of lookups.  See Geodata.find_locations.
+
+The names of all the entries in the batch are put in a temp table and joined against the geodata and admin
+tables, so the rows for the whole batch are read with one query per table.  The lookups for each entry then
+get their name queries from memory instead of running their own small SELECTs.
+"""
+import logging
+import time
+
+from geofinder.HotTier import COLUMN_POS, TABLES, match_terms, parse_where, rank_rows
+from geofinder.Snapshot import SELECT_STR
+
+logger = logging.getLogger(__name__)
+
+
+class BatchCache:
+    """
+    select() takes the same arguments as DB.select and answers queries with a 'name = ?' term for a name in the
+    batch.  All the rows for those names are held, so results are the same as SQLite.  Other queries return None
+    """
+
+    def __init__(self, geodb, names):
+        """
+        Read the rows for names from the DB
+        :param geodb: GeoDB to read from
+        :param names: Set of names in the batch
+        """
+        from geofinder.GeoDB import base_table
+
+        start = time.time()
+        self.names = set(names)
+        # Name to list of rows in primary key order (the order of a SQLite name query)
+        self.rows = {tbl: {} for tbl in TABLES}
+        # Name to list of row priorities.  Used for ranked queries
+        self.priority = {tbl: {} for tbl in TABLES}
+        decode = {pos: {code: name for name, code in geodb.codes[tbl].items()}
+                  for pos, tbl in [(COLUMN_POS['country'], 'country_code'), (COLUMN_POS['f_code'], 'feature_code')]}
+
+        cur = geodb.db.conn.cursor()
+        cur.execute('CREATE TEMP TABLE IF NOT EXISTS batch_name (name text primary key not null) WITHOUT ROWID')
+        # noinspection SqlWithoutWhere
+        cur.execute('DELETE FROM temp.batch_name')
+        cur.executemany('INSERT OR IGNORE INTO temp.batch_name(name) VALUES(?)', [(name,) for name in self.names])
+        select_str = ', '.join(f'g.{col}' for col in SELECT_STR.split(', '))
+        count = 0
+        for tbl in TABLES:
+            cur.execute(f'SELECT {select_str}, g.priority FROM temp.batch_name b JOIN {base_table[tbl]} g ON g.name = b.name '
+                        f'ORDER BY g.name, g.country, g.id')
+            rows = self.rows[tbl]
+            priority = self.priority[tbl]
+            for row in cur:
+                row = list(row)
+                for pos, values in decode.items():
+                    row[pos] = values.get(row[pos], '')
+                rows.setdefault(row[0], []).append(tuple(row[:-1]))
+                priority.setdefault(row[0], []).append(row[-1] or 0)
+                count += 1
+        # noinspection SqlWithoutWhere
+        cur.execute('DELETE FROM temp.batch_name')
+        logger.debug(f'Batch cache loaded.  {len(self.names):,} names {count:,} rows  Elapsed ={time.time() - start:.2f}')
+
+    def select(self, select_str, where, from_tbl, args, limit=None, ranked=False):
+        """
+        Run a query from DB.select against the batch rows
+        :param ranked: Return the best limit rows by priority rather than the first limit rows
+        :return: list of rows, or None if query isn't supported
+        """
+        tbl = from_tbl.split('.')[-1]
+        if tbl not in self.rows or ' '.join(select_str.split()) != SELECT_STR:
+            return None
+        terms = parse_where(where, args)
+        if terms is None:
+            return None
+        name = None
+        for col, op, value in terms:
+            if col == 'name' and op == '=':
+                name = value
+                break
+        if name is None or name not in self.names:
+            return None
+
+        res = []
+        rows = self.rows[tbl].get(name, [])
+        for row_pos, row in enumerate(rows):
+            if match_terms(row, terms):
+                res.append(row_pos)
+                if limit is not None and len(res) >= limit and not ranked:
+                    break
+        return [rows[row_pos] for row_pos in rank_rows(res, self.priority[tbl].get(name, []), limit, ranked)]
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import argparse
+import copy
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+from geofinder import DB, GeoKeys, Gedcom, Loc, GrampsXml, LookupEngine
+from geofinder import __version__
+from geofinder.CachedDictionary import CachedDictionary
+from geofinder.IniHandler import IniHandler
+from geofinder.LookupEngine import open_geodata, find_entries
+
+GEOID_TOKEN = 1
+PREFIX_TOKEN = 2
+scan_suffix = 'scan.tmp'
+
+
+class BatchGeoFinder:
+    """
+    Command line version of GeoFinder.  Runs with no display and no user input.
+    Each place in a GEDCOM or Gramps XML file is handled the way GeoFinder handles it during shutdown:
+    Global replace entries and strong matches are applied, skiplist entries and everything else are written out as-is.
+    Places that need review are written to <file>.review.txt
+
+    With one worker the file is read once and each distinct place is looked up as it is reached.  With more workers
+    the file is read twice.  The first pass collects the distinct places to look up, these are looked up by a
+    LookupEngine pool of worker processes with the DB opened read only, and the second pass writes the import file.
+    """
+
+    def __init__(self, directory, in_path: str, workers: int, diagnostics: bool, profile='legacy', storage='disk'):
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.cache_dir = GeoKeys.get_cache_directory(self.directory)
+        self.in_path = in_path
+        self.workers = workers
+        self.diagnostics = diagnostics
+        # Query cascade profile.  See DB.cascade_profiles
+        self.profile = profile
+        # DB storage profile.  See DB.storage_profiles
+        self.storage = storage
+        self.skiplist = None
+        self.global_replace = None
+        self.geodata = None
+        self.ancestry_file_handler = None
+        self.out_suffix = ''
+        self.out_diag_file = None
+        self.in_diag_file = None
+        self.matched_count = 0
+        self.review_count = 0
+        self.skip_count = 0
+        # Lookup results keyed by (location, event year, coordinate)
+        self.results = {}
+        # Places that need review.  Location -> [count, place]
+        self.review = {}
+
+    def load_data(self) -> bool:
+        # Read in Skiplist, Replace list and open geoname DB read only.  Returns True if error
+        self.skiplist = CachedDictionary(self.cache_dir, "skiplist.pkl")
+        self.skiplist.read()
+        self.global_replace = CachedDictionary(self.cache_dir, "global_replace.pkl")
+        self.global_replace.read()
+
+        if self.workers > 1:
+            # Lookups run on the LookupEngine workers.  This process only needs the DB for global replace entries
+            # and display names, so it skips the memo and the in-memory copy
+            self.geodata = open_geodata(self.directory, memo_enabled=False, profile=self.profile, storage='disk')
+        else:
+            self.geodata = open_geodata(self.directory, memo_enabled=True, profile=self.profile, storage=self.storage)
+        return self.geodata is None
+
+    def open_handler(self, out_suffix):
+        # Open GEDCOM or Gramps handler for in_path
+        if '.ged' in self.in_path:
+            handler = Gedcom.Gedcom(in_path=self.in_path, out_suffix=out_suffix, cache_d=self.cache_dir,
+                                    progress=None, geodata=self.geodata)
+        elif '.gramps' in self.in_path:
+            handler = GrampsXml.GrampsXml(in_path=self.in_path, out_suffix=out_suffix, cache_d=self.cache_dir,
+                                          progress=None, geodata=self.geodata)
+        else:
+            self.logger.error(f'UNKNOWN File type. Not .gramps and not .ged. {self.in_path}')
+            return None
+        handler.interactive = False
+        if handler.error:
+            self.logger.error(f'File {self.in_path} not found.')
+            return None
+        return handler
+
+    def run(self) -> bool:
+        """ Geocode in_path.  Returns True if error """
+        if '.ged' in self.in_path:
+            self.out_suffix = "import.ged"
+        elif '.gramps' in self.in_path:
+            self.out_suffix = "import.gramps"
+
+        if self.load_data():
+            self.logger.error(f'Cannot open geoname database in {self.cache_dir}.  Run geofinder to build it')
+            return True
+
+        if self.workers > 1:
+            start = time.time()
+            entries = self.scan()
+            if entries is None:
+                return True
+            self.lookup(entries)
+            self.logger.info(f'Lookup complete. {len(entries):,} places in {time.time() - start:.1f} seconds')
+
+        err = self.write_import()
+        self.write_review()
+        self.shutdown()
+        print(f'Matched={self.matched_count}  Skipped={self.skip_count}  Needed Review={self.review_count}')
+        return err
+
+    def scan(self):
+        """
+        First pass.  Collect the places that don't have a global replace or skiplist entry
+        :return: List of (location, event year, coordinate) or None if error
+        """
+        handler = self.open_handler(scan_suffix)
+        if handler is None:
+            return None
+        entries = {}
+        while True:
+            town_entry, eof, rec_id = handler.get_next_place()
+            if eof:
+                break
+            town_entry = GeoKeys.semi_normalize(town_entry)
+            if self.global_replace.get(town_entry) is not None or self.skiplist.get(town_entry) is not None:
+                continue
+            entries[(town_entry, int(handler.event_year), handler.get_coord())] = None
+        handler.close()
+        # The scan output is not used
+        if os.path.exists(handler.out_path):
+            os.remove(handler.out_path)
+        self.logger.info(f'Scan complete. {len(entries):,} places to look up')
+        return list(entries)
+
+    def lookup(self, entries):
+        # Look up entries on a LookupEngine.  Results are in self.results.  Small files don't start the workers
+        if len(entries) > self.workers:
+            engine = LookupEngine.LookupEngine(self.directory, self.workers, profile=self.profile, storage=self.storage)
+            try:
+                places = engine.find_locations(entries)
+            finally:
+                engine.close()
+        else:
+            places = find_entries(self.geodata, entries)
+        self.results = dict(zip(entries, places))
+
+    def write_import(self) -> bool:
+        """ Second pass.  Write out import file with updated places.  Returns True if error """
+        self.ancestry_file_handler = self.open_handler(self.out_suffix)
+        if self.ancestry_file_handler is None:
+            return True
+        if self.diagnostics:
+            self.out_diag_file = open(self.in_path + '.output.txt', 'w')
+            self.in_diag_file = open(self.in_path + '.input.txt', 'w')
+
+        handler = self.ancestry_file_handler
+        while True:
+            town_entry, eof, rec_id = handler.get_next_place()
+            if eof:
+                break
+            town_entry = GeoKeys.semi_normalize(town_entry)
+
+            # See if we already have a fix (Global Replace) or Skip (ignore).
+            place = Loc.Loc()
+            place.id = rec_id
+            replacement_geoid = self.get_replacement(self.global_replace, town_entry, place)
+
+            if replacement_geoid is not None:
+                # IN GLOBAL REPLACE LIST
+                if place.result_type == GeoKeys.Result.STRONG_MATCH:
+                    self.matched_count += 1
+                    self.write_updated_place(place, town_entry)
+                elif place.result_type != GeoKeys.Result.DELETE:
+                    self.logger.warning(f'***ERROR looking up GEOID=[{replacement_geoid}] for [{town_entry}] ')
+                    self.write_review_place(place, town_entry)
+            elif self.skiplist.get(town_entry) is not None:
+                # IN SKIPLIST - Write out as-is
+                self.skip_count += 1
+                handler.write_asis(town_entry)
+            else:
+                key = (town_entry, int(handler.event_year), handler.get_coord())
+                result = self.results.get(key)
+                if result is None:
+                    # Single pass.  Look up each distinct place the first time it is reached
+                    result = Loc.Loc()
+                    result.event_year = key[1]
+                    self.geodata.find_location(town_entry, result, True, coord=key[2])
+                    self.results[key] = result
+                # Result is shared by every entry with the same location
+                place = copy.copy(result)
+                place.id = rec_id
+                if place.result_type == GeoKeys.Result.STRONG_MATCH:
+                    self.matched_count += 1
+                    # Add to global replace list - Use '@' for tokenizing.  Save GEOID_TOKEN and PREFIX_TOKEN
+                    self.global_replace.set(town_entry, '@' + place.geoid + '@' + place.prefix)
+                    self.write_updated_place(place, town_entry)
+                else:
+                    self.write_review_place(place, town_entry)
+        handler.close()
+        return False
+
+    def get_replacement(self, dct, town_entry: str, place):
+        geoid = None
+        replacement = dct.get(town_entry)
+
+        if replacement is not None:
+            if len(replacement) > 0:
+                # parse replacement entry
+                rep_tokens = replacement.split('@')
+                geoid = rep_tokens[GEOID_TOKEN]
+                if len(geoid) > 0:
+                    self.geodata.find_geoid(geoid, place)
+                else:
+                    place.result_type = GeoKeys.Result.DELETE
+
+                # Get prefix if there was one
+                if len(rep_tokens) > 2:
+                    place.prefix = rep_tokens[PREFIX_TOKEN]
+                    place.prefix_commas = ','
+
+        return geoid
+
+    def write_updated_place(self, place: Loc.Loc, entry):
+        # Write out updated location and lat/lon to  file
+        self.geodata.geo_files.geodb.set_display_names(place)
+        place.original_entry = place.format_full_nm(self.geodata.geo_files.output_replace_dct)
+        prefix = GeoKeys.capwords(place.prefix)
+        if self.diagnostics:
+            self.in_diag_file.write(f'{entry}\n')
+
+        self.ancestry_file_handler.write_updated(prefix + place.prefix_commas + place.original_entry, place)
+        self.ancestry_file_handler.write_lat_lon(lat=place.lat, lon=place.lon)
+        if self.diagnostics:
+            text = prefix + place.prefix_commas + place.original_entry + '\n'
+            self.out_diag_file.write(str(text.encode('utf-8', errors='replace')))
+
+    def write_review_place(self, place: Loc.Loc, entry):
+        # Write out place as-is and add it to review list
+        self.review_count += 1
+        self.ancestry_file_handler.write_asis(entry)
+        item = self.review.get(entry)
+        if item is None:
+            self.review[entry] = [1, place]
+        else:
+            item[0] += 1
+
+    def write_review(self):
+        # Write out places that need review.  Tab separated: count, place, result, status, best match
+        path = self.in_path + '.review.txt'
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('count\tplace\tresult\tstatus\tmatch\n')
+            for entry, (count, place) in sorted(self.review.items(), key=lambda item: -item[1][0]):
+                match = ''
+                if len(place.georow_list) > 0:
+                    row = place.georow_list[0]
+                    match = f'{row[GeoKeys.Entry.NAME]} {row[GeoKeys.Entry.ISO]} {row[GeoKeys.Entry.ID]}'
+                file.write(f'{count}\t{entry}\t{place.result_type}\t{place.status.strip()}\t{match}\n')
+        self.logger.info(f'Wrote {len(self.review):,} places for review to {path}')
+
+    def shutdown(self):
+        """ Write out Gbl Replace and skip file """
+        if self.geodata:
+            self.geodata.close()
+        if self.skiplist:
+            self.skiplist.write()
+        if self.global_replace:
+            self.global_replace.write()
+        if self.out_diag_file:
+            self.out_diag_file.close()
+        if self.in_diag_file:
+            self.in_diag_file.close()
+        self.logger.info(f'Created {self.in_path}.{self.out_suffix}')
+
+
+def entry():
+    parser = argparse.ArgumentParser(description='Geocode the places in a GEDCOM or Gramps XML file with no display')
+    parser.add_argument("path", help="GEDCOM (.ged) or Gramps XML (.gramps) file")
+    parser.add_argument("--directory", help="GeoFinder data directory.  Default is the directory in geofinder.ini")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) - 1),
+                        help="Number of lookup worker processes")
+    parser.add_argument("--profile", default='legacy', choices=sorted(DB.cascade_profiles),
+                        help="Query cascade profile.  Default legacy runs every stage")
+    parser.add_argument("--storage", default='disk', choices=sorted(DB.storage_profiles),
+                        help="Database storage.  memory loads the database into RAM in each process")
+    parser.add_argument("--logging", help="Enable quiet logging")
+    parser.add_argument("--diagnostics", action='store_true', help="Create diagnostics files")
+    args = parser.parse_args()
+
+    fmt = "%(levelname)s %(name)s.%(funcName)s %(lineno)d: %(message)s"
+    logging.basicConfig(level=logging.INFO if args.logging == 'info' else logging.WARNING, stream=sys.stdout, format=fmt)
+    # No display.  Messages go to the log
+    GeoKeys.gui_enabled = False
+    print('GeoFinder batch v{}'.format(__version__.__version__))
+
+    directory = args.directory
+    if directory is None:
+        ini_handler = IniHandler(home_path=str(Path.home()), ini_name='geofinder.ini')
+        directory = ini_handler.get_directory_from_ini()
+
+    finder = BatchGeoFinder(directory=str(directory), in_path=args.path, workers=args.workers,
+                            diagnostics=args.diagnostics, profile=args.profile, storage=args.storage)
+    err = finder.run()
+    sys.exit(1 if err else 0)
+
+
+if __name__ == "__main__":
+    entry()
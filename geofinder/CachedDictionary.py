@@ -20,9 +20,10 @@
 import logging
 import os
 import pickle
-from tkinter import messagebox
 from typing import Dict
 
+from geofinder import GeoKeys
+
 
 class CachedDictionary:
     """ Use a Python Pickle file to maintain a cached dictionary """
@@ -60,7 +61,7 @@ class CachedDictionary:
                 with open(path, 'wb') as file:
                     pickle.dump(self.dict, file)
             except OSError as e:
-                messagebox.showwarning('File Error',f'{e}')
+                GeoKeys.show_message('showwarning', 'File Error',f'{e}')
             self.error = True
             return True
 
@@ -75,7 +76,7 @@ class CachedDictionary:
             with open(path, 'wb') as file:
                 pickle.dump(self.dict, file)
         except OSError as e:
-            messagebox.showwarning('File Write Error',e)
+            GeoKeys.show_message('showwarning', 'File Write Error',e)
             return  True
 
         return False
@@ -92,6 +92,7 @@ class Country:
 
             self.geodb.insert(geo_row=geo_row, feat_code='ADM0')
 
+        self.geodb.flush_bulk()
         self.geodb.db.commit()
         return False
 
@@ -151,7 +152,7 @@ country_dict = {
     'Congo, the Democratic Republic of the': ('CD', 'COD', '180', '0', '25'),
     'Cook Islands': ('CK', 'COK', '184', '-21.233', '-159.766'),
     'Costa Rica': ('CR', 'CRI', '188', '10', '-84'),
-    'Côte d Ivoire': ('CI', 'CIV', '384', '8', ' - 5'),
+    'Côte d Ivoire': ('CI', 'CIV', '384', '8', '-5'),
     'Ivory Coast': ('CI', 'CIV', '384', '8', '-5'),
     'Croatia': ('HR', 'HRV', '191', '45.166', '15.5'),
     'Cuba': ('CU', 'CUB', '192', '21.5', '-80'),
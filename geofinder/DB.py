@@ -16,39 +16,202 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program; if not, write to the Free Software
 #   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+import collections
+import itertools
 import logging
+import os
+import re
 import sqlite3
 import sys
+import threading
 import time
-from tkinter import messagebox
+import urllib.parse
+import weakref
 
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.  Process size isn't reported
+    resource = None
+
+from geofinder import GeoKeys, QueryCache, QueryStats
 from geofinder.GeoKeys import Query, Result, Entry
 
+CascadePolicy = collections.namedtuple('CascadePolicy', 'min_rows stop_on fallback top_k')
+
+# Stop rules for the run_query_list cascade.
+#   min_rows - Stop once this many rows are found
+#   stop_on  - Stop after a stage with one of these result codes returns rows
+#   fallback - Wildcard and soundex stages: 'always' run, run 'if_empty' (no rows found yet), or 'never' run
+#   top_k    - Each geodata and admin query returns its best top_k rows by priority.  None for the first rows found
+#              up to limit_str
+cascade_profiles = {
+    # Default.  Every stage runs until more than 6 rows are found, up to limit_str rows each.  Same as before profiles
+    'legacy': CascadePolicy(min_rows=7, stop_on=(), fallback='always', top_k=None),
+    # Stop on a hit with all the place items.  Otherwise fallbacks add candidates for the user to review
+    'interactive': CascadePolicy(min_rows=7, stop_on=(Result.STRONG_MATCH,), fallback='always', top_k=50),
+    # No user to review candidates.  Stop on any name hit and only try fallbacks when nothing was found
+    'batch': CascadePolicy(min_rows=7, stop_on=(Result.STRONG_MATCH, Result.PARTIAL_MATCH), fallback='if_empty', top_k=25),
+    # Name hits only
+    'strict': CascadePolicy(min_rows=7, stop_on=(Result.STRONG_MATCH, Result.PARTIAL_MATCH), fallback='never', top_k=25),
+}
+
+# Tables with a priority column and the order of their ranked queries.  Ties are in primary key order
+RANKED_TABLES = ['geodata', 'admin']
+RANK_ORDER = 'ORDER BY priority, name, country, id'
+
+StorageProfile = collections.namedtuple('StorageProfile', 'in_memory cache_kb mmap_mb')
+
+# How query pages are held.
+#   in_memory - Copy the DB file to an in memory DB with the backup API when it is opened.  Read only mode only
+#   cache_kb  - SQLite page cache size of each connection
+#   mmap_mb   - Memory map up to this much of the DB file.  0 for none
+storage_profiles = {
+    # Pages are read from the file as queries need them
+    'disk': StorageProfile(in_memory=False, cache_kb=8 * 1024, mmap_mb=0),
+    # File is memory mapped so the OS keeps hot pages.  Larger page cache
+    'mmap': StorageProfile(in_memory=False, cache_kb=64 * 1024, mmap_mb=4 * 1024),
+    # Whole DB is in RAM.  Slower start and RAM for the whole DB in each process
+    'memory': StorageProfile(in_memory=True, cache_kb=2 * 1024, mmap_mb=0),
+}
+# Numbers in memory DB names
+memory_db_ids = itertools.count(1)
+
+
+class ThreadConn:
+    """ Read only connection of one thread.  Only the thread local holds it, so it is freed when the thread ends """
+
+    def __init__(self, conn):
+        self.conn = conn
+
 
 class DB:
     """
     Sqlite3  helper functions
     """
 
-    def __init__(self, db_filename: str):
+    def __init__(self, db_filename: str, read_only: bool = False, immutable: bool = False, storage: str = 'disk'):
+        """
+        Open DB
+        :param read_only: Open with URI mode=ro.  Each thread gets its own connection (see conn) so lookups can run
+        from several threads, and other processes can read the same file
+        :param immutable: Read only and the file is never changed while open.  SQLite skips all locking
+        :param storage: Storage profile.  See storage_profiles
+        """
         self.logger = logging.getLogger(__name__)
+        self.db_filename = db_filename
+        self.read_only = read_only or immutable
+        self.immutable = immutable
+        # Per thread state:  read only connection and hot tier
+        self.local = threading.local()
+        # Read only connections of all threads.  A thread's connection is closed when the thread ends.  See conn
+        self.pool = []
+        self.pool_lock = threading.Lock()
+        self.main_conn = None
 
         # self.select_str = '*'
         self.order_str = ''
         self.limit_str = ''
         self.cur = None
         self.total_time = 0
+        # Wildcard and soundex stages.  False turns them off for every lookup.  See lookup_wildcards for one lookup
         self.use_wildcards = True
+        # Read only snapshot of geodata and admin tables.  Queries it supports don't go to SQLite.  See Snapshot.py
+        self.snapshot = None
+        # In memory hot tier.  Only set while a tiered lookup is using it (per thread).  See HotTier.py
+        self.tier = None
+        # Rows for the names in a batch of lookups.  Only set during a batch (per thread).  See BatchCache.py
+        self.batch = None
+        # LRU cache of process_query results.  Cleared when a write is committed.  See set_query_cache()
+        self.query_cache = QueryCache.QueryCache(max_entries=20000, max_bytes=32 * 1024 * 1024)
+        # Stop rules for the query cascade and statistics for each stage.  See run_query_list
+        self.cascade_profile = 'legacy'
+        self.cascade_policy = cascade_profiles[self.cascade_profile]
+        self.query_stats = QueryStats.QueryStats()
+        # True when the name_fts full text index is current.  Used by GeoDB.advanced_search.  See update_name_index()
+        self.name_index = False
+        # True when the name_trigram index is current.  Used for name LIKE queries.  See use_trigram_index()
+        self.trigram_index = False
+
+        # Storage profile.  An in memory DB would lose writes, so it is only used read only
+        if storage not in storage_profiles:
+            self.logger.warning(f'Unknown storage profile {storage}.  Using disk')
+            storage = 'disk'
+        if storage_profiles[storage].in_memory and not self.read_only:
+            self.logger.info('In memory database requires read only mode.  Using mmap')
+            storage = 'mmap'
+        self.storage = storage
+        self.storage_profile = storage_profiles[storage]
+        # Shared cache URI of the in memory DB.  All connections of this DB use it.  Seconds to load it
+        self.memory_uri = f'file:geofinder_{os.getpid()}_{next(memory_db_ids)}?mode=memory&cache=shared' \
+            if self.storage_profile.in_memory else None
+        self.load_time = 0.0
+
+        # Page cache size in KB during a DB build and during normal queries
+        self.build_cache_kb = 256 * 1024
+        self.query_cache_kb = self.storage_profile.cache_kb
 
         # create a database connection
-        self.conn = self.connect(db_filename=db_filename)
-        if self.conn is None:
+        self.main_conn = self.connect(db_filename=db_filename)
+        if self.main_conn is None:
             self.err = True
             self.logger.error(f"Error! cannot open database {db_filename}.")
             raise ValueError('Cannot open database')
         else:
             self.err = False
-            self.conn.isolation_level = None
+            self.main_conn.isolation_level = None
+            if self.read_only:
+                self.local.conn_ref = ThreadConn(self.main_conn)
+                self.pool.append(self.main_conn)
+
+    @property
+    def conn(self):
+        # Connection for this thread.  In read only mode each thread opens its own connection on first use
+        if not self.read_only:
+            return self.main_conn
+        conn_ref = getattr(self.local, 'conn_ref', None)
+        if conn_ref is None:
+            conn = self.connect(db_filename=self.db_filename)
+            conn.isolation_level = None
+            conn_ref = ThreadConn(conn)
+            self.local.conn_ref = conn_ref
+            with self.pool_lock:
+                self.pool.append(conn)
+            # The thread local is cleared when the thread ends.  Then the connection is closed
+            weakref.finalize(conn_ref, self.release, conn)
+        return conn_ref.conn
+
+    def release(self, conn):
+        # Close the connection of a thread that has ended.  Connections already closed by close() are skipped
+        with self.pool_lock:
+            if conn in self.pool:
+                self.pool.remove(conn)
+                conn.close()
+
+    @property
+    def tier(self):
+        return getattr(self.local, 'tier', None)
+
+    @tier.setter
+    def tier(self, tier):
+        self.local.tier = tier
+
+    @property
+    def lookup_wildcards(self) -> bool:
+        # Wildcard and soundex stages run for the lookup on this thread.  Geodata.find_location sets it per lookup
+        return self.use_wildcards and getattr(self.local, 'wildcards', True)
+
+    @lookup_wildcards.setter
+    def lookup_wildcards(self, enabled: bool):
+        self.local.wildcards = enabled
+
+    @property
+    def batch(self):
+        return getattr(self.local, 'batch', None)
+
+    @batch.setter
+    def batch(self, batch):
+        self.local.batch = batch
 
     def connect(self, db_filename: str):
         """ create a database connection to the SQLite database
@@ -57,15 +220,66 @@ class DB:
         :return: Connection object or None
         """
         try:
-            conn = sqlite3.connect(db_filename)
+            if self.memory_uri is not None:
+                conn = self.connect_memory(db_filename)
+            elif self.read_only:
+                mode = 'immutable=1' if self.immutable else 'mode=ro'
+                conn = sqlite3.connect(f'file:{urllib.parse.quote(db_filename)}?{mode}', uri=True,
+                                       check_same_thread=False)
+            else:
+                conn = sqlite3.connect(db_filename)
+            if self.read_only:
+                conn.execute(f'PRAGMA cache_size = -{self.query_cache_kb}')
+                conn.execute('PRAGMA temp_store = memory')
+            conn.execute(f'PRAGMA mmap_size = {self.storage_profile.mmap_mb * 1024 * 1024}')
             self.logger.info(f'DB {db_filename} connected')
             return conn
         except Exception as e:
-            messagebox.showwarning('Error', f'Database Connection Error\n {e}')
+            GeoKeys.show_message('showwarning', 'Error', f'Database Connection Error\n {e}')
             self.err = True
             self.logger.error(e)
             sys.exit()
 
+    def connect_memory(self, db_filename: str):
+        # Connection to the in memory DB.  The first connection copies the DB file into it with the backup API
+        conn = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+        if self.main_conn is None:
+            start = time.time()
+            src = sqlite3.connect(f'file:{urllib.parse.quote(db_filename)}?mode=ro', uri=True)
+            try:
+                src.backup(conn)
+            finally:
+                src.close()
+            self.load_time = time.time() - start
+            self.logger.info(f'Database loaded into memory.  {self.get_db_bytes(conn) / 1024 / 1024:,.1f} MB  '
+                             f'Elapsed ={self.load_time:.1f}')
+        return conn
+
+    @staticmethod
+    def get_db_bytes(conn) -> int:
+        # Size of the DB on conn
+        page_count = conn.execute('PRAGMA page_count').fetchall()[0][0]
+        page_size = conn.execute('PRAGMA page_size').fetchall()[0][0]
+        return page_count * page_size
+
+    def get_storage_stats(self) -> dict:
+        """
+        Storage profile, seconds to load the in memory DB, DB bytes held in memory (the in memory copy or the
+        memory mapped part of the file) and peak process size.  Process size is 0 where it isn't available
+        """
+        db_bytes = self.get_db_bytes(self.conn)
+        if self.memory_uri is not None:
+            resident = db_bytes
+        else:
+            resident = min(db_bytes, self.storage_profile.mmap_mb * 1024 * 1024)
+        peak = 0
+        if resource is not None:
+            # ru_maxrss is in KB on Linux and bytes on macOS
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        return {'storage': self.storage, 'load_seconds': round(self.load_time, 2),
+                'db_mb': round(db_bytes / 1024 / 1024, 1), 'resident_mb': round(resident / 1024 / 1024, 1),
+                'cache_mb': round(self.query_cache_kb / 1024, 1), 'peak_process_mb': round(peak / 1024 / 1024, 1)}
+
     def set_params(self, order_str: str, limit_str: str):
         # Set values for SELECT, ORDER BY, and LIMIT
         self.order_str = order_str
@@ -87,7 +301,7 @@ class DB:
             self.conn.commit()
             self.logger.info(f'Create DB table {create_table_sql[27:36]}')  # Lazy attempt to get table name for logging
         except Exception as e:
-            messagebox.showwarning('Error', e)
+            GeoKeys.show_message('showwarning', 'Error', e)
             self.err = True
             self.logger.error(e)
             sys.exit()
@@ -99,7 +313,7 @@ class DB:
             c.execute(create_table_sql)
             self.conn.commit()
         except Exception as e:
-            messagebox.showwarning('Error', e)
+            GeoKeys.show_message('showwarning', 'Error', e)
             self.err = True
             self.logger.error(e)
             sys.exit()
@@ -109,8 +323,9 @@ class DB:
         try:
             # noinspection SqlWithoutWhere
             cur.execute(f'DELETE FROM {tbl}')
+            self.query_cache.clear()
         except Exception as e:
-            messagebox.showwarning('Error', f'Database delete table error\n {e}')
+            GeoKeys.show_message('showwarning', 'Error', f'Database delete table error\n {e}')
             self.err = True
             self.logger.error(e)
             sys.exit()
@@ -132,26 +347,52 @@ class DB:
             self.cur.execute(sql, args)
         """
         except Exception as e:
-            messagebox.showwarning('Error', f'{DB_CORRUPT_MSG}\n {e}')
+            GeoKeys.show_message('showwarning', 'Error', f'{DB_CORRUPT_MSG}\n {e}')
             self.err = True
             self.logger.error(e)
             sys.exit()
         """
         return self.cur.lastrowid
 
+    def executemany(self, sql, rows):
+        # Execute sql for each row in a single call.  Used for bulk load
+        self.cur.executemany(sql, rows)
+
     def commit(self):
-        # Commit transaction
+        # Commit transaction.  Cached query results are cleared once per transaction rather than on each write
         self.cur.execute("commit")
+        self.query_cache.clear()
 
     def select(self, select_str, where, from_tbl, args):
+        # Ranked queries return the best rows by priority.  See cascade_profiles top_k
+        top_k = self.cascade_policy.top_k
+        ranked = top_k is not None and self.order_str == '' and from_tbl.split('.')[-1] in RANKED_TABLES
+        limit = top_k if ranked else self.get_limit()
+        if self.tier is not None and self.order_str == '':
+            res = self.tier.select(select_str, where, from_tbl, args, limit, ranked)
+            if res is not None:
+                return res
+        if self.batch is not None and self.order_str == '':
+            res = self.batch.select(select_str, where, from_tbl, args, limit, ranked)
+            if res is not None:
+                return res
+        if self.snapshot is not None and self.order_str == '':
+            res = self.snapshot.select(select_str, where, from_tbl, args, limit, ranked)
+            if res is not None:
+                return res
+        if self.trigram_index:
+            where = self.use_trigram_index(where, args)
         error = False
         cur = self.conn.cursor()
-        sql = f"SELECT {select_str} FROM {from_tbl} WHERE {where} {self.order_str} {self.limit_str}"
+        if ranked:
+            sql = f"SELECT {select_str} FROM {from_tbl} WHERE {where} {RANK_ORDER} LIMIT {top_k}"
+        else:
+            sql = f"SELECT {select_str} FROM {from_tbl} WHERE {where} {self.order_str} {self.limit_str}"
         try:
             cur.execute(sql, args)
             res = cur.fetchall()
         except Exception as e:
-            messagebox.showwarning('Error', f'Database select error\n\n'
+            GeoKeys.show_message('showwarning', 'Error', f'Database select error\n\n'
             f'SELECT\n {select_str}\n FROM {from_tbl} WHERE\n {where}\n'
             f'{args}\n\n {e}')
             self.err = True
@@ -162,6 +403,30 @@ class DB:
             skdfjd = hghg
         return res
 
+    @staticmethod
+    def use_trigram_index(where, args) -> str:
+        """
+        Change 'name LIKE ?' terms in where clause to a lookup in the name_trigram index.  The index is only used
+        when the pattern has 3 characters in a row without a wildcard
+        :return: where clause.  args are unchanged
+        """
+        terms = re.split(r'(\s+and\s+)', where, flags=re.IGNORECASE)
+        arg_idx = 0
+        for idx in range(0, len(terms), 2):
+            term = terms[idx]
+            if re.fullmatch(r'\s*name\s+like\s+\?\s*', term, flags=re.IGNORECASE) and arg_idx < len(args) and \
+                    isinstance(args[arg_idx], str) and re.search(r'[^%_]{3}', args[arg_idx]):
+                terms[idx] = ' name IN (SELECT name FROM name_trigram WHERE name LIKE ?) '
+            arg_idx += term.count('?')
+        return ''.join(terms)
+
+    def get_limit(self):
+        # Row limit from limit_str or None
+        match = re.match(r'\s*LIMIT\s+(\d+)\s*$', self.limit_str, flags=re.IGNORECASE)
+        if match:
+            return int(match.group(1))
+        return None
+
     def table_exists(self, table_name):
         # SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}';
         where = "type=? AND name=?"
@@ -206,15 +471,59 @@ class DB:
             self.logger.warning(f'DB ERROR {e}')
             return True
 
+    def close(self):
+        # Close connection, and in read only mode the connections of all threads
+        with self.pool_lock:
+            conns = self.pool if self.read_only else [self.main_conn]
+            for conn in conns:
+                conn.close()
+            self.pool = []
+
+    def set_query_cache(self, max_entries: int, max_bytes: int):
+        # Set query cache limits.  max_entries of zero turns the cache off
+        self.query_cache = QueryCache.QueryCache(max_entries=max_entries, max_bytes=max_bytes)
+
+    def set_cascade_profile(self, profile: str):
+        # Set stop rules for the query cascade.  See cascade_profiles
+        if profile not in cascade_profiles:
+            self.logger.warning(f'Unknown query profile {profile}.  Using {self.cascade_profile}')
+            return
+        self.cascade_profile = profile
+        self.cascade_policy = cascade_profiles[profile]
+        self.query_cache.clear()
+
     def process_query(self, select_string, from_tbl: str, query_list: [Query]):
-        # Try each query in list until we find a match
+        # Try each query in list until we find a match.  Results are cached on everything that can change them
+        key = (select_string, from_tbl, tuple((query.where, tuple(query.args), query.result) for query in query_list),
+               self.lookup_wildcards, self.tier is not None, self.order_str, self.limit_str, self.cascade_profile)
+        try:
+            cached = self.query_cache.get(key)
+        except TypeError:
+            # Unhashable args
+            return self.run_query_list(select_string, from_tbl, query_list)
+        if cached is not None:
+            return list(cached[0]), cached[1]
+        row_list, res = self.run_query_list(select_string, from_tbl, query_list)
+        if row_list is not None:
+            self.query_cache.put(key, (tuple(row_list), res), row_list)
+        return row_list, res
+
+    def run_query_list(self, select_string, from_tbl: str, query_list: [Query]):
+        """
+        Try each query in list until the cascade policy says to stop.  Rows from each stage are added together
+        :return: (rows, result code of the stage that stopped the cascade or NO_MATCH)
+        """
+        policy = self.cascade_policy
         row_list = None
         result = None
         res = Result.NO_MATCH
         for query in query_list:
-            # During shutdown, wildcards are turned off since there is no UI to verify results
-            if self.use_wildcards == False and (query.result == Result.WILDCARD_MATCH or query.result == Result.SOUNDEX_MATCH):
-                continue
+            stage = (from_tbl, query.where, query.result)
+            if query.result == Result.WILDCARD_MATCH or query.result == Result.SOUNDEX_MATCH:
+                # During shutdown, wildcards are turned off since there is no UI to verify results
+                if not self.lookup_wildcards or policy.fallback == 'never' or (policy.fallback == 'if_empty' and row_list):
+                    self.query_stats.add_skip(stage)
+                    continue
             start = time.time()
             if query.result == Result.WILDCARD_MATCH:
                 result = self.word_match(select_string, query.where, from_tbl,
@@ -231,9 +540,10 @@ class DB:
             if elapsed > 5:
                 self.logger.debug(f'[{elapsed:.4f}] [{self.total_time:.1f}] len {len(row_list)} from {from_tbl} '
                                   f'where {query.where} val={query.args} ')
-            if len(row_list) > 6:
+            stop = len(row_list) >= policy.min_rows or (len(result) > 0 and query.result in policy.stop_on)
+            self.query_stats.add(stage, len(result), elapsed, stop)
+            if stop:
                 res = query.result  # Set specified success code
-                # self.logger.debug(row_list)
                 # Found match.  Break out of loop
                 break
         return row_list, res
@@ -262,43 +572,71 @@ class DB:
 
         The order of the words will also not matter, so results should contain
         "City of Bay Village", "Bay Village" etc.
+
+        Each word is a LIKE '%word%' query with the rest of the where clause and the row limit, so the limit is
+        per word and applies after the country and feature terms.  With the name_trigram index, words of 3 or more
+        characters are found through the index (see use_trigram_index).  Matches are the same as without it
         """
         words = args[0].split()
-        results = []    # the entire merged list of result rows
-        res_flags = []  # list of flags, matching results list, 'True' to keep
+        results = {}    # geoid to [row, flag].  Flag is True to keep
         for word in words:
             # redo tuple for each word; select_string still has LIKE
             n_args = (f'%{word.strip()}%', *args[1:])
             result = self.select(select_string, where, from_tbl, n_args)
             for row in result:
-                # check if already in overall list
-                for indx, r_row in enumerate(results):
-                    if row[Entry.ID] == r_row[Entry.ID]:
-                        # if has same ID as in overall list, mark to keep
-                        res_flags[indx] = True
-                        break
-                else:  # this result row did not match anything
-                    results.append(row)  # add it to overall list
+                item = results.get(row[Entry.ID])
+                if item:
+                    # if has same ID as in overall list, mark to keep
+                    item[1] = True
+                else:
                     # if reasonable number of results for this word, flag to
                     # keep the result
-                    res_flags.append(len(result) < 20)
+                    results[row[Entry.ID]] = [row, len(result) < 20]
         # strip out any results not flagged (too many to be interesting)
-        result = [results[indx] for indx in range(len(results)) if
-                  res_flags[indx]]
-        return result
+        return [row for row, keep in results.values() if keep]
 
     def set_speed_pragmas(self):
         # Set DB pragmas for speed.  These can lead to corruption!   -900
+        if self.read_only:
+            # Read only connections are set up in connect().  Exclusive locking would block other readers
+            return
         self.logger.info('Database pragmas set for speed')
-        for txt in ['PRAGMA temp_store = memory',
+        for txt in [f'PRAGMA cache_size = -{self.query_cache_kb}',
+                    'PRAGMA temp_store = memory',
                     'PRAGMA journal_mode = off',
                     'PRAGMA locking_mode = exclusive',
                     'PRAGMA synchronous = 0']:
             self.set_pragma(txt)
 
+    def release_lock(self):
+        # Switch from exclusive locking (see set_speed_pragmas) so other connections can read the DB.  SQLite releases
+        # the lock at the next read
+        self.set_pragma('PRAGMA locking_mode = normal')
+        self.conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchall()
+
+    def set_build_pragmas(self):
+        # Set DB pragmas for a bulk load - large page cache
+        self.logger.info('Database pragmas set for build')
+        self.set_pragma(f'PRAGMA cache_size = -{self.build_cache_kb}')
+
+    def set_query_pragmas(self):
+        # Switch back from build pragmas to normal query settings
+        self.logger.info('Database pragmas set for query')
+        self.set_pragma(f'PRAGMA cache_size = -{self.query_cache_kb}')
+
     def set_analyze_pragma(self):
         # Set DB pragmas for speed.  These can lead to corruption!   -900
         self.logger.info(' Database Analyze pragma')
         for txt in ['PRAGMA optimize',
                     ]:
             self.set_pragma(txt)
+
+
+def get_tokens(text) -> []:
+    # Split text into words the way the FTS unicode61 tokenizer does
+    return re.findall(r'[^\W_]+', text.lower())
+
+
+def get_fts_phrase(tokens) -> str:
+    # FTS query phrase that matches the tokens with a prefix match on the last token
+    return '"' + ' '.join(tokens) + '"*'
@@ -19,6 +19,8 @@
 import logging
 import os
 
+from geofinder import Prefilter
+
 
 class FileReader:
     """
@@ -32,6 +34,10 @@ class FileReader:
         self.fname: str = filename
         self.cache_changed = False
         self.count = 0
+        # Optional compiled bytes pattern.  If set, only lines that match are decoded and passed to handle_line
+        self.prefilter = None
+        # File position to start reading at (prefiltered read only)
+        self.start_pos = 0
 
     def read(self) -> bool:
         """
@@ -45,6 +51,8 @@ class FileReader:
         self.logger.info(f"Reading file {path}")
         if os.path.exists(path):
             fsize = os.path.getsize(path)
+            if self.prefilter is not None:
+                return self.read_prefiltered(path, fsize)
             with open(path, 'r', newline="", encoding='utf-8', errors='replace') as file:
                 for row in file:
                     if self.progress_bar is not None:
@@ -67,6 +75,30 @@ class FileReader:
             self.logger.error(f'Unable to open {path}')
             return True
 
+    def read_prefiltered(self, path, fsize) -> bool:
+        # Read file through Prefilter.  Lines that don't match self.prefilter are skipped without being decoded
+        for file_pos, line_count, lines in Prefilter.scan_file(path, self.prefilter, start=self.start_pos):
+            for line_num, row in lines:
+                self.handle_line(line_num, row)
+            prog = file_pos * 100 / fsize
+            self.progress(f"2) Loading {self.fname} {prog:.0f}%", prog)
+
+            cancelled = self.progress_bar is not None and self.progress_bar.shutdown_requested
+            self.chunk_done(file_pos, cancelled)
+            if cancelled:
+                # User requested cancel
+                self.cancel()
+                return False
+
+        self.cache_changed = True
+        self.progress("", 100)
+        self.logger.info(f'Added {self.count} items')
+        return False
+
+    def chunk_done(self, file_pos: int, cancelled: bool):
+        # Called by read_prefiltered after each chunk.  file_pos is where the next chunk starts
+        pass
+
     def cancel(self):
         # User requested cancel of file read
         pass
@@ -89,6 +89,41 @@ class Gedcom(AncestryFile):
 
         return self.id
 
+    def get_coord(self):
+        """
+        Return (lat, lon) from the MAP LATI LONG entry in the substructure of the current PLAC line, or None.
+        MAP can follow other PLAC subordinate lines (FORM, SOUR, NOTE, etc).  Doesn't move forward in file
+        """
+        if self.infile is None:
+            return None
+        pos = self.infile.tell()
+        coord = {}
+        in_map = False
+        while True:
+            matches = re.match(r"^\s*(\d+)\s+(\S+)\s*(.*)", self.infile.readline())
+            if matches is None or int(matches.group(1)) <= self.level:
+                # End of file or end of PLAC substructure
+                break
+            level = int(matches.group(1))
+            if level == self.level + 1:
+                if in_map:
+                    break
+                in_map = matches.group(2) == 'MAP'
+            elif in_map and level == self.level + 2 and matches.group(2) in ('LATI', 'LONG'):
+                val = re.match(r"([NSEW]?)([-+]?[0-9.]+)", matches.group(3))
+                if val is None:
+                    continue
+                try:
+                    num = float(val.group(2))
+                except ValueError:
+                    continue
+                # GEDCOM 5.5 style is N18.150944 / W168.150944
+                coord[matches.group(2)] = -num if val.group(1) in ('S', 'W') else num
+        self.infile.seek(pos)  # Back up to where we were
+        if 'LATI' in coord and 'LONG' in coord:
+            return coord['LATI'], coord['LONG']
+        return None
+
     def write_updated(self, txt: str, place):
         """ Write out a place line with updated value.  Put together the pieces:  level, Label, tag, value """
         if self.outfile is not None:
@@ -16,35 +16,90 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program; if not, write to the Free Software
 #   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+import json
 import logging
+import math
 import os
 import re
+import sqlite3
 import sys
 import time
-from tkinter import messagebox
+import uuid
+from operator import itemgetter
 
-from geofinder import DB, Loc, GeoKeys, MatchScore, Country
+from geofinder import DB, Loc, GeoKeys, MatchScore, Country, Geodata
 from geofinder.GeoKeys import Query, Result, Entry, get_soundex
 
+# Geoname entries are stored in clustered tables with integer codes for country and feature.  Queries use the
+# geodata and admin views, which decode the codes.  Writes go to the base tables (see encode_row)
+base_table = {'geodata': 'geodata_tbl', 'admin': 'admin_tbl'}
+insert_sql = {tbl: f''' INSERT INTO {base}(id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx, priority)
+                      VALUES(?,?,?,?,?,?,?,?,?,?,?) ''' for tbl, base in base_table.items()}
+# Rows of the build_id table.  geonames is the ID of the current geonames data.  The others are the geonames
+# build ID a derived table was built from
+build_id_rows = {'geonames': 1, 'titles': 2, 'name_fts': 3, 'name_trigram': 4, 'place_rtree': 5}
+# Derived tables and the table that shows each one exists.  Country changes update these in place.  See delete_country
+derived_tables = {'titles': 'place_title', 'name_fts': 'name_fts', 'name_trigram': 'name_trigram',
+                  'place_rtree': 'admin_rtree'}
+# Full text indices of geodata and admin names.  One row per distinct name.  See build_name_index()
+name_index_tokenizer = {'name_fts': 'unicode61 remove_diacritics 0', 'name_trigram': 'trigram'}
+
+
+def rank_priority(feature: str, pop) -> int:
+    # Priority column of an entry.  Lowest is best.  Feature priority (see Geodata.feature_priority), then larger population
+    return int(Geodata.Geodata.get_priority(feature)) * 1000 - int(100 * math.log10(1 + max(int(pop or 0), 0)))
+
 
 class GeoDB:
     """
     geoname data database.  Add items, look up items, create tables, indices
     """
 
-    def __init__(self, db_path, version):
+    def __init__(self, db_path, version, read_only=False, storage='disk'):
+        """
+        Open or create geoname DB
+        :param read_only: Open an existing DB read only.  Lookups can then run from several threads (see DB.conn).
+        Derived tables are not built, so titles and indices are only used if they are current
+        :param storage: Storage profile: disk, mmap or memory.  See DB.storage_profiles
+        """
         self.logger = logging.getLogger(__name__)
         self.start = 0
         self.match = MatchScore.MatchScore()
 
         self.db_path = db_path
+        self.page_size = 8192
+
+        # Bulk load support.  See begin_bulk_load()
+        self.bulk_mode = False
+        self.bulk_sort = True
+        self.bulk_batch_size = 100000
+        self.bulk_rows = {}
+
+        # Country ISO and feature codes are stored as integer codes.  Dictionary of value to code for each code table
+        self.codes = {'country_code': {}, 'feature_code': {}}
+
+        # Admin names and IDs for the lookups done for every place and every result row.  See get_admin_maps()
+        self.admin_maps = None
+
+        # True when the place_title table is current.  See update_titles()
+        self.titles_current = False
+
+        # True when the geodata_rtree and admin_rtree spatial indices are current.  See update_rtree()
+        self.rtree_current = False
+
+        # In memory tier of admin and large places.  Lookups try it before the full DB.  See HotTier.py
+        self.hot_tier = None
+
         # See if DB exists
         if os.path.exists(db_path):
             db_exists = True
         else:
             db_exists = False
 
-        self.db = DB.DB(db_path)
+        if read_only and not db_exists:
+            self.logger.error(f"Error! cannot open database {db_path} read only.  Not found")
+            raise ValueError('Cannot open database')
+        self.db = DB.DB(db_path, read_only=read_only, storage=storage)
         if self.db.err:
             self.logger.error(f"Error! cannot open database {db_path}.")
             raise ValueError('Cannot open database')
@@ -56,23 +111,25 @@ class GeoDB:
 
             if res:
                 self.logger.warning(f'DB error for {db_path}')
-                if messagebox.askyesno('Error',
-                                       f'Geoname database is empty or corrupt:\n\n {db_path} \n\nDo you want to delete it and rebuild?'):
-                    messagebox.showinfo('', 'Deleting Geoname database')
+                if not GeoKeys.gui_enabled:
+                    # No one to ask.  Leave the file for the user and let the caller report the error
+                    raise ValueError('Geoname database is empty or corrupt')
+                if GeoKeys.show_message('askyesno', 'Error',
+                                        f'Geoname database is empty or corrupt:\n\n {db_path} \n\nDo you want to delete it and rebuild?'):
+                    GeoKeys.show_message('showinfo', '', 'Deleting Geoname database')
                     self.db.conn.close()
                     os.remove(db_path)
                 sys.exit()
         else:
-            # DB didnt exist.  Create tables.
+            # DB didnt exist.  Set page size (only possible before tables are created) and create tables.
+            self.db.set_pragma(f'PRAGMA page_size = {self.page_size}')
             self.create_tables()
             if version:
                 self.insert_version(version)
 
         self.db.set_speed_pragmas()
         self.db.set_params(order_str='', limit_str='LIMIT 105')
-        self.geoid_main_dict = {}  # Key is GEOID, Value is DB ID for entry
-        self.geoid_admin_dict = {}  # Key is GEOID, Value is DB ID for entry
-        self.place_type = ''
+        self.read_codes()
 
     def delete_dbZZZ(self):
         self.logger.info('Deleting geoname DB')
@@ -83,7 +140,6 @@ class GeoDB:
         The dictionary geo_result entry contains: Lat, Long, districtID (County or State or Province ID)
         There can be multiple entries if a city name isnt unique in a country
         """
-        result_place: Loc = Loc.Loc()
         self.start = time.time()
         place.result_type = Result.STRONG_MATCH
         #place.admin2_name, modified = GeoKeys.admin2_normalize(place.admin2_name, place.country_iso)
@@ -115,9 +171,23 @@ class GeoDB:
 
         # nm = place.original_entry
         # self.logger.debug(f'Search results for {place.target} pref[{place.prefix}]')
+        min_score = self.assign_scores(place)
+
+        if place.result_type == Result.STRONG_MATCH and len(place.prefix) > 0:
+            place.result_type = Result.PARTIAL_MATCH
+
+        if place.result_type == Result.STRONG_MATCH and min_score > 10:
+            place.result_type = Result.PARTIAL_MATCH
+
+    def assign_scores(self, place: Loc.Loc) -> float:
+        """
+        Add search quality score to each row in place.georow_list
+        :return: Lowest score
+        """
+        result_place: Loc = Loc.Loc()
         min_score = 9999
 
-        # Add search quality score to each entry
+        titles = self.get_titles(place.georow_list)
         for idx, rw in enumerate(place.georow_list):
             self.copy_georow_to_place(row=rw, place=result_place)
 
@@ -127,7 +197,8 @@ class GeoDB:
             else:
                 result_place.prefix = ''
 
-            score = self.match.match_score(inp_place=place, res_place=result_place)
+            score = self.match.match_score(inp_place=place, res_place=result_place,
+                                           res_title=titles[(rw[Entry.ID], rw[Entry.NAME])][1])
             if score < min_score:
                 min_score = score
 
@@ -142,12 +213,7 @@ class GeoDB:
             if place.place_type != Loc.PlaceType.ADVANCED_SEARCH:
                 for item in tk_list:
                     place.prefix = re.sub(item.strip(' ').lower(), '', place.prefix)
-
-        if place.result_type == Result.STRONG_MATCH and len(place.prefix) > 0:
-            place.result_type = Result.PARTIAL_MATCH
-
-        if place.result_type == Result.STRONG_MATCH and min_score > 10:
-            place.result_type = Result.PARTIAL_MATCH
+        return min_score
 
     def select_city(self, place: Loc):
         """
@@ -330,6 +396,11 @@ class GeoDB:
         if len(lookup_target) == 0:
             return
 
+        admin1_id = self.get_admin_maps()['admin1_id'].get((lookup_target, place.country_iso))
+        if admin1_id is not None:
+            place.admin1_id = admin1_id
+            return
+
         # Try each query until we find a match - each query gets less exact
         query_list = [
             Query(where="name = ? AND country = ? AND f_code = ? ",
@@ -356,6 +427,14 @@ class GeoDB:
         if len(lookup_target) == 0:
             return
 
+        if len(place.admin1_id) > 0:
+            admin2_id = self.get_admin_maps()['admin2_id'].get((lookup_target, place.country_iso, place.admin1_id))
+        else:
+            admin2_id = self.get_admin_maps()['admin2_id_iso'].get((lookup_target, place.country_iso))
+        if admin2_id is not None:
+            place.admin2_id = admin2_id
+            return
+
         # Try each query until we find a match - each query gets less exact
         query_list = []
         if len(place.admin1_id) > 0:
@@ -412,17 +491,9 @@ class GeoDB:
         if len(lookup_target) == 0:
             return ''
 
-        # Try each query until we find a match - each query gets less exact
-        query_list = [
-            Query(where="admin1_id = ? AND country = ?  AND f_code = ? ",
-                  args=(lookup_target, place.country_iso, 'ADM1'),
-                  result=Result.STRONG_MATCH)
-        ]
-        row_list, res = self.db.process_query_list(from_tbl='main.admin', query_list=query_list)
-
-        if len(row_list) > 0:
-            row = row_list[0]
-            place.admin1_name = row[Entry.NAME]
+        name = self.get_admin_maps()['admin1_name'].get((place.country_iso, lookup_target))
+        if name is not None:
+            place.admin1_name = name
             return place.admin1_name
         else:
             return ''
@@ -432,19 +503,7 @@ class GeoDB:
         if len(lookup_target) == 0:
             return ''
 
-        # Try each query until we find a match - each query gets less exact
-        query_list = [
-            Query(where="admin1_id = ? AND country = ?  AND f_code = ? ",
-                  args=(lookup_target, iso, 'ADM1'),
-                  result=Result.STRONG_MATCH)
-        ]
-        row_list, res = self.db.process_query_list(from_tbl='main.admin', query_list=query_list)
-
-        if len(row_list) > 0:
-            row = row_list[0]
-            return row[Entry.NAME]
-        else:
-            return ''
+        return self.get_admin_maps()['admin1_name'].get((iso, lookup_target), '')
 
     def get_admin2_name_direct(self, admin1_id, admin2_id, iso) -> str:
         """Search for Admin2 entry"""
@@ -452,22 +511,12 @@ class GeoDB:
         if len(lookup_target) == 0:
             return ''
 
-        # Try each query until we find a match - each query gets less exact
-        query_list = [
-            Query(where="admin2_id = ? AND country = ? AND admin1_id = ?",
-                  args=(lookup_target, iso, admin1_id),
-                  result=Result.STRONG_MATCH),
-            Query(where="admin2_id = ? AND country = ?",
-                  args=(lookup_target, iso),
-                  result=Result.PARTIAL_MATCH)]
-
-        row_list, res = self.db.process_query_list(from_tbl='main.admin', query_list=query_list)
-
-        if len(row_list) > 0:
-            row = row_list[0]
-            return row[Entry.NAME]
-        else:
-            return ''
+        # Try with admin1 and then without
+        maps = self.get_admin_maps()
+        name = maps['admin2_name'].get((iso, admin1_id, lookup_target))
+        if name is None:
+            name = maps['admin2_name_iso'].get((iso, lookup_target), '')
+        return name
 
     def get_admin2_name(self, place: Loc) -> str:
         """Search for Admin1 entry"""
@@ -475,20 +524,9 @@ class GeoDB:
         if len(lookup_target) == 0:
             return ''
 
-        # Try each query until we find a match - each query gets less exact
-        query_list = [
-            Query(where="admin2_id = ? AND country = ? AND admin1_id = ?",
-                  args=(lookup_target, place.country_iso, place.admin1_id),
-                  result=Result.STRONG_MATCH),
-            Query(where="admin2_id = ? AND country = ?",
-                  args=(lookup_target, place.country_iso),
-                  result=Result.PARTIAL_MATCH)]
-
-        row_list, res = self.db.process_query_list(from_tbl='main.admin', query_list=query_list)
-
-        if len(row_list) > 0:
-            row = row_list[0]
-            place.admin2_name = row[Entry.NAME]
+        name = self.get_admin2_name_direct(place.admin1_id, lookup_target, place.country_iso)
+        if name != '':
+            place.admin2_name = name
             # self.logger.debug(f'adm2 nm = {place.admin2_name}')
             return place.admin2_name
         else:
@@ -496,8 +534,6 @@ class GeoDB:
 
     def lookup_geoid(self, place: Loc) -> None:
         """Search for GEOID"""
-        result_place: Loc = Loc.Loc()
-
         query_list = [
             Query(where="geoid = ? ",
                   args=(place.target,),
@@ -511,12 +547,11 @@ class GeoDB:
             place.result_type = GeoKeys.Result.STRONG_MATCH
 
         # Add search quality score to each entry
+        titles = self.get_titles(place.georow_list)
         for idx, rw in enumerate(place.georow_list):
-            self.copy_georow_to_place(row=rw, place=result_place)
             update = list(rw)
             update.append(1)  # Extend list row and assign score
-            result_place.prefix = ''
-            res_nm = result_place.format_full_nm(None)
+            res_nm = titles[(rw[Entry.ID], rw[Entry.NAME])][0]
             score = 0.0
 
             # Remove items in prefix that are in result
@@ -550,16 +585,8 @@ class GeoDB:
         if len(iso) == 0:
             return ''
 
-        # Try each query until we find a match - each query gets less exact
-        query_list = [
-            Query(where="country = ? AND f_code = ? ",
-                  args=(iso, 'ADM0'),
-                  result=Result.STRONG_MATCH)]
-
-        row_list, res = self.db.process_query_list(from_tbl='main.admin', query_list=query_list)
-
-        if len(row_list) > 0:
-            res = row_list[0][Entry.NAME]
+        res = self.get_admin_maps()['country_name'].get(iso)
+        if res is not None:
             if iso == 'us':
                 res = 'United States'
         else:
@@ -572,25 +599,12 @@ class GeoDB:
         if len(lookup_target) == 0:
             return ''
 
-        # Try each query until we find a match - each query gets less exact
-        query_list = [
-            Query(where="name = ? AND f_code = ? ",
-                  args=(lookup_target, 'ADM0'),
-                  result=Result.STRONG_MATCH),
-            # Query(where="name LIKE ?  AND f_code = ? ",
-            #      args=(self.create_wildcard(lookup_target), 'ADM0'),
-            #      result=Result.PARTIAL_MATCH)  #,
-            # Query(where="sdx = ?  AND f_code = ? ",
-            #      args=(GeoKeys.get_soundex (lookup_target), 'ADM0'),
-            #      result=Result.PARTIAL_MATCH)
-        ]
+        iso_list = self.get_admin_maps()['country_iso'].get(lookup_target, [])
 
-        row_list, result_code = self.db.process_query_list(from_tbl='main.admin', query_list=query_list)
-
-        if len(row_list) > 0:
-            res = row_list[0][Entry.ISO]
-            if len(row_list) == 1:
-                place.country_name = row_list[0][Entry.NAME]
+        if len(iso_list) > 0:
+            res = iso_list[0]
+            if len(iso_list) == 1:
+                place.country_name = lookup_target
         else:
             res = ''
 
@@ -609,14 +623,22 @@ class GeoDB:
         self.logger.debug(f'Advanced Search. Targ=[{pattern}] feature=[{feature_pattern}]'
                           f'  iso=[{place.country_iso}] ')
 
+        tokens = DB.get_tokens(lookup_target)
+        if self.db.name_index and '*' not in lookup_target and len(tokens) > 0:
+            # Names with the target words, the last word as a prefix.  See update_name_index()
+            name_where = 'name IN (SELECT name FROM name_fts WHERE name_fts MATCH ?)'
+            pattern = DB.get_fts_phrase(tokens)
+        else:
+            name_where = 'name LIKE ?'
+
         if len(place.feature) > 0:
             query_list = [
-                Query(where="name LIKE ? AND country LIKE ? AND f_code LIKE ?",
+                Query(where=f"{name_where} AND country LIKE ? AND f_code LIKE ?",
                       args=(pattern, place.country_iso, feature_pattern),
                       result=Result.PARTIAL_MATCH)]
         else:
             query_list = [
-                Query(where="name LIKE ? AND country LIKE ?",
+                Query(where=f"{name_where} AND country LIKE ?",
                       args=(pattern, place.country_iso),
                       result=Result.PARTIAL_MATCH)]
 
@@ -644,21 +666,19 @@ class GeoDB:
         place.feature = str(row[Entry.FEAT])
         place.geoid = str(row[Entry.ID])
 
+        # place.place_type is left as parsing set it.  GeoDB is shared by lookups on several threads so
+        # nothing per place is kept on self
         if place.feature == 'ADM0':
-            self.place_type = Loc.PlaceType.COUNTRY
             pass
         elif place.feature == 'ADM1':
             place.admin1_id = row[Entry.ADM1]
-            self.place_type = Loc.PlaceType.ADMIN1
         elif place.feature == 'ADM2':
             place.admin1_id = row[Entry.ADM1]
             place.admin2_id = row[Entry.ADM2]
-            self.place_type = Loc.PlaceType.ADMIN2
         else:
             place.admin1_id = row[Entry.ADM1]
             place.admin2_id = row[Entry.ADM2]
             place.city1 = row[Entry.NAME]
-            self.place_type = Loc.PlaceType.CITY
 
         place.admin1_name = str(self.get_admin1_name(place))
         place.admin2_name = str(self.get_admin2_name(place))
@@ -673,29 +693,29 @@ class GeoDB:
 
     def clear_geoname_data(self):
         # Delete all the geoname data
+        for rows in self.bulk_rows.values():
+            rows.clear()
         for tbl in ['geodata', 'admin']:
             # noinspection SqlWithoutWhere
-            self.db.delete_table(tbl)
+            self.db.delete_table(base_table[tbl])
 
     # Streams_nocase_idx ON Streams(Name 
 
     def create_geoid_index(self):
         # Create indices
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS geoid_idx ON geodata(geoid )')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS admgeoid_idx ON admin(geoid  )')
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS geoid_idx ON geodata_tbl(geoid )')
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS admgeoid_idx ON admin_tbl(geoid  )')
         self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS altnamegeoid_idx ON altname(geoid  )')
 
     def create_indices(self):
-        # Create indices
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS name_idx ON geodata(name, country )')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS admin1_idx ON geodata(admin1_id )')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS sdx_idx ON geodata(sdx )')
+        # Create indices.  Name lookups use the table primary key (name, country, id).
+        # Admin indices end in id so rows for an admin ID come back in insertion order (see flush_bulk)
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS sdx_idx ON geodata_tbl(sdx )')
 
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_name_idx ON admin(name, country )')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_admin1_idx ON admin(admin1_id, f_code)')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_admin2_idx ON admin(admin1_id, admin2_id)')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_country_idx ON admin(country, f_code)')
-        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_sdx_idx ON admin(sdx )')
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_admin1_idx ON admin_tbl(admin1_id, f_code, id)')
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_admin2_idx ON admin_tbl(country, admin2_id, id)')
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_country_idx ON admin_tbl(country, f_code, id)')
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS adm_sdx_idx ON admin_tbl(sdx, id)')
 
     @staticmethod
     def make_georow(name: str, iso: str, adm1: str, adm2: str, lat: float, lon: float, feat: str, geoid: str, sdx: str) -> ():
@@ -704,8 +724,23 @@ class GeoDB:
         return res
 
     def get_row_count(self) -> int:
+        if self.db.snapshot is not None:
+            return self.db.snapshot.get_row_count()
         return self.db.get_row_count()
 
+    def set_snapshot(self, snapshot):
+        # Serve name, soundex and geoid queries from a Snapshot (None to use only SQLite).  See Snapshot.py
+        if self.db.snapshot is not None and self.db.snapshot is not snapshot:
+            self.db.snapshot.close()
+        self.db.snapshot = snapshot
+
+    def set_hot_tier(self, hot_tier):
+        # Tier for tiered lookups (None to turn tiered lookup off).  See HotTier.py
+        if self.hot_tier is not None and self.hot_tier is not hot_tier:
+            self.logger.info(self.hot_tier.get_stats())
+        self.db.tier = None
+        self.hot_tier = hot_tier
+
     @staticmethod
     def create_wildcard(pattern):
         # Create SQL wildcard pattern (convert * to %).  Add % on end
@@ -733,9 +768,15 @@ class GeoDB:
             return f'{pattern}'
 
     def close(self):
-        self.db.set_analyze_pragma()
+        self.logger.info(self.db.query_cache.get_stats())
+        self.logger.info(self.db.query_stats.get_stats())
+        self.logger.info(f'Storage {self.db.get_storage_stats()}')
+        self.set_hot_tier(None)
+        self.set_snapshot(None)
+        if not self.db.read_only:
+            self.db.set_analyze_pragma()
         self.logger.info('Closing Database')
-        self.db.conn.close()
+        self.db.close()
 
     def set_display_names(self, temp_place):
         place_lang = Country.Country.get_lang(temp_place.country_iso)
@@ -760,30 +801,697 @@ class GeoDB:
         else:
             return '', ''
 
-    def insert(self, geo_row: (), feat_code: str):
+    def insert(self, geo_row: (), feat_code: str, priority: int = None):
         # We split the data into 2  tables, 1) Admin: ADM0/ADM1/ADM2,  and 2) city data
+        # priority is from rank_priority().  Default is the priority for the row feature with no population
+        if priority is None:
+            priority = rank_priority(geo_row[Entry.FEAT], 0)
+        if self.bulk_mode:
+            # Gather row for bulk write.  Row ID is assigned when batch is written.  Priority follows the row
+            if feat_code == 'ADM1' or feat_code == 'ADM0' or feat_code == 'ADM2':
+                self.bulk_append('admin', (*geo_row, priority))
+            else:
+                self.bulk_append('geodata', (*geo_row, priority))
+            return None
+
         if feat_code == 'ADM1' or feat_code == 'ADM0' or feat_code == 'ADM2':
-            sql = ''' INSERT OR IGNORE INTO admin(name,country, admin1_id,admin2_id,lat,lon,f_code, geoid, sdx)
-                      VALUES(?,?,?,?,?,?,?,?,?) '''
-            row_id = self.db.execute(sql, geo_row)
-            # Add name to dictionary.  Used by AlternateNames for fast lookup during DB build
-            self.geoid_admin_dict[geo_row[Entry.ID]] = row_id
+            tbl = 'admin'
         else:
-            sql = ''' INSERT OR IGNORE INTO geodata(name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx)
-                      VALUES(?,?,?,?,?,?,?,?,?) '''
-            row_id = self.db.execute(sql, geo_row)
-            # Add name to dictionary.  Used by AlternateNames for fast lookup during DB build
-            self.geoid_main_dict[geo_row[Entry.ID]] = row_id
-
+            tbl = 'geodata'
+        row_id = self.get_next_id(tbl)
+        self.db.execute(insert_sql[tbl], self.encode_row(row_id, geo_row, priority))
+        self.set_next_id(tbl, row_id + 1)
         return row_id
 
     def insert_alternate_name(self, alternate_name: str, geoid: str, lang: str):
         # We split the data into 2  tables, 1) Admin: ADM0/ADM1/ADM2,  and 2) city data
         row = (alternate_name, lang, geoid)
+        if self.bulk_mode:
+            self.bulk_append('altname', row)
+            return
         sql = ''' INSERT OR IGNORE INTO altname(name,lang, geoid)
                   VALUES(?,?,?) '''
         row_id = self.db.execute(sql, row)
 
+    def begin_bulk_load(self, sort_rows=True):
+        """
+        Start a bulk load.  Rows from insert() and insert_alternate_name() are gathered and written in large
+        executemany batches instead of one row at a time.
+        Build pragmas are set until end_bulk_load()
+        :param sort_rows: Sort each geodata batch by (name, country) so index build gets rows in index order
+        """
+        self.bulk_mode = True
+        self.bulk_sort = sort_rows
+        for tbl in ['geodata', 'admin', 'altname', 'altid']:
+            self.bulk_rows[tbl] = []
+        self.db.set_build_pragmas()
+
+    def end_bulk_load(self):
+        # Write out remaining rows and switch back to query pragmas
+        self.flush_bulk()
+        self.bulk_mode = False
+        self.db.set_query_pragmas()
+
+    def bulk_append(self, tbl, row):
+        self.bulk_rows[tbl].append(tuple(row))
+        if len(self.bulk_rows[tbl]) >= self.bulk_batch_size:
+            self.flush_bulk()
+
+    def flush_bulk(self):
+        # Write all gathered bulk rows to DB.  Uses the current transaction if there is one
+        if not self.bulk_mode:
+            return
+        own_transaction = not self.db.conn.in_transaction
+        if own_transaction:
+            self.db.begin()
+
+        for tbl in ['admin', 'geodata']:
+            rows = self.bulk_rows[tbl]
+            if len(rows) == 0:
+                continue
+            if self.bulk_sort and tbl == 'geodata':
+                # Admin rows keep insertion order - the first admin row found is used as the name for an admin ID
+                # (e.g. US state name before its abbreviation).  Sort is stable so equal names keep their order
+                rows.sort(key=itemgetter(Entry.NAME, Entry.ISO))
+            next_id = self.get_next_id(tbl)
+            self.db.executemany(insert_sql[tbl], [self.encode_row(next_id + idx, row, row[-1]) for idx, row in enumerate(rows)])
+            self.set_next_id(tbl, next_id + len(rows))
+            rows.clear()
+
+        for tbl, sql in [('altname', ''' INSERT OR IGNORE INTO altname(name,lang, geoid)
+                      VALUES(?,?,?) '''),
+                         ('altid', ''' INSERT OR REPLACE INTO altid(id, geoid, name, lang)
+                      VALUES(?,?,?,?) ''')]:
+            rows = self.bulk_rows[tbl]
+            if len(rows) > 0:
+                self.db.executemany(sql, rows)
+                rows.clear()
+
+        if own_transaction:
+            self.db.commit()
+
+    def encode_row(self, row_id: int, geo_row, priority: int) -> ():
+        # Convert geo_row to a base table row: DB ID first, integer codes for country and feature, and priority last
+        return (row_id, geo_row[Entry.NAME], self.get_code('country_code', geo_row[Entry.ISO]), geo_row[Entry.ADM1],
+                geo_row[Entry.ADM2], geo_row[Entry.LAT], geo_row[Entry.LON],
+                self.get_code('feature_code', geo_row[Entry.FEAT]), geo_row[Entry.ID], geo_row[Entry.SDX], priority)
+
+    def get_next_id(self, tbl) -> int:
+        # Next DB ID for geodata or admin table
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT id FROM next_id WHERE tbl = ?', (tbl,))
+        res = cur.fetchall()
+        if len(res) == 0:
+            return 1
+        return res[0][0]
+
+    def set_next_id(self, tbl, next_id: int):
+        self.db.conn.execute('INSERT OR REPLACE INTO next_id(tbl, id) VALUES(?,?)', (tbl, next_id))
+
+    def get_code(self, tbl, value) -> int:
+        # Return integer code for a country ISO (country_code table) or feature (feature_code table).  Adds new values
+        codes = self.codes[tbl]
+        code = codes.get(value)
+        if code is None:
+            code = len(codes) + 1
+            self.db.conn.execute(f'INSERT INTO {tbl}(code, name) VALUES(?,?)', (code, value))
+            codes[value] = code
+        return code
+
+    def read_codes(self):
+        # Load country and feature code dictionaries
+        for tbl, codes in self.codes.items():
+            codes.clear()
+            if self.db.table_exists(tbl):
+                cur = self.db.conn.cursor()
+                cur.execute(f'SELECT name, code FROM {tbl}')
+                for name, code in cur.fetchall():
+                    codes[name] = code
+
+    def get_row_titles(self, row, place=None) -> (str, str):
+        """
+        Build the titles for a DB row
+        :param place: Loc to use as work area.  Default is a new Loc
+        :return: (display title, match title).  Display title is format_full_nm without output replacements.
+        Match title is the normalized five part title MatchScore uses for the result
+        """
+        if place is None:
+            place = Loc.Loc()
+        self.copy_georow_to_place(row=row, place=place)
+        place.prefix = ''
+        title = place.format_full_nm(None)
+        place.prefix = ' '
+        match_title = GeoKeys.normalize_match_title(place.get_five_part_title(), place.country_iso)
+        return title, match_title
+
+    def get_titles(self, rows) -> {}:
+        """
+        Get titles for DB rows from the place_title table.  Titles that aren't in the table are built
+        :return: Dictionary of (geoid, name) to (display title, match title)
+        """
+        res = {}
+        if self.titles_current:
+            geoids = list({row[Entry.ID] for row in rows})
+            cur = self.db.conn.cursor()
+            for start in range(0, len(geoids), 500):
+                chunk = geoids[start:start + 500]
+                cur.execute(f'SELECT geoid, name, title, match_title FROM place_title WHERE geoid IN ({",".join("?" * len(chunk))})',
+                            chunk)
+                for geoid, name, title, match_title in cur:
+                    res[(geoid, name)] = (title, match_title)
+        for row in rows:
+            key = (row[Entry.ID], row[Entry.NAME])
+            if key not in res:
+                res[key] = self.get_row_titles(row)
+        return res
+
+    def update_titles(self):
+        """
+        Build the place_title table:  display title and match title for each geodata and admin row.
+        The table is rebuilt when the geonames data has changed since it was built
+        """
+        build_id = self.get_build_id()
+        if build_id != '' and self.get_build_id('titles') == build_id:
+            self.titles_current = True
+            return
+        self.titles_current = False
+        if self.db.read_only:
+            return
+
+        start_time = time.time()
+        self.db.begin()
+        # noinspection SqlWithoutWhere
+        self.db.execute('DELETE FROM place_title', ())
+        count = self.insert_titles('', ())
+        self.db.execute('INSERT OR REPLACE INTO build_id(id, build_id) VALUES(?, ?)', (build_id_rows['titles'], build_id))
+        self.db.commit()
+        self.titles_current = True
+        self.logger.info(f'Place titles done.  {count} rows.  Elapsed ={time.time() - start_time:.1f}')
+
+    def refresh_titles(self, geoids, areas=()):
+        """
+        Rebuild the place_title rows for geoids whose geodata or admin rows changed.  Requires a transaction
+        :param areas: Admin areas (see admin_area) of changed admin entries.  The title of each place in the area
+        includes the admin name, so they are all rebuilt
+        """
+        # Titles use the admin names in this transaction
+        self.admin_maps = None
+        geoids = list(geoids)
+        for start in range(0, len(geoids), 500):
+            chunk = geoids[start:start + 500]
+            in_list = ','.join('?' * len(chunk))
+            self.db.execute(f'DELETE FROM place_title WHERE geoid IN ({in_list})', chunk)
+            self.insert_titles(f'WHERE geoid IN ({in_list})', chunk)
+        for iso, col, admin_id in areas:
+            where = 'WHERE country = ?' if col is None else f'WHERE country = ? AND {col} = ?'
+            args = (iso,) if col is None else (iso, admin_id)
+            self.db.execute(f'DELETE FROM place_title WHERE geoid IN (SELECT geoid FROM geodata {where} '
+                            f'UNION SELECT geoid FROM admin {where})', args + args)
+            self.insert_titles(where, args)
+
+    @staticmethod
+    def admin_area(row):
+        # (country ISO, admin ID column, admin ID) of the places whose titles use an admin row's name.  None if not admin
+        if row[Entry.FEAT] == 'ADM0':
+            return row[Entry.ISO], None, None
+        elif row[Entry.FEAT] == 'ADM1':
+            return row[Entry.ISO], 'admin1_id', row[Entry.ADM1]
+        elif row[Entry.FEAT] == 'ADM2':
+            return row[Entry.ISO], 'admin2_id', row[Entry.ADM2]
+        return None
+
+    def insert_titles(self, where, args) -> int:
+        # Add place_title rows for the geodata and admin rows that match where.  Requires a transaction.  Returns count
+        place = Loc.Loc()
+        count = 0
+        cur = self.db.conn.cursor()
+        for tbl in ['admin', 'geodata']:
+            cur.execute(f'SELECT name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx FROM {tbl} {where}', args)
+            while True:
+                rows = cur.fetchmany(self.bulk_batch_size)
+                if len(rows) == 0:
+                    break
+                titles = []
+                for row in rows:
+                    title, match_title = self.get_row_titles(row, place)
+                    titles.append((row[Entry.ID], row[Entry.NAME], title, match_title))
+                self.db.executemany('INSERT OR IGNORE INTO place_title(geoid, name, title, match_title) VALUES(?,?,?,?)',
+                                    titles)
+                count += len(titles)
+        return count
+
+    def update_name_index(self):
+        """
+        Build the name_fts word index.  Used by advanced_search.  DB.word_match matches inside words, so it uses
+        the name_trigram index instead
+        """
+        self.db.name_index = self.build_name_index('name_fts')
+
+    def update_trigram_index(self, enabled: bool):
+        """
+        Build the name_trigram index.  DB.select uses it for name LIKE queries, so '*' patterns and infix searches
+        don't scan the name tables.  If not enabled, the index is removed
+        """
+        if enabled or self.db.read_only:
+            self.db.trigram_index = self.build_name_index('name_trigram')
+        else:
+            self.db.trigram_index = False
+            if self.db.table_exists('name_trigram'):
+                self.db.conn.execute('DROP TABLE name_trigram')
+                self.logger.info('Trigram index removed')
+
+    def build_name_index(self, tbl) -> bool:
+        """
+        Build a full text index of geodata and admin names.  Country and feature filters are applied through the
+        primary key of the name tables, so the index only holds each name once.
+        The index is rebuilt when the geonames data has changed since it was built
+        :param tbl: Index table.  See name_index_tokenizer
+        :return: True if index is available
+        """
+        build_id = self.get_build_id()
+        if build_id != '' and self.get_build_id(tbl) == build_id and self.db.table_exists(tbl):
+            return True
+        if self.db.read_only:
+            return False
+
+        start_time = time.time()
+        try:
+            self.db.conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {tbl} USING fts5(name, "
+                                 f"tokenize='{name_index_tokenizer[tbl]}')")
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5 or the tokenizer.  Searches use LIKE
+            self.logger.warning(f'Index {tbl} not available: {e}')
+            return False
+        self.db.begin()
+        # noinspection SqlWithoutWhere
+        self.db.execute(f'DELETE FROM {tbl}', ())
+        self.db.execute(f'INSERT INTO {tbl}(name) SELECT name FROM {base_table["geodata"]} '
+                        f'UNION SELECT name FROM {base_table["admin"]}', ())
+        self.db.execute(f"INSERT INTO {tbl}({tbl}) VALUES('optimize')", ())
+        self.db.execute('INSERT OR REPLACE INTO build_id(id, build_id) VALUES(?, ?)', (build_id_rows[tbl], build_id))
+        self.db.commit()
+        self.logger.info(f'Index {tbl} done.  Elapsed ={time.time() - start_time:.1f}')
+        return True
+
+    def update_rtree(self):
+        """
+        Build the geodata_rtree and admin_rtree spatial indices of lat/lon for reverse_lookup().
+        The indices are rebuilt when the geonames data has changed since they were built
+        """
+        build_id = self.get_build_id()
+        if build_id != '' and self.get_build_id('place_rtree') == build_id and self.db.table_exists('admin_rtree'):
+            self.rtree_current = True
+            return
+        self.rtree_current = False
+        if self.db.read_only:
+            return
+
+        start_time = time.time()
+        try:
+            for tbl in base_table:
+                self.db.conn.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {tbl}_rtree USING '
+                                     f'rtree(id, min_lat, max_lat, min_lon, max_lon, +geoid)')
+        except sqlite3.OperationalError as e:
+            # SQLite built without R*Tree
+            self.logger.warning(f'Spatial index not available: {e}')
+            return
+        self.db.begin()
+        for tbl, base in base_table.items():
+            # noinspection SqlWithoutWhere
+            self.db.execute(f'DELETE FROM {tbl}_rtree', ())
+            self.db.execute(f'INSERT INTO {tbl}_rtree(id, min_lat, max_lat, min_lon, max_lon, geoid) '
+                            f'SELECT id, lat, lat, lon, lon, geoid FROM {base} WHERE lat IS NOT NULL AND lon IS NOT NULL', ())
+        self.db.execute('INSERT OR REPLACE INTO build_id(id, build_id) VALUES(?, ?)', (build_id_rows['place_rtree'], build_id))
+        self.db.commit()
+        self.rtree_current = True
+        self.logger.info(f'Spatial index done.  Elapsed ={time.time() - start_time:.1f}')
+
+    def reverse_lookup(self, lat: float, lon: float, radius: float, features=None) -> []:
+        """
+        Find places near a coordinate
+        :param radius: Distance in km
+        :param features: List of feature codes to include.  None for all
+        :return: geodata and admin rows within radius, closest first
+        """
+        if not self.rtree_current:
+            return []
+        # Bounding box for radius.  Boxes aren't split at the 180 degree meridian
+        d_lat = math.degrees(radius / GeoKeys.EARTH_RADIUS_KM)
+        d_lon = d_lat / max(math.cos(math.radians(lat)), 0.01)
+        cur = self.db.conn.cursor()
+        result = []
+        for tbl in base_table:
+            cur.execute(f'SELECT geoid FROM {tbl}_rtree WHERE min_lat <= ? AND max_lat >= ? AND min_lon <= ? AND max_lon >= ?',
+                        (lat + d_lat, lat - d_lat, lon + d_lon, lon - d_lon))
+            geoids = [row[0] for row in cur.fetchall()]
+            if len(geoids) == 0:
+                continue
+            where = 'geoid IN (SELECT value FROM json_each(?))'
+            args = [json.dumps(geoids)]
+            if features is not None:
+                where += f' AND f_code IN ({",".join("?" * len(features))})'
+                args.extend(features)
+            cur.execute(f'SELECT name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx FROM {tbl} WHERE {where}',
+                        args)
+            for row in cur.fetchall():
+                distance = GeoKeys.get_distance(lat, lon, row[Entry.LAT], row[Entry.LON])
+                if distance <= radius:
+                    result.append((distance, row))
+        result.sort(key=itemgetter(0))
+        return [row for distance, row in result]
+
+    def get_admin_maps(self) -> {}:
+        # Admin table maps.  Loaded on first use and cleared when the geonames data changes (see new_build_id)
+        if self.admin_maps is None:
+            self.admin_maps = self.load_admin_maps()
+        return self.admin_maps
+
+    def load_admin_maps(self) -> {}:
+        """
+        Load the admin table into maps of name to ID and ID to name.  The first row for each key is the row the
+        equivalent SQL query returns first:  name queries return rows in primary key order and ID queries in id order
+        :return: Dictionary of maps
+        """
+        start = time.time()
+        maps = {'country_name': {}, 'admin1_name': {}, 'admin2_name': {}, 'admin2_name_iso': {},
+                'country_iso': {}, 'admin1_id': {}, 'admin2_id': {}, 'admin2_id_iso': {}}
+        country = {code: name for name, code in self.codes['country_code'].items()}
+        feature = {code: name for name, code in self.codes['feature_code'].items()}
+        cur = self.db.conn.cursor()
+        cur.execute(f'SELECT id, name, country, admin1_id, admin2_id, f_code FROM {base_table["admin"]} '
+                    f'ORDER BY name, country, id')
+        rows = [(row_id, name, country.get(iso, ''), adm1, adm2, feature.get(feat, ''))
+                for row_id, name, iso, adm1, adm2, feat in cur]
+
+        # Name to ID
+        for row_id, name, iso, adm1, adm2, feat in rows:
+            if feat == 'ADM0':
+                maps['country_iso'].setdefault(name, []).append(iso)
+            elif feat == 'ADM1':
+                maps['admin1_id'].setdefault((name, iso), adm1)
+            elif feat == 'ADM2':
+                maps['admin2_id'].setdefault((name, iso, adm1), adm2)
+                maps['admin2_id_iso'].setdefault((name, iso), adm2)
+
+        # ID to name.  Admin2 queries don't check the feature code
+        for row_id, name, iso, adm1, adm2, feat in sorted(rows, key=itemgetter(0)):
+            if feat == 'ADM0':
+                maps['country_name'].setdefault(iso, name)
+            elif feat == 'ADM1':
+                maps['admin1_name'].setdefault((iso, adm1), name)
+            maps['admin2_name'].setdefault((iso, adm1, adm2), name)
+            maps['admin2_name_iso'].setdefault((iso, adm2), name)
+
+        self.logger.debug(f'Admin maps loaded.  {len(rows)} rows.  Elapsed ={time.time() - start:.2f}')
+        return maps
+
+    def add_country_codes(self):
+        # Country codes are assigned in ISO order so names found in several countries are returned in ISO order
+        for iso in sorted(set(row[Country.CnRow.ISO].lower() for row in Country.country_dict.values())):
+            self.get_code('country_code', iso)
+
+    def create_alt_stage(self):
+        # Temporary staging table for alternate names.  See load_alt_stage()
+        self.db.create_table("""CREATE TEMP TABLE IF NOT EXISTS alt_stage    (
+                id           integer primary key autoincrement not null,
+                alt_id     integer,
+                geoid      text,
+                lang     text,
+                name     text
+                                    );""")
+        # noinspection SqlWithoutWhere
+        self.db.conn.execute('DELETE FROM alt_stage')
+
+    def insert_alt_stage(self, rows):
+        # Add (alternate name ID, geoid, lang, name) rows to staging table.  Requires a transaction
+        self.db.executemany('INSERT INTO alt_stage(alt_id, geoid, lang, name) VALUES(?,?,?,?)', rows)
+
+    def load_alt_stage(self, countries) -> int:
+        """
+        Add the staged alternate names to DB with a few set based queries.  Requires a transaction
+        Names for geoids that aren't in DB for one of the countries are dropped.  For each remaining name:
+        1) geodata/admin alias row, copied from the geoid's entry with the name normalized and soundex from the name
+           (English names for ADM entries are skipped) with the entry's priority,
+        2) altname row (if not English), and  3) altid row
+        :param countries: ISO codes of countries to add names for
+        :return: Number of alias rows added
+        """
+        self.db.conn.create_function('normalize', 1, GeoKeys.normalize, deterministic=True)
+        self.db.conn.create_function('soundex', 1, GeoKeys.get_soundex, deterministic=True)
+        codes = [self.codes['country_code'].get(iso, -1) for iso in countries]
+        in_countries = f"country IN ({','.join('?' * len(codes))})"
+
+        self.db.execute('CREATE INDEX IF NOT EXISTS temp.alt_stage_geoid_idx ON alt_stage(geoid)', ())
+        # Probe the geoid index for each staged name rather than scanning the tables at every checkpoint
+        self.db.execute(f'DELETE FROM alt_stage WHERE '
+                        f'NOT EXISTS (SELECT 1 FROM geodata_tbl g WHERE g.geoid = alt_stage.geoid AND g.{in_countries}) '
+                        f'AND NOT EXISTS (SELECT 1 FROM admin_tbl a WHERE a.geoid = alt_stage.geoid AND a.{in_countries})',
+                        (*codes, *codes))
+
+        count = 0
+        for tbl in ['admin', 'geodata']:
+            # Use the first (primary) entry for each geoid.  Geodata rows are sorted by (name, country) like
+            # flush_bulk().  Admin rows keep file order.  Row IDs follow on from the highest ID in table
+            order = 'name, country' if tbl == 'geodata' else 'stage_id'
+            sql = f''' INSERT INTO {base_table[tbl]}(id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx, priority)
+                  SELECT ? + row_number() OVER (ORDER BY {order}), name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx,
+                    priority
+                  FROM (SELECT s.id AS stage_id, normalize(s.name) AS name, g.country AS country, g.admin1_id AS admin1_id,
+                          g.admin2_id AS admin2_id, g.lat AS lat, g.lon AS lon, g.f_code AS f_code, g.geoid AS geoid,
+                          soundex(s.name) AS sdx, g.priority AS priority
+                        FROM alt_stage s JOIN
+                          (SELECT MIN(id), country, admin1_id, admin2_id, lat, lon, f_code, geoid, priority FROM {base_table[tbl]}
+                           WHERE geoid IN (SELECT geoid FROM alt_stage) GROUP BY geoid) g ON g.geoid = s.geoid
+                          JOIN feature_code f ON f.code = g.f_code
+                        WHERE s.lang != 'en' OR instr(f.name, 'ADM') = 0)
+                  ORDER BY {order} '''
+            next_id = self.get_next_id(tbl)
+            self.db.execute(sql, (next_id - 1,))
+            self.set_next_id(tbl, next_id + self.db.cur.rowcount)
+            count += self.db.cur.rowcount
+
+        self.db.execute(''' INSERT OR IGNORE INTO altname(name, lang, geoid)
+                  SELECT name, lang, geoid FROM alt_stage WHERE lang != 'en' ORDER BY id ''', ())
+        self.db.execute(''' INSERT OR REPLACE INTO altid(id, geoid, name, lang)
+                  SELECT alt_id, geoid, name, lang FROM alt_stage ORDER BY id ''', ())
+        # noinspection SqlWithoutWhere
+        self.db.execute('DELETE FROM alt_stage', ())
+        return count
+
+    def get_geoid_rows(self, geoid) -> []:
+        """
+        Get all admin and geodata rows for a geoid
+        :return: list of (table, DB ID, row) in DB ID order.  The primary name for the geoid is first, followed by
+        the US state abbreviation (if any) and then the alternate names
+        """
+        res = []
+        cur = self.db.conn.cursor()
+        for tbl in ['admin', 'geodata']:
+            cur.execute(f'SELECT id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx FROM {tbl} '
+                        f'WHERE geoid = ? ORDER BY id', (geoid,))
+            for row in cur.fetchall():
+                res.append((tbl, row[0], row[1:]))
+        return res
+
+    def get_geoid_priority(self, geoid):
+        # Priority of the primary (first) row for a geoid or None if geoid is not in DB.  Alias rows use the same priority
+        cur = self.db.conn.cursor()
+        for tbl in ['admin', 'geodata']:
+            cur.execute(f'SELECT priority FROM {tbl} WHERE geoid = ? ORDER BY id LIMIT 1', (geoid,))
+            res = cur.fetchall()
+            if len(res) > 0:
+                return res[0][0]
+        return None
+
+    def delete_geoid(self, geoid):
+        # Delete all geodata and admin rows for geoid.  Requires a transaction
+        for tbl in ['admin', 'geodata']:
+            self.db.execute(f'DELETE FROM {base_table[tbl]} WHERE geoid = ?', (geoid,))
+
+    def delete_place(self, geoid):
+        # Delete a geonames entry.  Geodata and admin rows (primary name and aliases), altname and altid rows.
+        # Requires a transaction
+        self.delete_geoid(geoid)
+        self.delete_alternate_names(geoid)
+        self.db.execute('DELETE FROM altid WHERE geoid = ?', (geoid,))
+
+    def delete_row(self, tbl, row_id, row):
+        # Delete a single geodata or admin row (from get_geoid_rows) by DB ID.  Requires a transaction
+        self.db.execute(f'DELETE FROM {base_table[tbl]} WHERE name = ? AND country = ? AND id = ?',
+                        (row[Entry.NAME], self.codes['country_code'].get(row[Entry.ISO], -1), row_id))
+
+    def delete_alternate_names(self, geoid, name=None, lang=None):
+        # Delete altname rows for geoid.  Optionally only those with the specified name and/or lang
+        sql = 'DELETE FROM altname WHERE geoid = ?'
+        args = [geoid]
+        if name is not None:
+            sql += ' AND name = ?'
+            args.append(name)
+        if lang is not None:
+            sql += ' AND lang = ?'
+            args.append(lang)
+        self.db.execute(sql, tuple(args))
+
+    def insert_alt_id(self, alt_id: str, geoid: str, name: str, lang: str):
+        # Record the geonames alternate name ID for an alternate name we added.  Used to apply alternate name updates
+        row = (alt_id, geoid, name, lang)
+        if self.bulk_mode:
+            self.bulk_append('altid', row)
+            return
+        sql = ''' INSERT OR REPLACE INTO altid(id, geoid, name, lang)
+                  VALUES(?,?,?,?) '''
+        self.db.execute(sql, row)
+
+    def get_alt_id(self, alt_id: str):
+        # Return (geoid, name, lang) for a geonames alternate name ID or None if we didn't add it
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT geoid, name, lang FROM altid WHERE id = ?', (alt_id,))
+        res = cur.fetchall()
+        if len(res) > 0:
+            return res[0]
+        return None
+
+    def delete_alt_id(self, alt_id: str):
+        self.db.execute('DELETE FROM altid WHERE id = ?', (alt_id,))
+
+    def get_applied_updates(self) -> set:
+        # Return the set of geonames update files that have been applied to DB
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT fname FROM update_log')
+        return set(row[0] for row in cur.fetchall())
+
+    def insert_applied_update(self, fname: str):
+        # Record that a geonames update file has been applied.  Requires a transaction
+        self.db.execute('INSERT OR IGNORE INTO update_log(fname) VALUES(?)', (fname,))
+
+    def get_loaded_countries(self) -> []:
+        # Return list of country ISO codes that have been loaded from geonames files
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT iso FROM loaded_country')
+        return [row[0] for row in cur.fetchall()]
+
+    def insert_loaded_countries(self, iso_list):
+        # Record countries that have been loaded from geonames files
+        self.db.begin()
+        for iso in iso_list:
+            self.db.execute('INSERT OR IGNORE INTO loaded_country(iso) VALUES(?)', (iso,))
+        self.db.commit()
+
+    def delete_country(self, iso: str):
+        """
+        Delete all geonames entries for a country.  The country name entries (ADM0) are kept for all countries.
+        Derived tables that were current have the country's rows removed in the same transaction and stay current
+        """
+        current = self.get_current_derived()
+        country = self.codes['country_code'].get(iso, -1)
+        adm0 = self.codes['feature_code'].get('ADM0', -1)
+        self.db.begin()
+        geoid_sql = "SELECT geoid FROM geodata WHERE country = ? UNION SELECT geoid FROM admin WHERE country = ? AND f_code != 'ADM0'"
+        for tbl in ['altname', 'altid']:
+            self.db.execute(f'DELETE FROM {tbl} WHERE geoid IN ({geoid_sql})', (iso, iso))
+        if 'titles' in current:
+            self.db.execute(f'DELETE FROM place_title WHERE geoid IN ({geoid_sql})', (iso, iso))
+        if 'place_rtree' in current:
+            self.db.execute('DELETE FROM geodata_rtree WHERE id IN (SELECT id FROM geodata_tbl WHERE country = ?)',
+                            (country,))
+            self.db.execute('DELETE FROM admin_rtree WHERE id IN (SELECT id FROM admin_tbl WHERE country = ? AND f_code != ?)',
+                            (country, adm0))
+        # Names of the country's entries.  After the delete, the ones no other entry has are removed from the name indices
+        self.db.execute('CREATE TEMP TABLE IF NOT EXISTS country_name(name text primary key not null)', ())
+        # noinspection SqlWithoutWhere
+        self.db.execute('DELETE FROM temp.country_name', ())
+        self.db.execute('INSERT INTO temp.country_name(name) SELECT name FROM geodata_tbl WHERE country = ? '
+                        'UNION SELECT name FROM admin_tbl WHERE country = ? AND f_code != ?', (country, country, adm0))
+
+        self.db.execute('DELETE FROM geodata_tbl WHERE country = ?', (country,))
+        self.db.execute('DELETE FROM admin_tbl WHERE country = ? AND f_code != ?', (country, adm0))
+        for tbl in name_index_tokenizer:
+            if tbl in current:
+                self.db.execute(f'DELETE FROM {tbl} WHERE name IN (SELECT name FROM temp.country_name c '
+                                f'WHERE NOT EXISTS (SELECT 1 FROM geodata_tbl g WHERE g.name = c.name) '
+                                f'AND NOT EXISTS (SELECT 1 FROM admin_tbl a WHERE a.name = c.name))', ())
+        self.db.execute('DELETE FROM loaded_country WHERE iso = ?', (iso,))
+        self.db.commit()
+        self.new_build_id(keep=current)
+
+    def add_country_derived(self, iso_list, current):
+        """
+        Add the derived table rows for countries just loaded into geodata and admin
+        :param iso_list: Countries loaded
+        :param current: Derived tables that were current before the countries were loaded.  See get_current_derived
+        """
+        countries = [self.codes['country_code'].get(iso, -1) for iso in iso_list]
+        in_list = ','.join('?' * len(countries))
+        adm0 = self.codes['feature_code'].get('ADM0', -1)
+        start_time = time.time()
+        self.db.begin()
+        if 'titles' in current:
+            self.insert_titles(f"WHERE country IN ({in_list}) AND f_code != 'ADM0'", iso_list)
+        if 'place_rtree' in current:
+            for tbl, base in base_table.items():
+                self.db.execute(f'INSERT INTO {tbl}_rtree(id, min_lat, max_lat, min_lon, max_lon, geoid) '
+                                f'SELECT id, lat, lat, lon, lon, geoid FROM {base} WHERE country IN ({in_list}) '
+                                f'AND f_code != ? AND lat IS NOT NULL AND lon IS NOT NULL', countries + [adm0])
+        for tbl in name_index_tokenizer:
+            if tbl in current:
+                # Names already in the index are the ones an entry of another country (or a country name) has
+                self.db.execute(f'INSERT INTO {tbl}(name) SELECT name FROM '
+                                f'(SELECT name FROM geodata_tbl WHERE country IN ({in_list}) '
+                                f'UNION SELECT name FROM admin_tbl WHERE country IN ({in_list}) AND f_code != ?) n '
+                                f'WHERE NOT EXISTS (SELECT 1 FROM geodata_tbl g WHERE g.name = n.name AND g.country NOT IN ({in_list})) '
+                                f'AND NOT EXISTS (SELECT 1 FROM admin_tbl a WHERE a.name = n.name '
+                                f'AND (a.country NOT IN ({in_list}) OR a.f_code = ?))',
+                                countries + countries + [adm0] + countries + countries + [adm0])
+        self.db.commit()
+        self.new_build_id(keep=current)
+        self.logger.info(f'Derived tables updated for {iso_list}.  Elapsed ={time.time() - start_time:.1f}')
+
+    def update_geoid_derived(self, geoids, old_rows, current):
+        """
+        Update the derived table rows for geoids whose geodata and admin rows were changed.  Requires a transaction
+        :param old_rows: Rows of the geoids before the change.  See get_geoid_rows
+        :param current: Derived tables that were current before the change.  See get_current_derived
+        """
+        rows = list(old_rows)
+        for geoid in geoids:
+            rows.extend(self.get_geoid_rows(geoid))
+        if 'titles' in current:
+            self.refresh_titles(geoids, {self.admin_area(row) for tbl, row_id, row in rows} - {None})
+        if 'place_rtree' in current:
+            # Remove the entries for the old and new row IDs and add the new rows
+            geoids = list(geoids)
+            for tbl, base in base_table.items():
+                ids = list({row_id for row_tbl, row_id, row in rows if row_tbl == tbl})
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    self.db.execute(f'DELETE FROM {tbl}_rtree WHERE id IN ({",".join("?" * len(chunk))})', chunk)
+                for start in range(0, len(geoids), 500):
+                    chunk = geoids[start:start + 500]
+                    self.db.execute(f'INSERT INTO {tbl}_rtree(id, min_lat, max_lat, min_lon, max_lon, geoid) '
+                                    f'SELECT id, lat, lat, lon, lon, geoid FROM {base} WHERE geoid IN ({",".join("?" * len(chunk))}) '
+                                    f'AND lat IS NOT NULL AND lon IS NOT NULL', chunk)
+        index_list = [tbl for tbl in name_index_tokenizer if tbl in current]
+        if len(index_list) > 0:
+            # Old names no entry has now are removed from the name indices and new names are added
+            self.db.execute('CREATE TEMP TABLE IF NOT EXISTS changed_name(name text primary key not null)', ())
+            # noinspection SqlWithoutWhere
+            self.db.execute('DELETE FROM temp.changed_name', ())
+            self.db.executemany('INSERT OR IGNORE INTO temp.changed_name(name) VALUES(?)',
+                                [(row[Entry.NAME],) for tbl, row_id, row in rows])
+            in_db = '(SELECT 1 FROM geodata_tbl g WHERE g.name = c.name) OR EXISTS (SELECT 1 FROM admin_tbl a WHERE a.name = c.name)'
+            for tbl in index_list:
+                self.db.execute(f'DELETE FROM {tbl} WHERE name IN (SELECT name FROM temp.changed_name c WHERE NOT (EXISTS {in_db}))', ())
+                self.db.execute(f'INSERT INTO {tbl}(name) SELECT name FROM temp.changed_name c WHERE (EXISTS {in_db}) '
+                                f'AND name NOT IN (SELECT name FROM {tbl})', ())
+
+    def get_current_derived(self) -> []:
+        # Derived tables built from the current geonames data
+        build_id = self.get_build_id()
+        if build_id == '' or self.db.read_only:
+            return []
+        return [item for item, tbl in derived_tables.items()
+                if self.get_build_id(item) == build_id and self.db.table_exists(tbl)]
+
     def insert_version(self, db_version: int):
         self.db.begin()
 
@@ -796,15 +1504,12 @@ class GeoDB:
     def get_db_version(self) -> int:
         # If version table does not exist, this is V1
         if self.db.table_exists('version'):
-            # query version ID
-            query_list = [
-                Query(where="version like ?",
-                      args=('%',),
-                      result=Result.STRONG_MATCH)]
-            select_str = '*'
-            row_list, res = self.db.process_query(select_string=select_str, from_tbl='main.version', query_list=query_list)
+            # Latest version row.  -1 means a build was started but not finished
+            cur = self.db.conn.cursor()
+            cur.execute('SELECT version FROM version ORDER BY id DESC LIMIT 1')
+            row_list = cur.fetchall()
             if len(row_list) > 0:
-                ver = int(row_list[0][1])
+                ver = int(row_list[0][0])
                 self.logger.debug(f'Database Version = {ver}')
                 return ver
 
@@ -812,48 +1517,243 @@ class GeoDB:
         self.logger.debug('No version table.  Version is 1')
         return 1
 
+    def get_build_id(self, item='geonames') -> str:
+        # Return ID of the current DB contents.  A new ID is set each time geonames data is changed.
+        # For other items, return the geonames build ID the item was built from.  See build_id_rows
+        if not self.db.table_exists('build_id'):
+            return ''
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT build_id FROM build_id WHERE id = ?', (build_id_rows[item],))
+        res = cur.fetchall()
+        if len(res) > 0:
+            return res[0][0]
+        return ''
+
+    def new_build_id(self, keep=()):
+        """
+        Record that the geonames data has changed.  Snapshots of the previous data are now stale
+        :param keep: Derived tables that were updated along with the change.  They stay current
+        """
+        build_id = uuid.uuid4().hex
+        self.db.conn.execute('INSERT OR REPLACE INTO build_id(id, build_id) VALUES(?, ?)',
+                             (build_id_rows['geonames'], build_id))
+        for item in keep:
+            self.db.conn.execute('INSERT OR REPLACE INTO build_id(id, build_id) VALUES(?, ?)', (build_id_rows[item], build_id))
+        # Snapshot and hot tier hold the previous data.  Lookups use SQLite until GeodataFiles opens new ones
+        self.set_snapshot(None)
+        self.set_hot_tier(None)
+        self.db.query_cache.clear()
+        self.admin_maps = None
+        self.titles_current = False
+        self.db.name_index = False
+        self.db.trigram_index = False
+        self.rtree_current = False
+
+    def get_build_state(self, fname) -> (int, int, bool):
+        """
+        Get build progress for a build step (geonames file name or step name)
+        :return: (file position reached, rows added, done)
+        """
+        if not self.db.table_exists('build_state'):
+            return 0, 0, False
+        cur = self.db.conn.cursor()
+        cur.execute('SELECT file_pos, rows, done FROM build_state WHERE fname = ?', (fname,))
+        res = cur.fetchall()
+        if len(res) > 0:
+            return res[0][0], res[0][1], bool(res[0][2])
+        return 0, 0, False
+
+    def set_build_state(self, fname, file_pos: int, rows: int, done: bool):
+        # Record build progress for a build step.  Requires a transaction
+        sql = ''' INSERT OR REPLACE INTO build_state(fname, file_pos, rows, done)
+                  VALUES(?,?,?,?) '''
+        self.db.execute(sql, (fname, file_pos, rows, int(done)))
+
     def create_tables(self):
+        for sql in self.geoname_table_sql():
+            self.db.create_table(sql)
+
         # name, country, admin1_id, admin2_id, lat, lon, f_code, geoid
-        sql_geodata_table = """CREATE TABLE IF NOT EXISTS geodata    (
+        sql_alt_name_table = """CREATE TABLE IF NOT EXISTS altname    (
                 id           integer primary key autoincrement not null,
                 name     text,
-                country     text,
-                admin1_id     text,
-                admin2_id text,
-                lat      text,
-                lon       text,
-                f_code      text,
-                geoid      text,
-                sdx     text
+                lang     text,
+                geoid      text
                                     );"""
 
         # name, country, admin1_id, admin2_id, lat, lon, f_code, geoid
-        sql_admin_table = """CREATE TABLE IF NOT EXISTS admin    (
+        sql_version_table = """CREATE TABLE IF NOT EXISTS version    (
                 id           integer primary key autoincrement not null,
-                name     text,
-                country     text,
+                version     integer
+                                    );"""
+
+        # Build progress for each geonames file or build step.  Used to resume a build
+        sql_build_state_table = """CREATE TABLE IF NOT EXISTS build_state    (
+                fname     text primary key not null,
+                file_pos     integer,
+                rows     integer,
+                done     integer
+                                    );"""
+
+        for tbl in [sql_version_table, sql_alt_name_table, sql_build_state_table]:
+            self.db.create_table(tbl)
+        self.create_update_tables()
+        self.read_codes()
+        if len(self.codes['country_code']) == 0:
+            self.add_country_codes()
+
+    @staticmethod
+    def geoname_table_sql() -> []:
+        """
+        SQL to create the geoname tables (DB version 4).
+        geodata_tbl and admin_tbl are WITHOUT ROWID tables clustered on (name, country, id) so a name lookup reads
+        one range of the table.  Lat/lon are REAL, and country and feature are integer codes from the country_code
+        and feature_code tables.  priority ranks the candidates for a query (see rank_priority).
+        The geodata and admin views decode the codes and are used for all queries
+        """
+        res = []
+        for tbl in ['country_code', 'feature_code']:
+            res.append(f"""CREATE TABLE IF NOT EXISTS {tbl}    (
+                code           integer primary key not null,
+                name     text unique not null
+                                    );""")
+
+        # Next DB ID for geodata and admin.  IDs keep rows for a geoid in the order they were added
+        res.append("""CREATE TABLE IF NOT EXISTS next_id    (
+                tbl     text primary key not null,
+                id     integer
+                                    );""")
+
+        for tbl, base in base_table.items():
+            # id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx, priority
+            res.append(f"""CREATE TABLE IF NOT EXISTS {base}    (
+                id           integer not null,
+                name     text not null,
+                country     integer not null,
                 admin1_id     text,
                 admin2_id text,
-                lat      text,
-                lon       text,
-                f_code      text,
+                lat      real,
+                lon       real,
+                f_code      integer,
                 geoid      text,
-                sdx     text
-                                    );"""
+                sdx     text,
+                priority     integer,
+                primary key (name, country, id)
+                                    ) WITHOUT ROWID;""")
+            res.append(f"""CREATE VIEW IF NOT EXISTS {tbl} AS
+                SELECT g.id AS id, g.name AS name, c.name AS country, g.admin1_id AS admin1_id, g.admin2_id AS admin2_id,
+                    g.lat AS lat, g.lon AS lon, f.name AS f_code, g.geoid AS geoid, g.sdx AS sdx, g.priority AS priority
+                FROM {base} g JOIN country_code c ON c.code = g.country JOIN feature_code f ON f.code = g.f_code""")
+        return res
 
-        # name, country, admin1_id, admin2_id, lat, lon, f_code, geoid
-        sql_alt_name_table = """CREATE TABLE IF NOT EXISTS altname    (
-                id           integer primary key autoincrement not null,
+    def migrate_v3(self):
+        """
+        Convert a version 2 DB (geodata and admin rowid tables with text columns) to the version 3 layout in place.
+        Rows keep their DB IDs
+        """
+        self.logger.info('Converting database to version 3')
+        start_time = time.time()
+        self.db.begin()
+        for sql in self.geoname_table_sql():
+            if not sql.startswith('CREATE VIEW'):
+                self.db.execute(sql, ())
+        self.read_codes()
+        self.add_country_codes()
+        cur = self.db.conn.cursor()
+        for col, tbl in [('country', 'country_code'), ('f_code', 'feature_code')]:
+            cur.execute(f'SELECT {col} FROM geodata UNION SELECT {col} FROM admin')
+            for row in cur.fetchall():
+                self.get_code(tbl, row[0])
+
+        for tbl, base in base_table.items():
+            cur.execute(f'SELECT MAX(id) FROM {tbl}')
+            self.set_next_id(tbl, (cur.fetchall()[0][0] or 0) + 1)
+            sql = f''' INSERT INTO {base}(id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx)
+                  SELECT g.id, IFNULL(g.name, ''), c.code, g.admin1_id, g.admin2_id, g.lat, g.lon, f.code, g.geoid, g.sdx
+                  FROM {tbl} g JOIN country_code c ON c.name = g.country JOIN feature_code f ON f.name = g.f_code
+                  ORDER BY 2, 3, 1 '''
+            self.db.execute(sql, ())
+            # Indices on the old table are dropped with it
+            self.db.execute(f'DROP TABLE {tbl}', ())
+        for sql in self.geoname_table_sql():
+            if sql.startswith('CREATE VIEW'):
+                self.db.execute(sql, ())
+        self.db.commit()
+
+        self.create_tables()
+        self.create_geoid_index()
+        self.create_indices()
+        self.insert_version(3)
+        self.db.conn.execute('VACUUM')
+        self.logger.info(f'Database converted.  Elapsed ={time.time() - start_time:.1f}')
+
+    def migrate_v4(self):
+        """
+        Add the priority column to a version 3 DB in place.  Population isn't in the DB, so existing rows get the
+        priority for their feature.  Population bands are part of the feature code (PP1M, P1HK, PPLL)
+        """
+        self.logger.info('Converting database to version 4')
+        start_time = time.time()
+        current = self.get_current_derived()
+        self.db.conn.create_function('rank_priority', 2, rank_priority, deterministic=True)
+        self.db.begin()
+        cur = self.db.conn.cursor()
+        for tbl, base in base_table.items():
+            cur.execute(f'PRAGMA table_info({base})')
+            if 'priority' not in [row[1] for row in cur.fetchall()]:
+                self.db.execute(f'ALTER TABLE {base} ADD COLUMN priority integer', ())
+            self.db.execute(f'UPDATE {base} SET priority = (SELECT rank_priority(f.name, 0) FROM feature_code f '
+                            f'WHERE f.code = {base}.f_code) WHERE priority IS NULL', ())
+            # Views are recreated to add the column
+            self.db.execute(f'DROP VIEW IF EXISTS {tbl}', ())
+        for sql in self.geoname_table_sql():
+            if sql.startswith('CREATE VIEW'):
+                self.db.execute(sql, ())
+        self.db.commit()
+        self.insert_version(4)
+        # Snapshots and memos of V3 rows have no priority.  Derived tables don't use it and stay current
+        self.create_update_tables()
+        self.new_build_id(keep=current)
+        self.logger.info(f'Database converted.  Elapsed ={time.time() - start_time:.1f}')
+
+    def create_update_tables(self):
+        # Tables used to update an existing DB (geonames.org daily update files and country list changes).
+        # Older DBs get these the first time they are opened
+        # geonames alternate name ID for each alternate name we added
+        sql_alt_id_table = """CREATE TABLE IF NOT EXISTS altid    (
+                id           integer primary key not null,
+                geoid      text,
                 name     text,
-                lang     text,
-                geoid      text
+                lang     text
                                     );"""
 
-        # name, country, admin1_id, admin2_id, lat, lon, f_code, geoid
-        sql_version_table = """CREATE TABLE IF NOT EXISTS version    (
-                id           integer primary key autoincrement not null,
-                version     integer
+        # Update files that have been applied
+        sql_update_log_table = """CREATE TABLE IF NOT EXISTS update_log    (
+                fname     text primary key not null
+                                    );"""
+
+        # Countries loaded from geonames files
+        sql_loaded_country_table = """CREATE TABLE IF NOT EXISTS loaded_country    (
+                iso     text primary key not null
+                                    );"""
+
+        # ID of the current DB contents.  See new_build_id()
+        sql_build_id_table = """CREATE TABLE IF NOT EXISTS build_id    (
+                id           integer primary key not null,
+                build_id     text
                                     );"""
 
-        for tbl in [sql_geodata_table, sql_admin_table, sql_version_table, sql_alt_name_table]:
+        # Display title and normalized match title for each geoid and name.  See update_titles()
+        sql_place_title_table = """CREATE TABLE IF NOT EXISTS place_title    (
+                geoid      text not null,
+                name     text not null,
+                title     text,
+                match_title     text,
+                primary key (geoid, name)
+                                    ) WITHOUT ROWID;"""
+
+        for tbl in [sql_alt_id_table, sql_update_log_table, sql_loaded_country_table, sql_build_id_table,
+                    sql_place_title_table]:
             self.db.create_table(tbl)
+        # Update deletes find altid rows by geoid
+        self.db.create_index(create_table_sql='CREATE INDEX IF NOT EXISTS altidgeoid_idx ON altid(geoid)')
@@ -201,6 +201,10 @@ class GeoFinder:
 
         # Initialize geodata
         self.geodata = Geodata.Geodata(directory_name=self.directory, progress_bar=self.w.prog)
+        # Worker processes for database builds.  Default is one less than the number of CPUs
+        workers = self.ini_handler.ini_read('BUILD', 'WORKERS')
+        if workers is not None and workers.strip().isdigit():
+            self.geodata.geo_files.build_workers = max(1, int(workers))
         error = self.geodata.read()
         if error:
             TKHelper.fatal_error(MISSING_FILES)
@@ -366,7 +370,9 @@ class GeoFinder:
                 # Found a  PLACE entry that we don't have a global replace or skip for
                 # See if it is in our place database
                 self.place.event_year = int(self.ancestry_file_handler.event_year)  # Set place date to event date (geo names change over time)
-                self.geodata.find_location(town_entry, self.place, self.w.prog.shutdown_requested)
+                # Use a coordinate already in the file to find or confirm the place
+                self.geodata.find_location(town_entry, self.place, self.w.prog.shutdown_requested,
+                                           coord=self.ancestry_file_handler.get_coord())
                 # if self.place.result_type not in GeoKeys.successful_match:
                 #    self.geodata.set_last_iso('')
                 #    self.geodata.find_location(town_entry, self.place)
@@ -796,7 +802,7 @@ class GeoFinder:
         """ Shutdown - write out Gbl Replace and skip file and exit """
         # self.w.root.update_idletasks()
         if self.geodata:
-            self.geodata.geo_files.geodb.close()
+            self.geodata.close()
         if self.skiplist:
             self.skiplist.write()
         if self.global_replace:
@@ -17,12 +17,17 @@
 #   along with this program; if not, write to the Free Software
 #   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
 import collections
+import logging
+import math
 import os
 import re
+from tkinter import messagebox
 
 import phonetics
 import unidecode
 
+EARTH_RADIUS_KM = 6371.0
+
 
 class Entry:
     NAME = 0
@@ -58,11 +63,34 @@ successful_match = [Result.STRONG_MATCH, Result.PARTIAL_MATCH, Result.WILDCARD_M
 
 Query = collections.namedtuple('Query', 'where args result')
 
+# Message boxes need a display.  Command line tools (BatchGeoFinder, GeoServer) and tests clear this and messages
+# go to the log instead.  See show_message
+gui_enabled = True
+
+
+def show_message(kind: str, title: str, text) -> bool:
+    """
+    Show a tkinter message box, or log the message when there is no GUI
+    :param kind: messagebox function - showinfo, showwarning, showerror or askyesno
+    :return: askyesno answer.  False when there is no GUI
+    """
+    if gui_enabled:
+        return getattr(messagebox, kind)(title, text)
+    level = {'showinfo': logging.INFO, 'showwarning': logging.WARNING}.get(kind, logging.ERROR)
+    logging.getLogger(__name__).log(level, f'{title}: {text}')
+    return False
+
 
 def get_soundex(txt):
     res = phonetics.dmetaphone(txt)
     return res[0]
 
+def get_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """ Great circle distance in km between two coordinates """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
 def get_directory_name() -> str:
     return "geoname_data"
 
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+HTTP geocoding service.  Holds one Geodata with the DB opened read only and answers lookups on a fixed pool of threads.
+With --workers the lookups run on a LookupEngine pool of worker processes.
+
+GET  /lookup?place=<location>&year=<event year>   Look up one place
+POST /batch                                       NDJSON lines of "<location>" or {"place":, "year":, "id":}.
+                                                  Returns one NDJSON result line per input line, in order
+GET  /geoid?id=<geoid>                            Look up a geoname ID
+GET  /health                                      Status and row count
+GET  /metrics                                     Request counts, lookup time, cache, query stage and storage stats
+
+Errors are returned as {"error": <message>} with a 4xx or 500 status.  A /batch request body needs a Content-Length
+and is read whole (up to GeoServer.max_body bytes) so that every line is checked before results are sent.  Larger
+inputs should be split into several requests.  If a lookup fails after /batch results have started, an error line
+is sent and the response ends.
+"""
+import argparse
+import concurrent.futures
+import copy
+import json
+import logging
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from geofinder import DB, GeoKeys, Loc
+from geofinder import __version__
+from geofinder.IniHandler import IniHandler
+from geofinder.LookupEngine import LookupEngine, open_geodata
+
+# Result code -> name, e.g. 8 -> STRONG_MATCH
+result_names = {val: name for name, val in vars(GeoKeys.Result).items() if not name.startswith('_')}
+
+
+class PoolServer(HTTPServer):
+    """
+    HTTP server that handles requests on a fixed number of threads.  Each thread keeps its read only DB connection
+    (see DB.conn), so connections don't grow with the number of requests
+    """
+
+    def __init__(self, server_address, handler, threads: int):
+        super().__init__(server_address, handler)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads),
+                                                              thread_name_prefix='geoserver')
+
+    def process_request(self, request, client_address):
+        # Queue the request for the next free thread
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        # Same as socketserver.ThreadingMixIn
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class GeoServer:
+    """ Serve Geodata lookups over HTTP.  See module docstring for endpoints """
+
+    def __init__(self, geodata, engine: LookupEngine = None, batch_size=200, max_candidates=20,
+                 max_body=64 * 1024 * 1024, threads=8):
+        self.logger = logging.getLogger(__name__)
+        self.geodata = geodata
+        # Lookups run on engine if there is one, otherwise on geodata
+        self.engine = engine
+        # Batch lines are looked up with Geodata.find_locations this many at a time
+        self.batch_size = batch_size
+        self.max_candidates = max_candidates
+        # Largest /batch request body in bytes.  The body is held in memory while its lines are looked up
+        self.max_body = max_body
+        # Requests are handled on this many threads.  Others wait for a free thread
+        self.threads = threads
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    def lookup(self, location: str, event_year: int) -> dict:
+        # Look up one place
+        start = time.time()
+        if self.engine is not None:
+            place = self.engine.find_locations([(location, event_year)], shutdown=False)[0]
+        else:
+            place = Loc.Loc()
+            place.event_year = event_year
+            self.geodata.find_location(location, place, False)
+        self.add_lookups(1, time.time() - start)
+        return self.get_result(location, place)
+
+    def lookup_batch(self, items) -> []:
+        # Look up list of (location, event year).  Returns list of results
+        start = time.time()
+        if self.engine is not None:
+            places = self.engine.find_locations(items, shutdown=False)
+        else:
+            places = self.geodata.find_locations(items)
+        self.add_lookups(len(items), time.time() - start)
+        return [self.get_result(location, place) for (location, _), place in zip(items, places)]
+
+    def lookup_geoid(self, geoid: str) -> dict:
+        place = Loc.Loc()
+        self.geodata.find_geoid(geoid, place)
+        return self.get_result(geoid, place)
+
+    def get_result(self, location: str, place: Loc.Loc) -> dict:
+        # Lookup result with the match and the scored candidates
+        geodb = self.geodata.geo_files.geodb
+        result = {'place': location,
+                  'result_type': place.result_type,
+                  'result': result_names.get(place.result_type, ''),
+                  'status': place.status.strip()}
+        temp_place = copy.copy(place)
+        if place.result_type == GeoKeys.Result.STRONG_MATCH:
+            geodb.set_display_names(temp_place)
+            result.update({'name': temp_place.format_full_nm(self.geodata.geo_files.output_replace_dct),
+                           'geoid': place.geoid, 'lat': place.lat, 'lon': place.lon, 'prefix': place.prefix})
+
+        candidates = []
+        for row in place.georow_list[:self.max_candidates]:
+            geodb.copy_georow_to_place(row, temp_place)
+            geodb.set_display_names(temp_place)
+            candidates.append({'name': temp_place.format_full_nm(self.geodata.geo_files.output_replace_dct),
+                               'geoid': row[GeoKeys.Entry.ID],
+                               'iso': row[GeoKeys.Entry.ISO],
+                               'admin1': row[GeoKeys.Entry.ADM1],
+                               'admin2': row[GeoKeys.Entry.ADM2],
+                               'lat': row[GeoKeys.Entry.LAT],
+                               'lon': row[GeoKeys.Entry.LON],
+                               'feature': row[GeoKeys.Entry.FEAT],
+                               'score': row[GeoKeys.Entry.SCORE] if len(row) > GeoKeys.Entry.SCORE else None})
+        result['candidates'] = candidates
+        return result
+
+    def add_lookups(self, count, elapsed):
+        with self.lock:
+            self.lookups += count
+            self.lookup_time += elapsed
+
+    def add_request(self, error: bool):
+        with self.lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+
+    def get_health(self) -> dict:
+        return {'status': 'ok', 'version': __version__.__version__,
+                'rows': self.geodata.geo_files.geodb.get_row_count(),
+                'uptime': round(time.time() - self.start_time, 1)}
+
+    def get_metrics(self) -> dict:
+        memo = self.geodata.lookup_memo
+        with self.lock:
+            return {'requests': self.requests,
+                    'errors': self.errors,
+                    'workers': self.engine.workers if self.engine is not None else 0,
+                    'lookups': self.lookups,
+                    'lookup_seconds': round(self.lookup_time, 3),
+                    'ms_per_lookup': round(1000 * self.lookup_time / self.lookups, 2) if self.lookups else 0.0,
+                    'query_cache': self.geodata.geo_files.geodb.db.query_cache.get_stats(),
+                    'lookup_memo': memo.get_stats() if memo is not None else '',
+                    'profile': self.geodata.geo_files.geodb.db.cascade_profile,
+                    'storage': self.geodata.geo_files.geodb.db.get_storage_stats(),
+                    'query_stages': self.geodata.geo_files.geodb.db.query_stats.get_list()}
+
+    def make_server(self, host: str, port: int) -> PoolServer:
+        # HTTP server for this GeoServer.  Port 0 picks a free port
+        handler = type('Handler', (RequestHandler,), {'geo_server': self})
+        return PoolServer((host, port), handler, self.threads)
+
+    def serve(self, host: str, port: int):
+        # Serve until interrupted
+        httpd = self.make_server(host, port)
+        self.logger.info(f'GeoFinder server on http://{host}:{port}')
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            if self.engine is not None:
+                self.engine.close()
+            self.geodata.close()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Handle one HTTP request.  geo_server is set by GeoServer.serve """
+    geo_server: GeoServer = None
+    protocol_version = 'HTTP/1.1'
+    # Seconds an idle keep-alive connection holds a server thread
+    timeout = 30
+
+    def do_GET(self):
+        self.run_handler(self.handle_get)
+
+    def do_POST(self):
+        self.run_handler(self.handle_post)
+
+    def run_handler(self, handler):
+        # Send a 500 error if handler fails.  If a streamed response has started, end it with an error line
+        self.streaming = False
+        try:
+            handler()
+        except Exception as e:
+            logging.getLogger(__name__).exception(f'{self.command} {self.path}')
+            self.close_connection = True
+            try:
+                if self.streaming:
+                    self.geo_server.add_request(error=True)
+                    self.write_chunk((json.dumps({'error': f'Internal error: {e}'}) + '\n').encode('utf-8'))
+                    self.write_chunk(b'')
+                else:
+                    self.send_error_json(500, f'Internal error: {e}')
+            except OSError:
+                # Client has gone
+                pass
+
+    def handle_get(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        server = self.geo_server
+        if url.path == '/lookup':
+            location = params.get('place', [''])[0]
+            if location == '':
+                self.send_error_json(400, 'Missing place')
+                return
+            try:
+                year = int(params.get('year', ['0'])[0])
+            except ValueError:
+                self.send_error_json(400, 'Invalid year')
+                return
+            self.send_json(server.lookup(location, year))
+        elif url.path == '/geoid':
+            geoid = params.get('id', [''])[0]
+            if geoid == '':
+                self.send_error_json(400, 'Missing id')
+                return
+            self.send_json(server.lookup_geoid(geoid))
+        elif url.path == '/health':
+            self.send_json(server.get_health())
+        elif url.path == '/metrics':
+            self.send_json(server.get_metrics())
+        else:
+            self.send_error_json(404, 'Not found')
+
+    def handle_post(self):
+        if urlparse(self.path).path != '/batch':
+            self.send_error_json(404, 'Not found')
+            return
+        server = self.geo_server
+        # The body isn't read on an error, so the connection is closed after the response
+        if self.headers.get('Content-Length') is None:
+            self.close_connection = True
+            self.send_error_json(411, 'Content-Length required')
+            return
+        try:
+            length = int(self.headers.get('Content-Length'))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self.send_error_json(400, 'Invalid Content-Length')
+            return
+        if length > server.max_body:
+            self.close_connection = True
+            self.send_error_json(413, f'Request body over {server.max_body} bytes.  Split the input')
+            return
+        try:
+            text = self.rfile.read(length).decode('utf-8')
+        except UnicodeDecodeError as e:
+            self.send_error_json(400, f'Invalid UTF-8 {e}')
+            return
+        lines = [line for line in text.splitlines() if line.strip() != '']
+
+        # Parse all lines first so a bad line is reported before any results are sent
+        items = []
+        ids = []
+        for line_num, line in enumerate(lines, 1):
+            try:
+                item = json.loads(line)
+                if isinstance(item, str):
+                    item = {'place': item}
+                items.append((str(item['place']), int(item.get('year') or 0)))
+                ids.append(item.get('id'))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self.send_error_json(400, f'Line {line_num}: {e}')
+                return
+
+        # Stream results as each group of lines is looked up
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self.streaming = True
+        for idx in range(0, len(items), server.batch_size):
+            text = ''
+            for item_id, result in zip(ids[idx:idx + server.batch_size],
+                                       server.lookup_batch(items[idx:idx + server.batch_size])):
+                if item_id is not None:
+                    result['id'] = item_id
+                text += json.dumps(result) + '\n'
+            self.write_chunk(text.encode('utf-8'))
+        # Counted before the response ends so a client that reads /metrics next sees it
+        server.add_request(error=False)
+        self.write_chunk(b'')
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f'{len(data):X}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def send_json(self, value, code=200):
+        data = json.dumps(value).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.geo_server.add_request(error=code != 200)
+        self.wfile.write(data)
+
+    def send_error_json(self, code, message):
+        self.send_json({'error': message}, code=code)
+
+    def log_message(self, fmt, *args):
+        logging.getLogger(__name__).debug(fmt % args)
+
+
+def entry():
+    parser = argparse.ArgumentParser(description='GeoFinder HTTP geocoding service')
+    parser.add_argument("--directory", help="GeoFinder data directory.  Default is the directory in geofinder.ini")
+    parser.add_argument("--host", default='127.0.0.1', help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8150, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=0, help="Number of lookup worker processes.  0 for none")
+    parser.add_argument("--threads", type=int, default=8, help="Number of request threads")
+    parser.add_argument("--profile", default='legacy', choices=sorted(DB.cascade_profiles),
+                        help="Query cascade profile.  Default legacy runs every stage")
+    parser.add_argument("--storage", default='disk', choices=sorted(DB.storage_profiles),
+                        help="Database storage.  memory loads the database into RAM in each process")
+    parser.add_argument("--logging", help="Enable quiet logging")
+    args = parser.parse_args()
+
+    fmt = "%(levelname)s %(name)s.%(funcName)s %(lineno)d: %(message)s"
+    logging.basicConfig(level=logging.INFO if args.logging == 'info' else logging.WARNING, stream=sys.stdout, format=fmt)
+    # No display.  Messages go to the log
+    GeoKeys.gui_enabled = False
+    print('GeoFinder server v{}'.format(__version__.__version__))
+
+    directory = args.directory
+    if directory is None:
+        ini_handler = IniHandler(home_path=str(Path.home()), ini_name='geofinder.ini')
+        directory = ini_handler.get_directory_from_ini()
+
+    geodata = open_geodata(str(directory), memo_enabled=True, profile=args.profile, storage=args.storage)
+    if geodata is None:
+        logging.getLogger(__name__).error(f'Cannot open geoname database in {directory}.  Run geofinder to build it')
+        sys.exit(1)
+    # Close memo and DB on SIGTERM as well as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    engine = LookupEngine(str(directory), args.workers, profile=args.profile, storage=args.storage) \
+        if args.workers > 0 else None
+    GeoServer(geodata, engine=engine, threads=args.threads).serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    entry()
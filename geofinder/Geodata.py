@@ -19,9 +19,12 @@
 import collections
 import copy
 import logging
+import os
+import re
+import sqlite3
 from operator import itemgetter
 
-from geofinder import GeodataFiles, GeoKeys, Loc
+from geofinder import BatchCache, GeodataFiles, GeoKeys, Loc, LookupMemo
 
 
 class Geodata:
@@ -38,15 +41,150 @@ class Geodata:
         self.directory: str = directory_name
         self.progress_bar = progress_bar  # progress_bar
         self.geo_files = GeodataFiles.GeodataFiles(self.directory, progress_bar=self.progress_bar)  # , geo_district=self.geo_district)
-        self.save_place = None
-
-    def find_location(self, location: str, place: Loc.Loc, shutdown):
+        # Persistent memo of lookup results.  See LookupMemo.py
+        self.memo_enabled = True
+        self.memo_name = 'lookup_memo.db'
+        self.lookup_memo = None
+        # Distance in km from a coordinate in the ancestry file for a place to match it.  See find_location_by_coord
+        self.coord_radius = 10.0
+
+    def find_location(self, location: str, place: Loc.Loc, shutdown, coord=None):
         """
         Find a location in the geoname dictionary.
         First parse the location into <prefix>, city, <district2>, district1, country.
         Then look it up in the place dictionary
         Update place with -- lat, lon, district, city, country_iso, result code
+        In tiered mode the lookup is tried on the hot tier first and only goes to the full DB if that isn't a strong match
+        :param coord: (lat, lon) the ancestry file has for this location or None.  Places near it are tried first
+        and it is used to pick between matches
+        """
+        geodb = self.geo_files.geodb
+        # During shutdown there is no user verification and no reason to try wildcard searches.
+        # Set for this lookup only.  The DB is shared by other threads and later lookups
+        use_wildcards = geodb.db.use_wildcards and not shutdown
+        geodb.db.lookup_wildcards = use_wildcards
+        try:
+            if coord is not None and self.find_location_by_coord(location, place, coord):
+                return
+
+            if self.lookup_memo is not None:
+                key = self.lookup_memo.get_key(location, place.event_year, use_wildcards)
+                if not self.lookup_memo.get(key, place):
+                    self.find_location_tiered(location, place, shutdown)
+                    self.lookup_memo.put(key, place)
+            else:
+                self.find_location_tiered(location, place, shutdown)
+
+            if coord is not None:
+                self.confirm_by_coord(place, coord)
+        finally:
+            geodb.db.lookup_wildcards = True
+
+    def find_locations(self, entries, shutdown=False) -> []:
+        """
+        Look up a batch of locations.  The rows for all the names in the batch are read with one set based query
+        (see BatchCache.py), then the entries are looked up grouped by country and admin1
+        :param entries: List of location strings or (location, event year) tuples
+        :return: List of Loc, in the same order as entries, with the results find_location gives
         """
+        items = []
+        for entry in entries:
+            if isinstance(entry, str):
+                items.append((entry, 0))
+            else:
+                items.append((entry[0], int(entry[1] or 0)))
+
+        # Parse entries for the names to read and the lookup order
+        names = set()
+        group = []
+        place = Loc.Loc()
+        for location, event_year in items:
+            place.parse_place(place_name=location, geo_files=self.geo_files)
+            for name in [place.target, place.city1, place.admin2_name, place.admin1_name, place.extra,
+                         GeoKeys.search_normalize(place.prefix, place.country_iso)]:
+                if name != '':
+                    names.add(name)
+            group.append((place.country_iso, place.admin1_name))
+
+        geodb = self.geo_files.geodb
+        results = [None] * len(items)
+        geodb.db.batch = BatchCache.BatchCache(geodb, names)
+        try:
+            for idx in sorted(range(len(items)), key=lambda item: group[item]):
+                location, event_year = items[idx]
+                place = Loc.Loc()
+                place.event_year = event_year
+                self.find_location(location, place, shutdown)
+                results[idx] = place
+        finally:
+            geodb.db.batch = None
+        return results
+
+    def find_location_by_coord(self, location: str, place: Loc.Loc, coord) -> bool:
+        """
+        Look up a location with the coordinate the ancestry file has for it.  Places within coord_radius of the
+        coordinate that have one of the location names are scored, and the best is used if it is a good match
+        :return: True if found
+        """
+        geodb = self.geo_files.geodb
+        place.parse_place(place_name=location, geo_files=self.geo_files)
+        if place.place_type == Loc.PlaceType.ADVANCED_SEARCH:
+            return False
+        names = {place.target, place.city1, place.admin2_name, place.admin1_name,
+                 GeoKeys.search_normalize(place.prefix, place.country_iso)}
+        rows = [row for row in geodb.reverse_lookup(coord[0], coord[1], self.coord_radius)
+                if row[GeoKeys.Entry.NAME] in names and place.country_iso in ('', row[GeoKeys.Entry.ISO]) and
+                self.valid_year_for_location(place.event_year, row[GeoKeys.Entry.ISO], row[GeoKeys.Entry.ADM1], 60)]
+        if len(rows) == 0:
+            return False
+
+        place.georow_list = rows
+        if geodb.assign_scores(place) >= STRONG_MATCH_SCORE:
+            return False
+        # Lowest score.  Rows are in order of distance, so ties go to the closest
+        place.georow_list = [min(place.georow_list, key=itemgetter(GeoKeys.Entry.SCORE))]
+        place.result_type = GeoKeys.Result.STRONG_MATCH
+        self.process_result(place=place, flags=ResultFlags(limited=False, filtered=False))
+        return True
+
+    def confirm_by_coord(self, place: Loc.Loc, coord):
+        """
+        If the lookup didn't give a strong match, use the match closest to the ancestry file coordinate.
+        The match must be within coord_radius and score well enough for a strong match (see process_results)
+        """
+        if place.result_type == GeoKeys.Result.STRONG_MATCH or len(place.georow_list) == 0:
+            return
+        candidates = [(GeoKeys.get_distance(coord[0], coord[1], row[GeoKeys.Entry.LAT], row[GeoKeys.Entry.LON]), idx)
+                      for idx, row in enumerate(place.georow_list)
+                      if len(row) > GeoKeys.Entry.SCORE and row[GeoKeys.Entry.SCORE] < STRONG_MATCH_SCORE]
+        if len(candidates) == 0:
+            return
+        distance, idx = min(candidates)
+        if distance > self.coord_radius:
+            return
+        place.georow_list = [place.georow_list[idx]]
+        place.result_type = GeoKeys.Result.STRONG_MATCH
+        self.process_result(place=place, flags=ResultFlags(limited=False, filtered=False))
+
+    def find_location_tiered(self, location: str, place: Loc.Loc, shutdown):
+        # Look up location in hot tier (if there is one) and then in DB
+        geodb = self.geo_files.geodb
+        hot_tier = geodb.hot_tier
+        if hot_tier is not None:
+            geodb.db.tier = hot_tier
+            try:
+                self.find_location_in_db(location, place, shutdown)
+            finally:
+                geodb.db.tier = None
+            hit = place.result_type == GeoKeys.Result.STRONG_MATCH
+            hot_tier.add_result(hit)
+            if hit:
+                return
+
+        self.find_location_in_db(location, place, shutdown)
+
+    def find_location_in_db(self, location: str, place: Loc.Loc, shutdown):
+        # Parse location and look it up in DB (or hot tier if it is set in DB)
         place.parse_place(place_name=location, geo_files=self.geo_files)
 
         # Successful Admin1 will also fill in country_iso
@@ -54,23 +192,19 @@ class Geodata:
         if place.country_name == '' and place.country_iso != '':
             place.country_name = self.geo_files.geodb.get_country_name(place.country_iso)
 
-        if shutdown:
-            # During shutdown there is no user verification and no reason to try wildcard searches
-            self.geo_files.geodb.db.use_wildcards = False
-
         flags = ResultFlags(limited=False, filtered=False)
         result_list = []
 
         #self.logger.debug(f'== FIND LOCATION City=[{place.city1}] Adm2=[{place.admin2_name}]\
         #Adm1=[{place.admin1_name}] Pref=[{place.prefix}] Cntry=[{place.country_name}] iso=[{place.country_iso}]  Type={place.place_type} ')
 
-        # Save a shallow copy so we can restore fields
-        self.save_place = copy.copy(place)
+        # Save a shallow copy so we can restore fields.  Kept local so lookups can run from several threads
+        save_place = copy.copy(place)
 
         if place.place_type == Loc.PlaceType.ADVANCED_SEARCH:
             # Lookup location with advanced search params
             self.logger.debug('Advanced Search')
-            self.lookup_by_type(place, result_list, place.place_type, self.save_place)
+            self.lookup_by_type(place, result_list, place.place_type, save_place)
             place.georow_list.clear()
             place.georow_list.extend(result_list)
 
@@ -97,20 +231,20 @@ class Geodata:
         self.update_rowlist_prefix(place=place)
 
         # Restore items
-        place.city1 = self.save_place.city1
-        place.admin2_name = self.save_place.admin2_name
-        place.prefix = self.save_place.prefix
-        place.extra = self.save_place.extra
+        place.city1 = save_place.city1
+        place.admin2_name = save_place.admin2_name
+        place.prefix = save_place.prefix
+        place.extra = save_place.extra
 
         # try alternatives since parsing can be wrong
         # 2) Try a) Prefix  as city, b) Admin2  as city
         place.standard_parse = False
         for ty in [Loc.PlaceType.PREFIX, Loc.PlaceType.ADMIN2]:
-            self.lookup_by_type(place, result_list, ty, self.save_place)
+            self.lookup_by_type(place, result_list, ty, save_place)
 
         # 3) Try city as Admin2
         #self.logger.debug(f'  3) Lkp w Cit as Adm2. Target={place.city1}  pref [{place.prefix}] ')
-        self.lookup_as_admin2(place=place, result_list=result_list, save_place=self.save_place)
+        self.lookup_as_admin2(place=place, result_list=result_list, save_place=save_place)
 
         #  Move result list into place georow list
         place.georow_list.clear()
@@ -124,7 +258,7 @@ class Geodata:
         if len(place.georow_list) == 0:
             # NO MATCH
             self.logger.debug(f'Not found.')
-            # place = self.save_place
+            # place = save_place
             if place.result_type != GeoKeys.Result.NO_COUNTRY and place.result_type != GeoKeys.Result.NOT_SUPPORTED:
                 place.result_type = GeoKeys.Result.NO_MATCH
         elif len(place.georow_list) > 1:
@@ -292,16 +426,20 @@ class Geodata:
         Set all the prefix values in the georow_list
         :param place:
         """
-        temp_place = Loc.Loc()
         tokens = place.original_entry.split(',')
+        titles = self.geo_files.geodb.get_titles(place.georow_list)
+        replace_dct = self.geo_files.output_replace_dct
 
         for idx, rw in enumerate(place.georow_list):
             update = list(rw)
 
             # Put unused fields into prefix
-            self.geo_files.geodb.copy_georow_to_place(rw, temp_place)
-            temp_place.prefix = ''
-            nm = GeoKeys.search_normalize(temp_place.format_full_nm(self.geo_files.output_replace_dct), place.country_iso)
+            nm = titles[(rw[GeoKeys.Entry.ID], rw[GeoKeys.Entry.NAME])][0]
+            # Perform any text replacements user entered into Output Tab
+            if replace_dct:
+                for key in replace_dct:
+                    nm = re.sub(key, replace_dct[key], nm)
+            nm = GeoKeys.search_normalize(nm, place.country_iso)
             # self.logger.debug(f'NAME ={nm}')
             place.prefix = ''
 
@@ -342,7 +480,34 @@ class Geodata:
 
     def read_geonames(self):
         self.progress("Reading Geoname files...", 70)
-        return self.geo_files.read_geoname()
+        err = self.geo_files.read_geoname()
+        if not err:
+            self.geo_files.geodb.db.set_cascade_profile(self.geo_files.cascade_profile)
+            self.open_memo()
+        return err
+
+    def open_memo(self):
+        # Open lookup memo.  Results are kept while the DB and the settings that change results stay the same
+        if not self.memo_enabled:
+            return
+        geo_files = self.geo_files
+        fingerprint = repr((geo_files.required_db_version, geo_files.geodb.get_build_id(),
+                            sorted(geo_files.output_replace_dct.items()), sorted(geo_files.supported_countries_dct),
+                            geo_files.hot_tier_features, geo_files.cascade_profile))
+        path = os.path.join(GeoKeys.get_cache_directory(self.directory), self.memo_name)
+        years = list(country_name_start_year.values()) + list(admin1_name_start_year.values())
+        try:
+            self.lookup_memo = LookupMemo.LookupMemo(path, fingerprint, years)
+        except sqlite3.Error as e:
+            self.logger.warning(f'Cannot open lookup memo {path} {e}')
+            self.lookup_memo = None
+
+    def close(self):
+        # Close lookup memo and DB
+        if self.lookup_memo is not None:
+            self.lookup_memo.close()
+            self.lookup_memo = None
+        self.geo_files.geodb.close()
 
     def progress(self, msg: str, percent: int):
         if self.progress_bar is not None:
@@ -431,8 +596,8 @@ class Geodata:
                 # Name is different.  Add previous item
                 place.georow_list.append(geo_row)
                 idx += 1
-            elif abs(float(prev_geo_row[GeoKeys.Entry.LAT]) - float(geo_row[GeoKeys.Entry.LAT])) + \
-                    abs(float(prev_geo_row[GeoKeys.Entry.LON]) - float(geo_row[GeoKeys.Entry.LON])) > distance_cutoff:
+            elif abs(prev_geo_row[GeoKeys.Entry.LAT] - geo_row[GeoKeys.Entry.LAT]) + \
+                    abs(prev_geo_row[GeoKeys.Entry.LON] - geo_row[GeoKeys.Entry.LON]) > distance_cutoff:
                 # Lat/lon is different from previous item. Add this one
                 place.georow_list.append(geo_row)
                 idx += 1
@@ -459,7 +624,7 @@ class Geodata:
             place.georow_list.append(geo_row)
             prev_score = score
 
-        if min_score < 9 and len(place.georow_list) == 1:
+        if min_score < STRONG_MATCH_SCORE and len(place.georow_list) == 1:
             place.result_type = GeoKeys.Result.STRONG_MATCH
 
         return ResultFlags(limited=limited_flag, filtered=date_filtered)
@@ -500,6 +665,9 @@ result_text_list = {
 
 ResultFlags = collections.namedtuple('ResultFlags', 'limited filtered')
 
+# A single match is strong if its score is under this.  Lower score is better.  See process_results
+STRONG_MATCH_SCORE = 9
+
 # Starting year this country name was valid
 country_name_start_year = {
     'cu': -1,
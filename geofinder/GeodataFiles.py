@@ -19,13 +19,19 @@
 
 import csv
 import logging
+import multiprocessing
 import os
 import time
-from collections import namedtuple
-from tkinter import messagebox
+from collections import namedtuple, deque
 from typing import Dict
 
-from geofinder import CachedDictionary, Country, GeoDB, GeoKeys, Loc, AlternateNames, UtilFeatureFrame
+from geofinder import CachedDictionary, Country, GeoDB, GeoKeys, Loc, AlternateNames, UtilFeatureFrame, GeodataUpdate, Snapshot, \
+    Prefilter, HotTier
+
+# Columns in a geonames.org places file (allCountries.txt, gb.txt, etc)
+Geofile_row = namedtuple('Geofile_row',
+                         'id name name_asc alt lat lon feat_class feat_code iso iso2 admin1_id'
+                         ' admin2_id admin3_id admin4_id pop elev dem timezone mod')
 
 
 class GeodataFiles:
@@ -48,12 +54,37 @@ class GeodataFiles:
     def __init__(self, directory: str, progress_bar):
         self.logger = logging.getLogger(__name__)
         self.geodb = None
-        self.required_db_version = 2
-        self.db_upgrade_text = 'Adding support for non-English output'
+        self.required_db_version = 4
+        self.db_upgrade_text = 'Lookups get the best candidates first'
         self.directory: str = directory
         self.progress_bar = progress_bar
         self.line_num = 0
         self.cache_changed: bool = False
+        # Parallel build - files larger than threshold are split into shards and parsed by a pool of worker processes.
+        # Set build_workers from [BUILD] WORKERS in geofinder.ini.  1 for a serial build
+        self.build_workers = max(1, (os.cpu_count() or 1) - 1)
+        self.parallel_threshold = 64 * 1024 * 1024
+        # Each shard comes back as one batch of rows and at most build_workers * 2 batches are in flight, so this
+        # process holds the rows for about shard_size * build_workers * 2 bytes of input
+        self.shard_size = 4 * 1024 * 1024
+        # Build commits and records its progress every checkpoint_size bytes of input so it can be resumed
+        self.checkpoint_size = 64 * 1024 * 1024
+        self.build_rows = 0
+        self.checkpoint_pos = 0
+        # Serve lookups from a memory mapped snapshot of the DB.  See Snapshot.py
+        self.snapshot_enabled = True
+        # Tiered lookup.  Admin rows and geodata rows with these feature codes are held in memory and lookups only go
+        # to the full DB when they don't give a strong match.  Empty list for no tier.  See HotTier.py
+        self.hot_tier_features = []
+        # Open an existing DB read only.  There is no build, update or country list change, and lookups can run from
+        # several threads or processes against the same file.  See GeoDB read_only
+        self.read_only = False
+        # Trigram index of names for '*' patterns and infix searches.  Adds about three times the name text to the DB
+        self.trigram_index_enabled = True
+        # Stop rules for the query cascade: legacy, interactive, batch or strict.  See DB.cascade_profiles
+        self.cascade_profile = 'legacy'
+        # How the DB is held for queries: disk, mmap or memory (read only mode).  See DB.storage_profiles
+        self.storage_profile = 'disk'
         sub_dir = GeoKeys.get_cache_directory(self.directory)
         self.country = None
 
@@ -73,6 +104,8 @@ class GeodataFiles:
         self.supported_countries_cd = CachedDictionary.CachedDictionary(sub_dir, "country_list.pkl")
         self.supported_countries_cd.read()
         self.supported_countries_dct: Dict[str, str] = self.supported_countries_cd.dict
+        # Countries to load from geonames files.  All supported countries for a full build, new countries on update
+        self.build_countries_dct: Dict[str, str] = self.supported_countries_dct
 
         # Read in dictionary listing languages (ISO2) we should include
         self.languages_list_cd = CachedDictionary.CachedDictionary(sub_dir, "languages_list.pkl")
@@ -100,6 +133,10 @@ class GeodataFiles:
                                                              geo_files=self, progress_bar=self.progress_bar,
                                                              filename='alternateNamesV2.txt', lang_list=self.lang_list)
 
+        # Support for Geonames daily modification and deletion files.  Applies updates to an existing DB
+        self.geodata_update = GeodataUpdate.GeodataUpdate(directory_name=self.directory,
+                                                          progress_bar=self.progress_bar, geo_files=self)
+
     def read(self) -> bool:
         """
         .. module:: read
@@ -115,6 +152,7 @@ class GeodataFiles:
 
         err = self.supported_countries_cd.read()
         self.supported_countries_dct = self.supported_countries_cd.dict
+        self.build_countries_dct = self.supported_countries_dct
         if err:
             self.logger.error('Error reading  supported countries')
             return True
@@ -136,16 +174,35 @@ class GeodataFiles:
         db_path = os.path.join(cache_dir, 'geodata.db')
         self.logger.debug(f'path for geodata.db: {db_path}')
         err_msg = ''
+        resume = False
+
+        if self.read_only:
+            return self.open_read_only(db_path)
 
         # Validate Database setup
         if os.path.exists(db_path):
             # See if db is fresh (newer than other files)
             self.logger.debug(f'DB found at {db_path}')
-            self.geodb = GeoDB.GeoDB(db_path=db_path, version=self.required_db_version)
+            self.geodb = GeoDB.GeoDB(db_path=db_path, version=self.required_db_version, storage=self.storage_profile)
 
             # Make sure DB is correct version
             ver = self.geodb.get_db_version()
-            if ver != self.required_db_version:
+            if ver in [2, 3] and self.required_db_version == 4:
+                # V2 and V3 tables are converted in place rather than rebuilt.  The message goes through show_message
+                # so it is logged when there is no display (a tkinter message box here stopped command line tools).
+                # Read only opens don't convert.  See open_read_only
+                GeoKeys.show_message('showinfo', 'Database', f'Database version will be upgraded:\n\n{self.db_upgrade_text}\n\n'
+                                    f'Upgrading database from V{ver} to V{self.required_db_version}.')
+                if ver == 2:
+                    self.geodb.migrate_v3()
+                self.geodb.migrate_v4()
+                ver = self.geodb.get_db_version()
+
+            if ver == -1 and self.geodb.get_build_state('country')[2] and self.geodb.db.table_exists('geodata_tbl'):
+                # Build was cancelled or failed.  Pick up where it stopped
+                err_msg = 'Database build was not finished.\n\nResuming database build'
+                resume = True
+            elif ver != self.required_db_version:
                 err_msg = f'Database version will be upgraded:\n\n{self.db_upgrade_text}\n\n' \
                     f'Upgrading database from V{ver} to V{self.required_db_version}.'
             else:
@@ -155,7 +212,8 @@ class GeodataFiles:
                 #if cache_time > dir_time:
                 if True:
                     self.logger.info(f'DB is up to date')
-                    # Ensure DB has reasonable number of records
+                    # Ensure DB has reasonable number of records.  Snapshot has the count so no table scan is needed
+                    self.open_snapshot(export=False)
                     count = self.geodb.get_row_count()
                     self.logger.info(f'Geoname entries = {count:,}')
                     if count < 1000:
@@ -164,7 +222,7 @@ class GeodataFiles:
                 if False:
                     # DB is stale
                     err_msg = f'DB {db_path} is older than geonames.org files.  Rebuilding DB '
-                    if not messagebox.askyesno('Stale Database','Database is older than geonames.org files.\n\nRebuild database?'):
+                    if not GeoKeys.show_message('askyesno', 'Stale Database','Database is older than geonames.org files.\n\nRebuild database?'):
                         err_msg = ''
         else:
             err_msg = f'Database not found at\n\n{db_path}.\n\nBuilding DB'
@@ -174,13 +232,35 @@ class GeodataFiles:
             # No DB errors detected
             self.geodb.create_indices()
             self.geodb.create_geoid_index()
+
+            # Add or remove countries if the country list changed
+            self.geodb.create_update_tables()
+            if self.update_countries():
+                return True
+
+            # Apply any new geonames.org update files
+            count = self.geodata_update.apply_updates()
+            if count > 0:
+                self.logger.info(f'Applied {count} geonames update files')
+            self.progress("Building place titles...", 95)
+            self.geodb.update_titles()
+            self.progress("Building name index...", 97)
+            self.geodb.update_name_index()
+            self.geodb.update_trigram_index(self.trigram_index_enabled)
+            self.progress("Building spatial index...", 98)
+            self.geodb.update_rtree()
+            self.open_snapshot(export=True)
+            self.open_hot_tier()
             return False
 
         # DB error detected - rebuild database
         self.logger.debug('message box')
-        messagebox.showinfo('Database Error', err_msg)
+        GeoKeys.show_message('showinfo', 'Database Error', err_msg)
         self.logger.debug('message box done')
 
+        if resume:
+            return self.build_db()
+
         # DB  error.  Rebuild it from geoname files
         self.logger.debug(err_msg)
 
@@ -189,29 +269,65 @@ class GeodataFiles:
             os.remove(db_path)
             self.logger.debug('Database deleted')
 
-        self.geodb = GeoDB.GeoDB(db_path=db_path, version=self.required_db_version)
+        self.geodb = GeoDB.GeoDB(db_path=db_path, version=self.required_db_version, storage=self.storage_profile)
+        return self.build_db()
+
+    def open_read_only(self, db_path) -> bool:
+        # Open DB in read only mode.  DB must exist and be the current version.  Older versions aren't converted,
+        # since that writes to the DB.  Open it once without read only to convert it.  Returns True if error
+        try:
+            self.geodb = GeoDB.GeoDB(db_path=db_path, version=self.required_db_version, read_only=True,
+                                     storage=self.storage_profile)
+        except ValueError as e:
+            self.logger.error(f'Cannot open {db_path} read only: {e}')
+            return True
+        ver = self.geodb.get_db_version()
+        if ver != self.required_db_version:
+            self.logger.error(f'Database is V{ver}.  V{self.required_db_version} is required for read only mode.  '
+                              f'Open it without read only to upgrade it')
+            return True
+        self.geodb.update_titles()
+        self.geodb.update_name_index()
+        self.geodb.update_trigram_index(self.trigram_index_enabled)
+        self.geodb.update_rtree()
+        self.open_snapshot(export=False)
+        self.open_hot_tier()
+        self.logger.info(f'Database opened read only.  Storage {self.geodb.db.get_storage_stats()}')
+        return False
+
+    def build_db(self) -> bool:
+        """
+        Build DB from the geonames files.  Progress for each step is recorded in the build_state table and
+        the geonames and alternate names files are committed at checkpoints, so a build that is cancelled or
+        fails is resumed from the last checkpoint on the next start.
+        :return: True if error
+        """
+        self.geodb.create_tables()
         self.country = Country.Country(self.progress_bar, geodb=self.geodb, lang_list=self.lang_list)
 
-        # walk thru list of files ending in .txt e.g US.txt, FR.txt, all_countries.txt, etc
-        file_count = 0
+        # Gather inserts into large batches for the build
+        self.geodb.begin_bulk_load()
 
-        # Put in country data
-        self.country.read()
+        if not self.geodb.get_build_state('country')[2]:
+            # New build.  Set DB version as -1 for incomplete
+            self.geodb.insert_version(-1)
 
-        start_time = time.time()
+            # Put in country data
+            self.country.read()
+            self.geodb.db.begin()
+            self.geodb.set_build_state('country', 0, 0, True)
+            self.geodb.db.commit()
+        else:
+            self.logger.info('Resuming database build')
 
-        # Set DB version as -1 for incomplete
-        self.geodb.insert_version(-1)
+        start_time = time.time()
 
+        # walk thru list of files ending in .txt e.g US.txt, FR.txt, all_countries.txt, etc
         # Put in geonames file data
-        for fname in ['allCountries.txt', 'ca.txt', 'gb.txt', 'de.txt', 'fr.txt', 'nl.txt']:
-            # Read all geoname files
-            error = self.read_geoname_file(fname)  # Read in info (lat/long) for all places from
-
-            if error:
-                self.logger.error(f'Error reading geoname file {fname}')
-            else:
-                file_count += 1
+        self.build_countries_dct = self.supported_countries_dct
+        file_count = self.read_geoname_files(resumable=True)
+        if self.shutdown_requested():
+            return self.stop_build()
 
         if file_count == 0:
             self.logger.error(f'No geonames files found in {os.path.join(self.directory, "*.txt")}')
@@ -221,7 +337,12 @@ class GeodataFiles:
         self.logger.info(f'geonames files done.  Elapsed ={time.time() - start_time}')
 
         start_time = time.time()
-        self.alternate_names.read()
+        # Alternate names are joined to entries by geoid
+        self.geodb.create_geoid_index()
+        self.alternate_names.read(resumable=True)
+        if self.shutdown_requested():
+            return self.stop_build()
+        self.geodb.end_bulk_load()
         self.logger.info(f'Alternate names done.  Elapsed ={time.time() - start_time}')
         self.logger.info(f'Geonames entries = {self.geodb.get_row_count():,}')
 
@@ -232,9 +353,151 @@ class GeodataFiles:
         self.logger.debug(f'Indices done.  Elapsed ={time.time() - start_time}')
         self.geodb.insert_version(self.required_db_version)
 
+        self.geodb.insert_loaded_countries(self.supported_countries_dct)
+
+        # Update files in directory are older than the geonames files we just loaded
+        self.geodata_update.mark_all_applied()
+
+        self.geodb.new_build_id()
+        self.progress("Building place titles...", 95)
+        self.geodb.update_titles()
+        self.progress("Building name index...", 97)
+        self.geodb.update_name_index()
+        self.geodb.update_trigram_index(self.trigram_index_enabled)
+        self.progress("Building spatial index...", 98)
+        self.geodb.update_rtree()
+        self.open_snapshot(export=True)
+        self.open_hot_tier()
         return False
 
-    def read_geoname_file(self, file) -> bool:  # , g_dict
+    def open_snapshot(self, export: bool):
+        """
+        Use the snapshot of the DB for lookups if it is current
+        :param export: If there isn't a current snapshot, write one
+        """
+        if not self.snapshot_enabled:
+            return
+        path = os.path.join(GeoKeys.get_cache_directory(self.directory), 'geodata.snap')
+        if export and self.geodb.get_build_id() == '':
+            # DB from before build IDs were recorded
+            self.geodb.new_build_id()
+        build_id = self.geodb.get_build_id()
+        snapshot = Snapshot.open_snapshot(path, build_id)
+        if snapshot is None and export:
+            self.progress("Writing database snapshot...", 98)
+            start_time = time.time()
+            try:
+                Snapshot.export_snapshot(self.geodb, path)
+            except OSError as e:
+                self.logger.warning(f'Cannot write snapshot {path} {e}')
+            else:
+                self.logger.info(f'Snapshot done.  Elapsed ={time.time() - start_time:.1f}')
+                snapshot = Snapshot.open_snapshot(path, build_id)
+        self.geodb.set_snapshot(snapshot)
+
+    def open_hot_tier(self):
+        # Load the hot tier for tiered lookups
+        if len(self.hot_tier_features) == 0:
+            self.geodb.set_hot_tier(None)
+            return
+        self.geodb.set_hot_tier(HotTier.HotTier(self.geodb, self.hot_tier_features))
+
+    def stop_build(self) -> bool:
+        # User cancelled build.  Everything up to the last checkpoint is committed and DB version stays -1
+        self.geodb.end_bulk_load()
+        if self.geodb.db.conn.in_transaction:
+            self.geodb.db.commit()
+        # Other connections (e.g. a new build process) can read the build state
+        self.geodb.db.release_lock()
+        self.logger.info('Database build stopped')
+        return False
+
+    def shutdown_requested(self) -> bool:
+        return self.progress_bar is not None and self.progress_bar.shutdown_requested
+
+    def checkpoint(self, file, file_pos, resumable, done=False, stop=False):
+        """
+        Commit all rows read so far.  For a resumable build, also record how far we got in file.
+        Starts a new transaction unless file is done or we are stopping
+        """
+        self.geodb.flush_bulk()
+        if resumable:
+            self.geodb.set_build_state(file, file_pos, self.build_rows, done)
+        self.geodb.db.commit()
+        self.checkpoint_pos = file_pos
+        if not done and not stop:
+            self.geodb.db.begin()
+
+    def read_geoname_files(self, resumable=False) -> int:
+        """
+        Read all the geonames files in the directory
+        :param resumable: Record progress in build_state table and resume each file from its last checkpoint
+        :return: Number of files read
+        """
+        file_count = 0
+        for fname in ['allCountries.txt', 'ca.txt', 'gb.txt', 'de.txt', 'fr.txt', 'nl.txt']:
+            # Read all geoname files
+            error = self.read_geoname_file(fname, resumable)  # Read in info (lat/long) for all places from
+
+            if error:
+                self.logger.error(f'Error reading geoname file {fname}')
+            else:
+                file_count += 1
+            if self.shutdown_requested():
+                break
+        return file_count
+
+    def update_countries(self) -> bool:
+        """
+        Add or remove countries in DB to match the supported country list rather than rebuilding the DB.
+        Only the geonames entries and alternate names for the changed countries are loaded or deleted.
+        :return: True if error
+        """
+        loaded = self.geodb.get_loaded_countries()
+        if len(loaded) == 0:
+            # DB was built before loaded countries were recorded.  It was built with the current list
+            self.geodb.insert_loaded_countries(self.supported_countries_dct)
+            return False
+
+        for iso in loaded:
+            if iso not in self.supported_countries_dct:
+                self.logger.info(f'Removing country {iso}')
+                self.geodb.delete_country(iso)
+
+        added = [iso for iso in self.supported_countries_dct if iso not in loaded]
+        if len(added) == 0:
+            return False
+
+        self.logger.info(f'Adding countries {added}')
+        start_time = time.time()
+        for iso in added:
+            # Clear out any partial load from an earlier cancelled update
+            self.geodb.delete_country(iso)
+
+        # Derived tables (titles, name indices, spatial index) get rows for just the new countries
+        current = self.geodb.get_current_derived()
+        self.build_countries_dct = {iso: '' for iso in added}
+        self.geodb.begin_bulk_load()
+        file_count = self.read_geoname_files()
+        if file_count > 0 and not self.shutdown_requested():
+            # Alternate names are only added for the geoids loaded above
+            self.alternate_names.read()
+        self.geodb.end_bulk_load()
+        self.build_countries_dct = self.supported_countries_dct
+        # Rows loaded before a cancel are in the derived tables too, so they are removed with the partial load
+        self.geodb.add_country_derived(added, current)
+
+        if file_count == 0:
+            self.logger.error(f'No geonames files found in {os.path.join(self.directory, "*.txt")}')
+            return True
+        if self.shutdown_requested():
+            # Cancelled.  Countries will be loaded again next time
+            return False
+        self.geodb.insert_loaded_countries(added)
+        self.logger.info(f'Countries added.  Elapsed ={time.time() - start_time}')
+        return False
+
+    def read_geoname_file(self, file, resumable=False) -> bool:  # , g_dict
         """Read in geonames files and build lookup structure
 
         Read a geoname.org places file and create a db of all the places.
@@ -242,59 +505,155 @@ class GeodataFiles:
         district2_id, feat_code
 
         2. Since Geonames supports over 25M entries, the db is filtered to only the countries and feature types we want
+
+        3. Rows are committed every checkpoint_size bytes.  If resumable, progress is recorded in the build_state
+        table and reading starts from the last checkpoint
+        :return: True if file not found
         """
-        Geofile_row = namedtuple('Geofile_row',
-                                 'id name name_asc alt lat lon feat_class feat_code iso iso2 admin1_id'
-                                 ' admin2_id admin3_id admin4_id pop elev dem timezone mod')
         self.line_num = 0
         self.progress("Reading {}...".format(file), 0)
         path = os.path.join(self.directory, file)
 
         if os.path.exists(path):
             fsize = os.path.getsize(path)
-            bytes_per_line = 128
-            with open(path, 'r', newline="", encoding='utf-8', errors='replace') as geofile:
-                self.progress("Building Database from {}".format(file), 2)  # initialize progress bar
-                reader = csv.reader(geofile, delimiter='\t')
-                self.geodb.db.begin()
-
-                # Map line from csv reader into GeonameData namedtuple
-                for line in reader:
-                    self.line_num += 1
-                    if self.line_num % 20000 == 0:
-                        # Periodically update progress
-                        prog = self.line_num * bytes_per_line * 100 / fsize
-                        self.progress(msg=f"1) Building Database from {file}            {prog:.1f}%", val=prog)
-                    try:
-                        geoname_row = Geofile_row._make(line)
-                    except TypeError:
-                        self.logger.error(f'Unable to parse geoname location info in {file}  line {self.line_num}')
+            start_pos, self.build_rows, done = 0, 0, False
+            if resumable:
+                start_pos, self.build_rows, done = self.geodb.get_build_state(file)
+                if done:
+                    return False
+            self.checkpoint_pos = start_pos
+
+            if self.build_workers > 1 and fsize - start_pos > self.parallel_threshold:
+                return self.read_geoname_file_parallel(file, path, fsize, start_pos, resumable)
+
+            # Only lines with a country and feature we follow are decoded and parsed
+            pattern = Prefilter.geoname_pattern(self.build_countries_dct, self.feature_code_list_dct)
+            self.progress("Building Database from {}".format(file), 2)  # initialize progress bar
+            self.geodb.db.begin()
+
+            for file_pos, line_count, lines in Prefilter.scan_file(path, pattern, start=start_pos):
+                for line_num, text in lines:
+                    geoname_row = parse_geoname_line(text)
+                    if geoname_row is None:
+                        self.logger.error(f'Unable to parse geoname location info in {file}  line {line_num}')
                         continue
 
                     # Only handle line if it's  for a country we follow and its
                     # for a Feature tag we're interested in
-                    if geoname_row.iso.lower() in self.supported_countries_dct and \
+                    if geoname_row.iso.lower() in self.build_countries_dct and \
                             geoname_row.feat_code in self.feature_code_list_dct:
-                        self.insert_georow(geoname_row)
+                        self.build_rows += self.insert_georow(geoname_row)
                         if geoname_row.name.lower() != GeoKeys.normalize(geoname_row.name):
                             self.geodb.insert_alternate_name(geoname_row.name,
                                                                    geoname_row.id, 'ut8')
 
-                    if self.progress_bar is not None:
-                        if self.progress_bar.shutdown_requested:
-                            # Abort DB build.  Clear out partial DB
-                            self.geodb.clear_geoname_data()
+                # Periodically update progress
+                self.line_num = line_count
+                prog = file_pos * 100 / fsize
+                self.progress(msg=f"1) Building Database from {file}            {prog:.1f}%", val=prog)
+
+                if self.shutdown_requested():
+                    # User cancelled.  Commit what we have read so far and stop
+                    self.checkpoint(file, file_pos, resumable, stop=True)
+                    return False
+                if file_pos - self.checkpoint_pos >= self.checkpoint_size:
+                    self.checkpoint(file, file_pos, resumable)
 
             self.progress("Write Database", 90)
-            self.geodb.db.commit()
+            self.checkpoint(file, fsize, resumable, done=True)
             self.progress("Database created", 100)
             return False
         else:
             return True
 
-    def insert_georow(self, geoname_row):
-        # Create Geo_row and inses
+    def read_geoname_file_parallel(self, file, path, fsize, start_pos, resumable) -> bool:
+        """
+        Parallel version of read_geoname_file.  The file is split into byte range shards which are parsed,
+        filtered, normalized and given soundex codes by a pool of worker processes.  The resulting rows are
+        streamed back in file order and written to the DB by this process (the only SQLite writer).
+        Checkpoints are at shard boundaries
+        """
+        shards = ((path, start, min(start + self.shard_size, fsize), self.build_countries_dct,
+                   self.feature_code_list_dct) for start in range(start_pos, fsize, self.shard_size))
+        self.logger.info(f'Reading {file} with {self.build_workers} workers, {-(-(fsize - start_pos) // self.shard_size)} shards')
+        self.shard_end = start_pos
+
+        self.progress("Building Database from {}".format(file), 2)  # initialize progress bar
+        self.geodb.db.begin()
+
+        # Keep a bounded number of shards in flight so parsed rows don't pile up in memory.  A shard is only
+        # submitted when an earlier one has been written
+        max_pending = self.build_workers * 2
+        pending = deque()
+        cancelled = False
+
+        with multiprocessing.Pool(processes=self.build_workers) as pool:
+            for shard in shards:
+                if len(pending) >= max_pending:
+                    cancelled = self.write_shard(file, fsize, pending.popleft().get(), resumable)
+                    if cancelled:
+                        break
+                pending.append(pool.apply_async(read_geoname_shard, (shard,)))
+
+            while len(pending) > 0 and not cancelled:
+                cancelled = self.write_shard(file, fsize, pending.popleft().get(), resumable)
+
+            if cancelled:
+                pool.terminate()
+
+        if cancelled:
+            # User cancelled.  Commit the shards written so far and stop
+            self.checkpoint(file, self.shard_end, resumable, stop=True)
+            return False
+
+        self.progress("Write Database", 90)
+        self.checkpoint(file, fsize, resumable, done=True)
+        self.progress("Database created", 100)
+        return False
+
+    def write_shard(self, file, fsize, shard_result, resumable) -> bool:
+        """
+        Write the rows from one shard to DB.
+        :return: True if user requested cancel
+        """
+        end, line_count, bad_lines, geo_rows, alt_rows = shard_result
+        self.line_num += line_count
+        for line_num in bad_lines:
+            self.logger.error(f'Unable to parse geoname location info in {file}  line {self.line_num - line_count + line_num}')
+
+        for geo_row, feat_code, priority in geo_rows:
+            self.geodb.insert(geo_row=geo_row, feat_code=feat_code, priority=priority)
+        for name, geoid, lang in alt_rows:
+            self.geodb.insert_alternate_name(name, geoid, lang)
+        self.build_rows += len(geo_rows)
+        self.shard_end = end
+
+        prog = end * 100 / fsize
+        self.progress(msg=f"1) Building Database from {file}            {prog:.1f}%", val=prog)
+
+        if self.shutdown_requested():
+            return True
+        if end - self.checkpoint_pos >= self.checkpoint_size:
+            self.checkpoint(file, end, resumable)
+        return False
+
+    def insert_georow(self, geoname_row) -> int:
+        # Create Geo_rows and insert them.  Returns number of rows
+        geo_rows = self.make_georows(geoname_row)
+        for geo_row, feat_code, priority in geo_rows:
+            self.geodb.insert(geo_row=geo_row, feat_code=feat_code, priority=priority)
+        return len(geo_rows)
+
+    @staticmethod
+    def make_georows(geoname_row) -> []:
+        """
+        Create the DB rows for a geonames row
+        :param geoname_row: Geofile_row
+        :return: list of (geo_row, feature code, priority).  US states have an extra row for their abbreviation.
+        Priority is from the feature and population (see GeoDB.rank_priority)
+        """
         # ('paris', 'fr', '07', '012', 12.345, 45.123, 'PPL', '34124')
+        res = []
         geo_row = [None] * GeoDB.Entry.MAX
         geo_row[GeoDB.Entry.NAME] = GeoKeys.normalize(geoname_row.name)
         geo_row[GeoDB.Entry.SDX] = GeoKeys.get_soundex(geo_row[GeoDB.Entry.NAME])
@@ -317,12 +676,15 @@ class GeodataFiles:
         #if geoname_row.feat_code == 'PPLQ':
         #    geo_row[GeoDB.Entry.NAME] = re.sub(r' historical', '', geo_row[GeoDB.Entry.NAME])
 
-        self.geodb.insert(geo_row=geo_row, feat_code=geoname_row.feat_code)
+        priority = GeoDB.rank_priority(geo_row[GeoDB.Entry.FEAT], geoname_row.pop)
+        res.append((tuple(geo_row), geoname_row.feat_code, priority))
 
         # Also add abbreviations for USA states
         if geo_row[GeoDB.Entry.ISO] == 'us' and geoname_row.feat_code == 'ADM1':
             geo_row[GeoDB.Entry.NAME] = geo_row[GeoDB.Entry.ADM1].lower()
-            self.geodb.insert(geo_row=geo_row, feat_code=geoname_row.feat_code)
+            res.append((tuple(geo_row), geoname_row.feat_code, priority))
+
+        return res
 
     def get_supported_countries(self) -> [str, int]:
         """ Convert list of supported countries into sorted string """
@@ -341,3 +703,47 @@ class GeodataFiles:
 
         if self.progress_bar is not None:
             self.progress_bar.update_progress(val, msg)
+
+
+def read_geoname_shard(shard) -> ():
+    """
+    Read one byte range of a geonames file through Prefilter.  This runs in a worker process for
+    GeodataFiles.read_geoname_file_parallel.
+    A line belongs to the shard that contains its first byte.
+    :param shard: (path, start, end, supported countries dict, feature code dict)
+    :return: (end, line count, list of bad line numbers, list of (geo_row, feat_code, priority), list of (alt name, geoid, lang))
+    """
+    path, start, end, supported_countries_dct, feature_code_list_dct = shard
+    pattern = Prefilter.geoname_pattern(supported_countries_dct, feature_code_list_dct)
+
+    geo_rows = []
+    alt_rows = []
+    bad_lines = []
+    line_count = 0
+    for file_pos, line_count, lines in Prefilter.scan_file(path, pattern, start, end):
+        for line_num, text in lines:
+            geoname_row = parse_geoname_line(text)
+            if geoname_row is None:
+                bad_lines.append(line_num)
+                continue
+
+            # Only handle line if it's  for a country we follow and its
+            # for a Feature tag we're interested in
+            if geoname_row.iso.lower() in supported_countries_dct and \
+                    geoname_row.feat_code in feature_code_list_dct:
+                geo_rows.extend(GeodataFiles.make_georows(geoname_row))
+                if geoname_row.name.lower() != GeoKeys.normalize(geoname_row.name):
+                    alt_rows.append((geoname_row.name, geoname_row.id, 'ut8'))
+
+    return end, line_count, bad_lines, geo_rows, alt_rows
+
+
+def parse_geoname_line(text):
+    """
+    Split a geonames places file line into columns
+    :return: Geofile_row or None if the line doesn't have the right number of columns
+    """
+    try:
+        return Geofile_row._make(next(csv.reader([text], delimiter='\t')))
+    except (TypeError, StopIteration):
+        return None
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import glob
+import os
+import re
+import time
+
+from geofinder import GeodataFiles, GeoKeys
+from geofinder.AlternateNames import ALT_ID, ALT_GEOID, ALT_LANG, ALT_NAME
+from geofinder.FileReader import FileReader
+from geofinder.GeoKeys import Entry
+
+# geonames.org daily update files, in the order they are applied for each date
+MODIFICATIONS = 'modifications'
+DELETES = 'deletes'
+ALT_MODIFICATIONS = 'alternateNamesModifications'
+ALT_DELETES = 'alternateNamesDeletes'
+update_types = [MODIFICATIONS, DELETES, ALT_MODIFICATIONS, ALT_DELETES]
+
+# Columns in geonames deletes file
+DEL_GEOID = 0
+
+# Columns in geonames alternateNamesDeletes file
+ALT_DEL_ID = 0
+ALT_DEL_GEOID = 1
+ALT_DEL_NAME = 2
+
+
+class GeodataUpdate(FileReader):
+    """
+    Apply geonames.org daily update files to an existing geoname DB rather than rebuilding it.
+
+    Reads modifications-YYYY-MM-DD.txt, deletes-YYYY-MM-DD.txt, alternateNamesModifications-YYYY-MM-DD.txt
+    and alternateNamesDeletes-YYYY-MM-DD.txt from the geoname data directory, in date order.  Rows are upserted by
+    geoid using the same country/feature filter and name normalization as the DB build.  Each file is applied in
+    a single transaction and recorded in the update_log table so it is only applied once.
+    FileReader calls handle_line every time it reads a line
+    """
+
+    def __init__(self, directory_name: str, progress_bar, geo_files: GeodataFiles):
+        super().__init__(directory_name, '', progress_bar)
+        self.geo_files: GeodataFiles.GeodataFiles = geo_files
+        self.update_type = ''
+        self.cancelled = False
+        # Geoids changed by the current file and their rows before the change.  See note_change
+        self.geoids = set()
+        self.old_rows = []
+
+    def get_update_files(self) -> []:
+        """
+        Find the geonames update files in the data directory
+        :return: list of file names sorted by date and then in update_types order
+        """
+        res = []
+        for path in glob.glob(os.path.join(self.directory, '*-*-*-*.txt')):
+            fname = os.path.basename(path)
+            match = re.match(r'^([a-zA-Z]+)-(\d\d\d\d-\d\d-\d\d)\.txt$', fname)
+            if match and match.group(1) in update_types:
+                res.append((match.group(2), update_types.index(match.group(1)), fname))
+        res.sort()
+        return [fname for date, idx, fname in res]
+
+    def mark_all_applied(self):
+        # A new DB built from a full geonames download already includes the update files in the directory
+        geodb = self.geo_files.geodb
+        geodb.create_update_tables()
+        geodb.db.begin()
+        for fname in self.get_update_files():
+            geodb.insert_applied_update(fname)
+        geodb.db.commit()
+
+    def apply_updates(self) -> int:
+        """
+        Apply any update files that have not yet been applied to DB
+        :return: Number of files applied
+        """
+        geodb = self.geo_files.geodb
+        geodb.create_update_tables()
+        applied = geodb.get_applied_updates()
+        current = geodb.get_current_derived()
+        count = 0
+
+        for fname in self.get_update_files():
+            if fname in applied:
+                continue
+            start_time = time.time()
+            self.fname = fname
+            self.update_type = fname.split('-')[0]
+            self.count = 0
+            self.geoids = set()
+            self.old_rows = []
+
+            geodb.db.begin()
+            self.read()
+            # Derived tables are updated for the changed geoids in the same transaction and stay current
+            geodb.update_geoid_derived(self.geoids, self.old_rows, current)
+            if self.cancelled:
+                # Partial file is committed but not logged.  Updates are idempotent so it is re-applied next time
+                geodb.db.commit()
+                self.logger.info(f'Update cancelled in {fname}')
+                break
+            geodb.insert_applied_update(fname)
+            geodb.db.commit()
+            count += 1
+            self.logger.info(f'Applied {fname}.  Elapsed ={time.time() - start_time:.1f}')
+
+        if count > 0 or self.cancelled:
+            geodb.new_build_id(keep=current)
+        return count
+
+    def note_change(self, geoid):
+        # Record a geoid about to be changed and its rows before the file's first change to it.  See GeoDB.update_geoid_derived
+        if geoid not in self.geoids:
+            self.geoids.add(geoid)
+            self.old_rows.extend(self.geo_files.geodb.get_geoid_rows(geoid))
+
+    def cancel(self):
+        # User requested cancel
+        self.cancelled = True
+
+    def handle_line(self, line_num, row):
+        # This is called as each line is read
+        if self.cancelled:
+            return
+        tokens = row.rstrip('\r\n').split('\t')
+
+        if self.update_type == MODIFICATIONS:
+            try:
+                geoname_row = GeodataFiles.Geofile_row._make(tokens)
+            except TypeError:
+                self.logger.debug(f'Incorrect number of tokens: {tokens} {self.fname} line {line_num}')
+                return
+            self.update_geoname(geoname_row)
+        elif self.update_type == DELETES:
+            self.note_change(tokens[DEL_GEOID])
+            self.geo_files.geodb.delete_place(tokens[DEL_GEOID])
+        elif self.update_type == ALT_MODIFICATIONS:
+            if len(tokens) != 10:
+                self.logger.debug(f'Incorrect number of tokens: {tokens} {self.fname} line {line_num}')
+                return
+            self.remove_alternate_name(tokens[ALT_ID])
+            if tokens[ALT_LANG] in self.geo_files.lang_list:
+                self.add_alternate_name(tokens[ALT_ID], tokens[ALT_GEOID], tokens[ALT_NAME], tokens[ALT_LANG])
+        elif self.update_type == ALT_DELETES:
+            if len(tokens) < 3:
+                self.logger.debug(f'Incorrect number of tokens: {tokens} {self.fname} line {line_num}')
+                return
+            if not self.remove_alternate_name(tokens[ALT_DEL_ID]):
+                # Alternate name ID not recorded (DB built before IDs were tracked).  Remove by geoid and name
+                self.remove_alias(tokens[ALT_DEL_GEOID], tokens[ALT_DEL_NAME], None)
+        self.count += 1
+
+    def update_geoname(self, geoname_row):
+        """
+        Insert or replace the rows for a modified geonames entry.  Alternate names previously added for the
+        geoid are kept and take the new location, admin IDs and feature.  Entries that no longer pass the
+        country and feature filter are deleted
+        """
+        geodb = self.geo_files.geodb
+        self.note_change(geoname_row.id)
+        old_rows = geodb.get_geoid_rows(geoname_row.id)
+
+        if geoname_row.iso.lower() not in self.geo_files.supported_countries_dct or \
+                geoname_row.feat_code not in self.geo_files.feature_code_list_dct:
+            if len(old_rows) > 0:
+                geodb.delete_place(geoname_row.id)
+            return
+
+        # Rows after the primary name (and US state abbreviation) are alternate names
+        alias_rows = old_rows[self.primary_row_count(old_rows):]
+
+        geodb.delete_geoid(geoname_row.id)
+        new_rows = GeodataFiles.GeodataFiles.make_georows(geoname_row)
+        names = set()
+        for geo_row, feat_code, priority in new_rows:
+            geodb.insert(geo_row=geo_row, feat_code=feat_code, priority=priority)
+            names.add(geo_row[Entry.NAME])
+
+        primary_row, feat_code, priority = new_rows[0]
+        for tbl, row_id, row in alias_rows:
+            if row[Entry.NAME] in names:
+                continue
+            names.add(row[Entry.NAME])
+            lst = list(primary_row)
+            lst[Entry.NAME] = row[Entry.NAME]
+            lst[Entry.SDX] = row[Entry.SDX]
+            geodb.insert(geo_row=tuple(lst), feat_code=feat_code, priority=priority)
+
+        # Replace UT8 version of name
+        geodb.delete_alternate_names(geoname_row.id, lang='ut8')
+        if geoname_row.name.lower() != GeoKeys.normalize(geoname_row.name):
+            geodb.insert_alternate_name(geoname_row.name, geoname_row.id, 'ut8')
+
+    def add_alternate_name(self, alt_id, geoid, name, lang):
+        # Add an alternate name for a geoid in DB.  Same rules as AlternateNames.handle_line
+        geodb = self.geo_files.geodb
+        old_rows = geodb.get_geoid_rows(geoid)
+        if len(old_rows) == 0:
+            # Geoid is not in DB (filtered out by country or feature)
+            return
+
+        self.note_change(geoid)
+        tbl, row_id, primary_row = old_rows[0]
+        lst = list(primary_row)
+        lst[Entry.NAME] = GeoKeys.normalize(name)
+        lst[Entry.SDX] = GeoKeys.get_soundex(name)
+        if lang != 'en' or 'ADM' not in lst[Entry.FEAT]:
+            # Only add if not English or not ADM1/ADM2
+            geodb.insert(geo_row=tuple(lst), feat_code=lst[Entry.FEAT], priority=geodb.get_geoid_priority(geoid))
+
+        if lang != 'en':
+            geodb.insert_alternate_name(name, geoid, lang)
+        geodb.insert_alt_id(alt_id, geoid, name, lang)
+
+    def remove_alternate_name(self, alt_id) -> bool:
+        """
+        Remove an alternate name we added, using its geonames alternate name ID
+        :return: True if the ID was found
+        """
+        geodb = self.geo_files.geodb
+        res = geodb.get_alt_id(alt_id)
+        if res is None:
+            return False
+        geoid, name, lang = res
+        self.remove_alias(geoid, name, lang)
+        geodb.delete_alt_id(alt_id)
+        return True
+
+    def remove_alias(self, geoid, name, lang):
+        # Remove one alias row and the altname rows for name.  The primary name row is never removed
+        geodb = self.geo_files.geodb
+        self.note_change(geoid)
+        old_rows = geodb.get_geoid_rows(geoid)
+        norm_name = GeoKeys.normalize(name)
+        for tbl, row_id, row in reversed(old_rows[self.primary_row_count(old_rows):]):
+            if row[Entry.NAME] == norm_name:
+                geodb.delete_row(tbl, row_id, row)
+                break
+
+        if lang != 'ut8':
+            geodb.delete_alternate_names(geoid, name=name, lang=lang)
+
+    @staticmethod
+    def primary_row_count(rows) -> int:
+        # Number of rows for a geoid created from the geonames entry itself.  US states also have an abbreviation row
+        if len(rows) == 0:
+            return 0
+        tbl, row_id, row = rows[0]
+        if row[Entry.ISO] == 'us' and row[Entry.FEAT] == 'ADM1' and len(rows) > 1:
+            if rows[1][2][Entry.NAME] == row[Entry.ADM1].lower():
+                return 2
+        return 1
@@ -73,6 +73,8 @@ class GrampsXml(AncestryFile):
         self.got_place = False
         self.lon = 99.9
         self.lat = 99.9
+        # Coordinate read from the current place object.  See get_coord()
+        self.coord = None
         self.place_complete = 0
         self.csv = GrampsCsv.GrampsCsv(in_path=in_path, geodata=geodata)
         self.title = ''
@@ -178,6 +180,7 @@ class GrampsXml(AncestryFile):
             #self.logger.debug(f'\n\nPLACEOBJECT {self.place.tag} =========')
             self.id = self.plac.get("id")
             self.title = ''
+            self.coord = None
             self.name = ''
             self.place_complete += 1
             # update progress bar
@@ -207,6 +210,10 @@ class GrampsXml(AncestryFile):
                     # <coord long="-0.16936" lat="51.48755"/>
                     self.lon = place_entry.attrib.get('long')
                     self.lat = place_entry.attrib.get('lat')
+                    try:
+                        self.coord = (float(self.lat), float(self.lon))
+                    except (TypeError, ValueError):
+                        self.coord = None
                     self.tag = 'IGNORE'
                     #self.logger.debug(f'<{place_entry.tag} LONG="{self.lon}" LAT="{self.lat}"/>')
                     self.plac.remove(place_entry)
@@ -233,6 +240,10 @@ class GrampsXml(AncestryFile):
             self.logger.debug('XML tree complete')
             self.more_available = False
 
+    def get_coord(self):
+        """ Return (lat, lon) from the current place object, or None """
+        return self.coord
+
     def write_updated(self, txt, place):
         # Update place entry in tree.  Tree will be written out later when entire XML tree is written out
         self.csv.create_csv_node(place)
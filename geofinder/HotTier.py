@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+In memory hot tier of the geoname DB for tiered lookups.
+
+The tier holds the whole admin table and the geodata rows for a small set of feature codes.  Population is
+encoded in the feature code when the DB is built (PP1M is over 1M, P1HK is over 100k), so the feature list also
+sets the population cutoff.  In tiered mode a lookup is run against the tier first and only goes to the full DB
+if the tier doesn't give a strong match (see Geodata.find_location).
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+
+from geofinder.Snapshot import SELECT_STR, STR_COLUMNS
+
+TABLES = ['geodata', 'admin']
+# Capitals, admin seats and places over 100k
+DEFAULT_FEATURES = ['PPLA', 'PPLC', 'P1HK', 'PP1M']
+# Column position in a row
+COLUMN_POS = {col: pos for pos, col in enumerate(SELECT_STR.split(', '))}
+
+logger = logging.getLogger(__name__)
+
+
+class HotTier:
+    """
+    Rows held in memory.  select() takes the same arguments as DB.select.  Queries on columns the tier
+    doesn't hold return None and are sent to SQLite
+    """
+
+    def __init__(self, geodb, features):
+        """
+        Load the tier from the DB
+        :param geodb: GeoDB to load from
+        :param features: Feature codes of geodata rows to include.  All admin rows are included
+        """
+        from geofinder.GeoDB import base_table
+
+        start = time.time()
+        self.features = list(features)
+        self.hits = 0
+        self.misses = 0
+        # Lookups can run from several threads.  Counters and index builds are under this lock
+        self.lock = threading.Lock()
+        self.rows = {}
+        # Priority of each row.  Used for ranked queries
+        self.priority = {}
+        # Rows are in primary key order so names are sorted.  Used for bisect on name prefix
+        self.names = {}
+        # Column value to list of row positions.  Built when a column is first searched
+        self.index = {tbl: {} for tbl in TABLES}
+
+        decode = {pos: {code: name for name, code in geodb.codes[tbl].items()}
+                  for pos, tbl in [(COLUMN_POS['country'], 'country_code'), (COLUMN_POS['f_code'], 'feature_code')]}
+        feature_codes = [geodb.codes['feature_code'][feat] for feat in self.features if feat in geodb.codes['feature_code']]
+        cur = geodb.db.conn.cursor()
+        for tbl in TABLES:
+            sql = f'SELECT {SELECT_STR}, priority FROM {base_table[tbl]}'
+            args = ()
+            if tbl == 'geodata':
+                sql += f' WHERE f_code IN ({",".join("?" * len(feature_codes)) or "NULL"})'
+                args = tuple(feature_codes)
+            cur.execute(sql + ' ORDER BY name, country, id', args)
+            rows = []
+            priority = []
+            for row in cur:
+                row = list(row)
+                for pos, values in decode.items():
+                    row[pos] = values.get(row[pos], '')
+                rows.append(tuple(row[:-1]))
+                priority.append(row[-1] or 0)
+            self.rows[tbl] = rows
+            self.priority[tbl] = priority
+            self.names[tbl] = [row[0] for row in rows]
+        logger.info(f'Hot tier loaded.  {len(self.rows["admin"]):,} admin, {len(self.rows["geodata"]):,} geodata '
+                    f'rows for {self.features}  Elapsed ={time.time() - start:.1f}')
+
+    def get_row_count(self, tbl='geodata') -> int:
+        return len(self.rows[tbl])
+
+    def add_result(self, hit: bool):
+        # Count a tiered lookup
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get_hit_rate(self) -> float:
+        # Fraction of tiered lookups answered by the tier
+        total = self.hits + self.misses
+        if total == 0:
+            return 0.0
+        return self.hits / total
+
+    def get_stats(self) -> str:
+        return f'Hot tier hits={self.hits} misses={self.misses} hit rate={self.get_hit_rate():.1%}'
+
+    def get_index(self, tbl, col) -> {}:
+        idx = self.index[tbl].get(col)
+        if idx is None:
+            with self.lock:
+                idx = self.index[tbl].get(col)
+                if idx is None:
+                    idx = {}
+                    pos = COLUMN_POS[col]
+                    for row_pos, row in enumerate(self.rows[tbl]):
+                        idx.setdefault(row[pos], []).append(row_pos)
+                    self.index[tbl][col] = idx
+        return idx
+
+    def select(self, select_str, where, from_tbl, args, limit=None, ranked=False):
+        """
+        Run a query from DB.select against the tier
+        :param ranked: Return the best limit rows by priority rather than the first limit rows
+        :return: list of rows, or None if query isn't supported
+        """
+        tbl = from_tbl.split('.')[-1]
+        if tbl not in self.rows or ' '.join(select_str.split()) != SELECT_STR:
+            return None
+        terms = parse_where(where, args)
+        if terms is None:
+            return None
+
+        # Use the term with the fewest candidate rows
+        candidates = None
+        for col, op, value in terms:
+            if op == '=':
+                found = self.get_index(tbl, col).get(value, [])
+            elif op == 'prefix' and col == 'name':
+                names = self.names[tbl]
+                found = range(bisect.bisect_left(names, value), bisect.bisect_left(names, value + '\U0010ffff'))
+            else:
+                continue
+            if candidates is None or len(found) < len(candidates):
+                candidates = found
+        if candidates is None:
+            candidates = range(len(self.rows[tbl]))
+
+        res = []
+        rows = self.rows[tbl]
+        for row_pos in candidates:
+            if match_terms(rows[row_pos], terms):
+                res.append(row_pos)
+                if limit is not None and len(res) >= limit and not ranked:
+                    break
+        return [rows[row_pos] for row_pos in rank_rows(res, self.priority[tbl], limit, ranked)]
+
+
+def rank_rows(positions, priority, limit, ranked) -> []:
+    # Row positions of a ranked query in priority order, ties in primary key order (position), up to limit
+    if ranked:
+        positions = sorted(positions, key=lambda pos: (priority[pos], pos))[:limit]
+    return positions
+
+
+def match_terms(row, terms) -> bool:
+    # True if row matches all the terms from parse_where
+    for col, op, value in terms:
+        item = row[COLUMN_POS[col]]
+        if op == '=':
+            if item != value:
+                return False
+        elif op == 'prefix':
+            if not item.startswith(value):
+                return False
+        elif value.fullmatch(item) is None:
+            return False
+    return True
+
+
+def parse_where(where, args):
+    """
+    Convert a where clause of 'col = ?' and 'col LIKE ?' terms joined by AND to a list of (col, op, value).
+    op is '=', 'prefix' (LIKE pattern with a single trailing %) or 'like' (value is a compiled pattern)
+    :return: list of terms or None if where clause isn't supported
+    """
+    terms = []
+    parts = re.split(r'\s+and\s+', where.strip(), flags=re.IGNORECASE)
+    if len(parts) != len(args):
+        return None
+    for part, value in zip(parts, args):
+        match = re.fullmatch(r'(\w+)\s*(=|like)\s*\?', part.strip(), flags=re.IGNORECASE)
+        if match is None or match.group(1) not in STR_COLUMNS or not isinstance(value, str):
+            return None
+        col = match.group(1)
+        if match.group(2) == '=':
+            terms.append((col, '=', value))
+        elif col == 'name' and value.isascii() and value.islower() and '_' not in value and '%' not in value.rstrip('%') \
+                and value.count('%') <= 1:
+            # Names are lower case so this matches SQLite case insensitive LIKE
+            terms.append((col, 'prefix' if value.endswith('%') else '=', value.rstrip('%')))
+        else:
+            # SQLite LIKE ignores case for ASCII letters only
+            pattern = ''.join('.*' if ch == '%' else '.' if ch == '_' else re.escape(ch) for ch in value)
+            terms.append((col, 'like', re.compile(pattern, flags=re.IGNORECASE | re.ASCII | re.DOTALL)))
+    return terms
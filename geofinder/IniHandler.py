@@ -82,6 +82,10 @@ class IniHandler:
 
         #  if directory doesnt exist, prompt user for folder
         if not Path(self.directory).is_dir():
+            if not GeoKeys.gui_enabled:
+                # No display for the folder dialog.  Caller reports the missing folder
+                GeoKeys.show_message('showerror', 'Geofinder Folder not found', str(self.directory))
+                return self.directory
             messagebox.showinfo('Geofinder Folder not found', 'Choose Folder for GeoFinder data in next dialog')
             self.directory = filedialog.askdirectory(initialdir=self.home_path, title="Choose Folder for GeoFinder data")
             if len(self.directory) == 0:
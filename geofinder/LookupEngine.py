@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Process pool for place lookups.
+
+Scoring and name normalization are pure Python, so lookups on threads don't use more than one core.  LookupEngine
+runs worker processes, each with the DB opened read only and its own caches and lookup memo file.
+Places are routed by country (the last item of the location) so each country has a home worker whose caches stay
+hot for it.  A country with more than its share of a request spills over to the least loaded workers.
+Results are returned in input order.  Used by BatchGeoFinder and GeoServer.
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+import zlib
+
+from geofinder import Geodata, GeoKeys, Loc
+
+
+class LookupEngine:
+    def __init__(self, directory, workers: int, profile='legacy', chunk_size=500, storage='disk', timeout=None):
+        """
+        Start worker processes
+        :param directory: GeoFinder data directory.  The DB in its cache directory must exist
+        :param workers: Number of worker processes
+        :param profile: Query cascade profile for the workers.  See DB.cascade_profiles
+        :param chunk_size: Maximum number of places sent to a worker in one message
+        :param storage: Storage profile for the workers.  See DB.storage_profiles.  With memory each worker has its
+        own copy of the DB
+        :param timeout: Seconds find_locations waits for a request before it fails.  None for no limit
+        """
+        self.logger = logging.getLogger(__name__)
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        # Seconds between checks that the workers are running while a request waits
+        self.poll_interval = 1.0
+        # Set when a worker has exited.  Later requests fail.  See check_workers()
+        self.error = None
+        # Spawn rather than fork so workers don't inherit the open DB connections and threads of this process
+        context = multiprocessing.get_context('spawn')
+        self.in_queues = [context.Queue() for _ in range(self.workers)]
+        self.out_queue = context.Queue()
+        self.processes = [context.Process(target=run_worker, args=(str(directory), idx, profile, storage, self.in_queues[idx],
+                                                                   self.out_queue),
+                                          daemon=True) for idx in range(self.workers)]
+        for process in self.processes:
+            process.start()
+
+        # Home worker for each country.  See route()
+        self.home = {}
+        # Request ID -> [places, remaining count, error, done event]
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+        self.logger.info(f'Lookup engine started with {self.workers} workers')
+
+    def find_locations(self, entries, shutdown=True) -> []:
+        """
+        Look up a list of places on the workers.  Can be called from several threads
+        :param entries: List of location strings, (location, event year) or (location, event year, coordinate)
+        :param shutdown: find_location shutdown flag.  True for no user verification
+        :return: List of Loc, in the same order as entries
+        """
+        items = [get_item(entry) for entry in entries]
+        if len(items) == 0:
+            return []
+        if self.error is not None:
+            raise RuntimeError(self.error)
+
+        request_id = next(self.request_ids)
+        request = [[None] * len(items), len(items), None, threading.Event()]
+        with self.lock:
+            self.pending[request_id] = request
+
+        for worker, indices in self.route(items):
+            for start in range(0, len(indices), self.chunk_size):
+                chunk = indices[start:start + self.chunk_size]
+                self.in_queues[worker].put((request_id, chunk, [items[idx] for idx in chunk], shutdown))
+
+        waited = 0.0
+        while not request[3].wait(self.poll_interval):
+            waited += self.poll_interval
+            self.check_workers()
+            if self.timeout is not None and waited >= self.timeout:
+                with self.lock:
+                    if not request[3].is_set():
+                        request[2] = f'Lookup timed out after {waited:.0f} seconds'
+                        request[3].set()
+        with self.lock:
+            del self.pending[request_id]
+        if request[2] is not None:
+            raise RuntimeError(request[2])
+        return request[0]
+
+    def check_workers(self):
+        # If a worker process has exited, fail the pending requests.  Its part of them will never be returned
+        dead = [process for process in self.processes if not process.is_alive()]
+        if len(dead) == 0:
+            return
+        error = f'Lookup worker {dead[0].pid} exited with code {dead[0].exitcode}'
+        with self.lock:
+            if self.error is None:
+                self.logger.error(error)
+                self.error = error
+            for request in self.pending.values():
+                if not request[3].is_set():
+                    request[2] = error
+                    request[3].set()
+
+    def route(self, items) -> []:
+        """
+        Split items by worker.  Each country goes to its home worker until that worker has its share of the items,
+        the rest goes to the least loaded worker
+        :return: List of (worker, list of item indices)
+        """
+        groups = {}
+        for idx, item in enumerate(items):
+            groups.setdefault(get_country_key(item[0]), []).append(idx)
+
+        share = -(-len(items) // self.workers)
+        loads = [0] * self.workers
+        assigned = [[] for _ in range(self.workers)]
+        for key, indices in sorted(groups.items(), key=lambda group: -len(group[1])):
+            home = self.home.setdefault(key, zlib.crc32(key.encode('utf-8')) % self.workers)
+            while len(indices) > 0:
+                worker = home if loads[home] < share else loads.index(min(loads))
+                count = max(1, share - loads[worker])
+                assigned[worker].extend(indices[:count])
+                loads[worker] += len(indices[:count])
+                indices = indices[count:]
+        return [(worker, indices) for worker, indices in enumerate(assigned) if len(indices) > 0]
+
+    def collect(self):
+        # Collector thread.  Copy worker results to their request
+        while True:
+            msg = self.out_queue.get()
+            if msg is None:
+                break
+            request_id, indices, places, error = msg
+            with self.lock:
+                request = self.pending.get(request_id)
+                if request is None or request[3].is_set():
+                    # Request has gone or has already failed
+                    continue
+                if error is not None:
+                    request[2] = error
+                    request[3].set()
+                    continue
+                for idx, place in zip(indices, places):
+                    request[0][idx] = place
+                request[1] -= len(indices)
+                if request[1] == 0:
+                    request[3].set()
+
+    def close(self, timeout=30.0):
+        # Stop workers.  Each worker closes its memo and DB.  Workers that don't stop within timeout are terminated
+        self.check_workers()
+        broken = self.error is not None
+        for queue in self.in_queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                # A worker that exited while writing a result can leave the result queue locked
+                self.logger.warning(f'Lookup worker {process.pid} did not stop.  Terminating')
+                process.terminate()
+                process.join()
+                broken = True
+        if broken:
+            # Queues can be left locked by a worker that exited.  Don't wait for them to flush.  The collector is
+            # a daemon thread
+            for queue in self.in_queues + [self.out_queue]:
+                queue.cancel_join_thread()
+            self.out_queue.put(None)
+            self.collector.join(timeout)
+        else:
+            self.out_queue.put(None)
+            self.collector.join()
+        self.logger.info('Lookup engine stopped')
+
+
+def get_item(entry) -> ():
+    # (location, event year, coordinate) for a find_locations entry
+    if isinstance(entry, str):
+        return entry, 0, None
+    location, event_year, coord = tuple(entry) + (0, None)[len(entry) - 1:]
+    return location, int(event_year or 0), coord
+
+
+def get_country_key(location: str) -> str:
+    # Routing key.  Last item of location, which is normally the country
+    return location.split(',')[-1].strip().lower()
+
+
+def open_geodata(directory, memo_enabled: bool, memo_name='lookup_memo.db', profile='legacy', storage='disk'):
+    # Open geoname DB read only.  Returns Geodata or None if error
+    geodata = Geodata.Geodata(directory_name=directory, progress_bar=None)
+    geodata.memo_enabled = memo_enabled
+    geodata.memo_name = memo_name
+    geodata.geo_files.read_only = True
+    geodata.geo_files.cascade_profile = profile
+    geodata.geo_files.storage_profile = storage
+    if geodata.read() or geodata.read_geonames():
+        return None
+    return geodata
+
+
+def find_entries(geodata, entries, shutdown=True) -> []:
+    # Look up (location, event year, coordinate) entries.  Returns list of Loc
+    # Entries with a coordinate are looked up one at a time with it.  The rest are one batch
+    results = [None] * len(entries)
+    batch = [idx for idx, (location, event_year, coord) in enumerate(entries) if coord is None]
+    if len(batch) > 0:
+        places = geodata.find_locations([entries[idx][:2] for idx in batch], shutdown=shutdown)
+        for idx, place in zip(batch, places):
+            results[idx] = place
+    for idx, (location, event_year, coord) in enumerate(entries):
+        if coord is not None:
+            place = Loc.Loc()
+            place.event_year = event_year
+            geodata.find_location(location, place, shutdown, coord=coord)
+            results[idx] = place
+    return results
+
+
+def run_worker(directory, worker_idx, profile, storage, in_queue, out_queue):
+    # Worker process.  Look up each chunk from in_queue until None.  Each worker has its own memo file
+    logging.basicConfig(level=logging.WARNING)
+    GeoKeys.gui_enabled = False
+    geodata = open_geodata(directory, memo_enabled=True, memo_name=f'lookup_memo_{worker_idx}.db', profile=profile,
+                           storage=storage)
+    error = None if geodata is not None else f'Worker {os.getpid()} cannot open geoname database in {directory}'
+    while True:
+        msg = in_queue.get()
+        if msg is None:
+            break
+        request_id, indices, entries, shutdown = msg
+        if error is not None:
+            out_queue.put((request_id, indices, None, error))
+            continue
+        try:
+            out_queue.put((request_id, indices, find_entries(geodata, entries, shutdown), None))
+        except Exception as e:
+            logging.getLogger(__name__).exception(f'Lookup error {e}')
+            out_queue.put((request_id, indices, None, f'Lookup error {e}'))
+    if geodata is not None:
+        geodata.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Persistent memo of Geodata.find_location results.
+
+Each entry is the finished place (georow_list, result type, status, names, etc) for a location string, an event
+year bucket, and the wildcard setting.  All outcomes are stored, including NO_MATCH and NOT_SUPPORTED.
+The memo file has a fingerprint of the DB version, DB build ID and the settings that change results.  If the
+fingerprint changes the memo is emptied.
+"""
+import bisect
+import logging
+import pickle
+import sqlite3
+import threading
+
+# Place attributes set by a lookup.  Others (id, event_year, etc) belong to the caller and are left alone
+RESULT_ATTRIBUTES = ['original_entry', 'formatted_name', 'lat', 'lon', 'country_iso', 'country_name', 'city1',
+                     'admin1_name', 'admin2_name', 'admin1_id', 'admin2_id', 'prefix', 'extra', 'feature', 'place_type',
+                     'target', 'geoid', 'prefix_commas', 'enclosed_by', 'standard_parse', 'status', 'status_detail',
+                     'result_type', 'result_type_text', 'georow_list']
+
+
+class LookupMemo:
+    def __init__(self, path, fingerprint: str, year_thresholds):
+        """
+        Open or create memo file
+        :param path: Memo file
+        :param fingerprint: DB version, build ID and settings.  Memo entries from a different fingerprint are discarded
+        :param year_thresholds: Start years used for event year checks.  See get_key()
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.thresholds = sorted(set(year_thresholds) | {-1})
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        # Lookups can run from several threads (see DB read_only).  The connection is shared under this lock
+        self.lock = threading.Lock()
+
+        # Each put is its own short transaction.  WAL lets readers of the file run while it is written
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+        self.conn.isolation_level = None
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS info (name text primary key not null, value text)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS memo (key text primary key not null, place blob)')
+        res = self.conn.execute("SELECT value FROM info WHERE name = 'fingerprint'").fetchall()
+        if len(res) == 0 or res[0][0] != fingerprint:
+            self.logger.info(f'Lookup memo reset {path}')
+            self.conn.execute('BEGIN')
+            # noinspection SqlWithoutWhere
+            self.conn.execute('DELETE FROM memo')
+            self.conn.execute("INSERT OR REPLACE INTO info(name, value) VALUES('fingerprint', ?)", (fingerprint,))
+            self.conn.execute('COMMIT')
+
+    def get_key(self, location: str, event_year: int, use_wildcards: bool) -> str:
+        """
+        Key for a lookup.  Event years that give the same result for every start year check share a bucket
+        """
+        if event_year == 0:
+            bucket = 'all'
+        else:
+            # Year checks are done with 0 and 60 years padding.  See Geodata.valid_year_for_location
+            bucket = f'{bisect.bisect_right(self.thresholds, event_year)}.{bisect.bisect_right(self.thresholds, event_year + 60)}'
+        return f'{int(use_wildcards)}|{bucket}|{location.strip()}'
+
+    def get(self, key, place) -> bool:
+        """
+        Copy memo entry to place
+        :return: True if found
+        """
+        with self.lock:
+            try:
+                res = self.conn.execute('SELECT place FROM memo WHERE key = ?', (key,)).fetchall()
+            except sqlite3.OperationalError as e:
+                # Memo problems never fail a lookup.  It is done against the DB
+                self.add_error(e)
+                return False
+            if len(res) == 0:
+                self.misses += 1
+                return False
+            self.hits += 1
+        place.__dict__.update(pickle.loads(res[0][0]))
+        return True
+
+    def put(self, key, place):
+        # Add lookup result for place
+        data = pickle.dumps({name: getattr(place, name) for name in RESULT_ATTRIBUTES})
+        with self.lock:
+            try:
+                self.conn.execute('INSERT OR REPLACE INTO memo(key, place) VALUES(?, ?)', (key, data))
+            except sqlite3.OperationalError as e:
+                self.add_error(e)
+
+    def add_error(self, err):
+        # Caller holds lock.  Log the first error only
+        if self.errors == 0:
+            self.logger.warning(f'Lookup memo error {self.path} {err}')
+        self.errors += 1
+
+    def get_stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0.0
+        return f'Lookup memo hits={self.hits} misses={self.misses} hit rate={rate:.1%} errors={self.errors}'
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        self.logger.info(self.get_stats())
@@ -49,10 +49,11 @@ class MatchScore:
         self.first_token_match_bonus = 27.0
         self.wrong_order_penalty = 2.0
 
-    def match_score(self, inp_place: Loc.Loc, res_place: Loc.Loc) -> int:
+    def match_score(self, inp_place: Loc.Loc, res_place: Loc.Loc, res_title=None) -> int:
         """
         :param inp_place: Input place structure with users text
         :param res_place: Result place structure with DB result
+        :param res_title: Normalized title of result (see GeoDB.get_titles).  Built from res_place if None
         :return: score 0-100 reflecting the difference between the user input and the result.  0 is perfect match, 100 is no match
         Score is also adjusted based on Feature type.  More important features (large city) get lower result
         """
@@ -66,9 +67,10 @@ class MatchScore:
         inp_tokens = inp_title.split(',')
 
         # Create full place title (prefix,city,county,state,country) from result place
-        res_place.prefix = ' '
-        res_title = res_place.get_five_part_title()
-        res_title = GeoKeys.normalize_match_title(res_title, res_place.country_iso)
+        if res_title is None:
+            res_place.prefix = ' '
+            res_title = res_place.get_five_part_title()
+            res_title = GeoKeys.normalize_match_title(res_title, res_place.country_iso)
         res_tokens = res_title.split(',')
 
         # Store length of original input tokens.  This is used for percent unmatched calculation
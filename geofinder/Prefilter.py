@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Byte level prefilter for geonames.org files.
+
+The files are read through mmap in large chunks and a compiled bytes regex finds the lines with a column value
+we want (country and feature code, or language).  Only those lines are decoded.  The patterns may let through
+a few extra lines, so callers still apply their normal filter to the lines returned.
+"""
+import mmap
+import os
+import re
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Pattern that never matches
+_NO_MATCH = rb'(?!)'
+
+
+def _alternatives(items) -> bytes:
+    if len(items) == 0:
+        return _NO_MATCH
+    return b'|'.join(re.escape(item.encode('utf-8')) for item in sorted(items, key=len, reverse=True))
+
+
+def geoname_pattern(countries, features):
+    """
+    Pattern for geonames places file lines (allCountries.txt, gb.txt, etc).  Feature code column is followed by
+    the country code column.  Country codes are case insensitive
+    :param countries: ISO codes to include
+    :param features: Feature codes to include
+    """
+    return re.compile(rb'\t(?:' + _alternatives(features) + rb')\t(?i:' + _alternatives(countries) + rb')\t')
+
+
+def altname_pattern(langs):
+    """
+    Pattern for alternateNamesV2.txt lines.  Geoname ID column is followed by the language column
+    :param langs: Languages to include
+    """
+    return re.compile(rb'\t[0-9]+\t(?:' + _alternatives(langs) + rb')\t')
+
+
+def _line_start(mm, pos, fsize) -> int:
+    # Return the start of the first line that begins at or after pos
+    if pos <= 0:
+        return 0
+    if pos >= fsize:
+        return fsize
+    if mm[pos - 1] == 10:
+        return pos
+    nl = mm.find(b'\n', pos)
+    if nl == -1:
+        return fsize
+    return nl + 1
+
+
+def scan_file(path, pattern, start=0, end=None, chunk_size=None):
+    """
+    Find the lines in a file that match pattern.  Only lines whose first byte is in [start, end) are scanned.
+    :param path: File to scan
+    :param pattern: Compiled bytes pattern.  A line matches if pattern is found anywhere in the line
+    :param chunk_size: Bytes to scan at a time.  Default CHUNK_SIZE
+    :return: generator of (file position reached, number of lines scanned, list of (line number, decoded line)).
+    Line numbers count from 1 at the first line scanned.  Decoded lines don't include the line ending
+    """
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    with open(path, 'rb') as fl:
+        fsize = os.fstat(fl.fileno()).st_size
+        if end is None or end > fsize:
+            end = fsize
+        if start >= end:
+            return
+
+        with mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = _line_start(mm, start, fsize)
+            end = _line_start(mm, end, fsize)
+            line_count = 0
+
+            while pos < end:
+                chunk_end = _line_start(mm, min(pos + chunk_size, end), fsize)
+                chunk = mm[pos:chunk_end]
+                lines = []
+                counted = 0
+                match = pattern.search(chunk)
+                while match:
+                    line_begin = chunk.rfind(b'\n', 0, match.start()) + 1
+                    line_end = chunk.find(b'\n', match.end())
+                    if line_end == -1:
+                        line_end = len(chunk)
+                    line_count += chunk.count(b'\n', counted, line_begin)
+                    counted = line_begin
+                    lines.append((line_count + 1, chunk[line_begin:line_end].rstrip(b'\r').decode('utf-8', errors='replace')))
+                    match = pattern.search(chunk, line_end)
+
+                line_count += chunk.count(b'\n', counted)
+                if not chunk.endswith(b'\n'):
+                    # Last line of file has no line ending
+                    line_count += 1
+                pos = chunk_end
+                yield pos, line_count, lines
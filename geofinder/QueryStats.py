@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import threading
+
+from geofinder.GeoKeys import Result
+
+# Result code -> name for stats output
+result_names = {val: name for name, val in vars(Result).items() if not name.startswith('_')}
+
+
+class QueryStats:
+    """
+    Statistics for each stage of the DB.run_query_list cascade.  A stage is the table, the where clause and the
+    result code of a Query.  Counts runs, runs with rows, rows, time, runs that ended the cascade and stages skipped
+    by the cascade policy.  Safe to use from several threads
+    """
+
+    def __init__(self):
+        # (table, where, result) -> [runs, hits, rows, seconds, stops, skips]
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, rows: int, elapsed: float, stop: bool):
+        # Add a stage that was run
+        with self.lock:
+            item = self.stages.setdefault(stage, [0, 0, 0, 0.0, 0, 0])
+            item[0] += 1
+            if rows > 0:
+                item[1] += 1
+            item[2] += rows
+            item[3] += elapsed
+            if stop:
+                item[4] += 1
+
+    def add_skip(self, stage):
+        # Add a stage that the cascade policy skipped
+        with self.lock:
+            self.stages.setdefault(stage, [0, 0, 0, 0.0, 0, 0])[5] += 1
+
+    def clear(self):
+        with self.lock:
+            self.stages.clear()
+
+    def get_list(self) -> []:
+        # List of dict for each stage, slowest total time first
+        with self.lock:
+            items = sorted(self.stages.items(), key=lambda item: -item[1][3])
+        return [{'table': tbl, 'where': ' '.join(where.split()), 'result': result_names.get(result, ''),
+                 'runs': runs, 'hits': hits, 'rows': rows, 'ms': round(1000 * seconds, 1),
+                 'ms_per_run': round(1000 * seconds / runs, 3) if runs else 0.0, 'stops': stops, 'skips': skips}
+                for (tbl, where, result), (runs, hits, rows, seconds, stops, skips) in items]
+
+    def get_stats(self) -> str:
+        # Text table of stage stats
+        lines = ['Query stages  runs  hit rate  rows/hit  ms/run  stops  skips']
+        for item in self.get_list():
+            rate = item['hits'] / item['runs'] if item['runs'] else 0.0
+            per_hit = item['rows'] / item['hits'] if item['hits'] else 0.0
+            lines.append(f"{item['table']} {item['result']} [{item['where']}]  {item['runs']}  {rate:.1%}  "
+                         f"{per_hit:.1f}  {item['ms_per_run']:.3f}  {item['stops']}  {item['skips']}")
+        return '\n'.join(lines)
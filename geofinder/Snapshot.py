@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Read only, memory mapped snapshot of the geodata and admin tables.
+
+The snapshot is a columnar file: each string column is an array of entries in a shared string pool, lat/lon
+are arrays of doubles and priority is an array of ints.  Rows are stored in the table primary key order (name, country, id), so name lookups are
+a bisect on the name column.  Sorted permutations of the rows by sdx and by geoid serve soundex and geoid lookups.
+Row order within a match is the same as the SQLite query, so results are identical.
+
+File layout:  magic, string pool, pool index, column arrays, JSON footer, footer length, magic.
+The footer has the build ID of the DB the snapshot was exported from.  A snapshot for a different build ID is stale
+"""
+import bisect
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+from array import array
+
+MAGIC = b'GEOSNAP2'
+TABLES = ['geodata', 'admin']
+# String columns in row order, then lat, lon and priority
+STR_COLUMNS = ['name', 'country', 'admin1_id', 'admin2_id', 'f_code', 'geoid', 'sdx']
+SELECT_STR = 'name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx'
+
+# Columns that can be searched with a sorted permutation.  name is the storage order
+PERMUTATIONS = ['sdx', 'geoid']
+# UTF-8 never contains this byte, so prefix + _HIGH is above every string starting with prefix
+_HIGH = b'\xff'
+
+logger = logging.getLogger(__name__)
+
+
+def export_snapshot(geodb, path):
+    """
+    Write geodata and admin tables from geodb to a snapshot file
+    :param geodb: GeoDB to export
+    :param path: Snapshot file.  Written to a temporary file and then renamed
+    """
+    from geofinder.GeoDB import base_table
+
+    conn = geodb.db.conn
+    decode = {col: {code: name for name, code in geodb.codes[tbl].items()}
+              for col, tbl in [('country', 'country_code'), ('f_code', 'feature_code')]}
+    tmp_path = path + '.tmp'
+    footer = {'build_id': geodb.get_build_id(), 'tables': {}}
+
+    with open(tmp_path, 'wb') as fl:
+        fl.write(MAGIC)
+        pool_start = fl.tell()
+        pool_index = array('Q', [0])
+        pool_size = 0
+        # Low cardinality values are only added to the pool once
+        shared = {}
+
+        def add_string(text, dedupe):
+            nonlocal pool_size
+            if dedupe:
+                entry = shared.get(text)
+                if entry is not None:
+                    return entry
+            data = text.encode('utf-8')
+            fl.write(data)
+            pool_size += len(data)
+            pool_index.append(pool_size)
+            entry = len(pool_index) - 2
+            if dedupe:
+                shared[text] = entry
+            return entry
+
+        columns = {}
+        for tbl in TABLES:
+            cols = {col: array('I') for col in STR_COLUMNS}
+            cols['lat'] = array('d')
+            cols['lon'] = array('d')
+            cols['priority'] = array('i')
+            prev_name, prev_entry = None, 0
+            cur = conn.cursor()
+            cur.execute(f'SELECT name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx, priority '
+                        f'FROM {base_table[tbl]} ORDER BY name, country, id')
+            for name, country, adm1, adm2, lat, lon, f_code, geoid, sdx, priority in cur:
+                # Rows are in name order so repeated names are adjacent
+                if name != prev_name:
+                    prev_name, prev_entry = name, add_string(name, False)
+                cols['name'].append(prev_entry)
+                cols['country'].append(add_string(decode['country'].get(country, ''), True))
+                cols['admin1_id'].append(add_string(adm1 or '', True))
+                cols['admin2_id'].append(add_string(adm2 or '', True))
+                cols['lat'].append(_to_float(lat))
+                cols['lon'].append(_to_float(lon))
+                cols['f_code'].append(add_string(decode['f_code'].get(f_code, ''), True))
+                cols['geoid'].append(add_string(str(geoid), False))
+                cols['sdx'].append(add_string(sdx or '', True))
+                cols['priority'].append(priority or 0)
+
+            # Permutations are sorted by SQLite.  Ties keep primary key order, like the sdx and geoid indices
+            for col in PERMUTATIONS:
+                perm = array('I')
+                cur.execute(f'SELECT rn FROM (SELECT row_number() OVER (ORDER BY name, country, id) - 1 AS rn, {col}, name, '
+                            f'country, id FROM {base_table[tbl]}) ORDER BY {col}, name, country, id')
+                for row in cur:
+                    perm.append(row[0])
+                cols[f'{col}_perm'] = perm
+            columns[tbl] = cols
+
+        # Arrays are 8 byte aligned so they can be cast from the mapped file
+        sections = [('pool_index', pool_index)]
+        for tbl in TABLES:
+            for col, arr in columns[tbl].items():
+                sections.append((f'{tbl}.{col}', arr))
+        footer['pool'] = [pool_start, pool_size]
+        footer['arrays'] = {}
+        for name, arr in sections:
+            fl.write(b'\0' * (-fl.tell() % 8))
+            footer['arrays'][name] = [fl.tell(), arr.typecode, len(arr)]
+            arr.tofile(fl)
+        for tbl in TABLES:
+            footer['tables'][tbl] = len(columns[tbl]['name'])
+
+        data = json.dumps(footer).encode('utf-8')
+        fl.write(data)
+        fl.write(struct.pack('<Q', len(data)))
+        fl.write(MAGIC)
+
+    os.replace(tmp_path, path)
+    logger.info(f'Snapshot written to {path}.  {footer["tables"]}')
+
+
+def _to_float(val) -> float:
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return float('NaN')
+
+
+def open_snapshot(path, build_id):
+    """
+    Open snapshot file
+    :param build_id: Build ID of DB.  Snapshot must have been exported from this build
+    :return: Snapshot or None if the file is missing, unreadable or stale
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        snap = Snapshot(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f'Cannot read snapshot {path} {e}')
+        return None
+    if snap.build_id != build_id:
+        logger.info('Snapshot is stale')
+        snap.close()
+        return None
+    return snap
+
+
+class _Column:
+    # Sequence of the string values (bytes) in a column, optionally through a permutation.  Used for bisect
+    def __init__(self, snap, entries, perm=None):
+        self.snap = snap
+        self.entries = entries
+        self.perm = perm
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        if self.perm is not None:
+            idx = self.perm[idx]
+        return self.snap.get_bytes(self.entries[idx])
+
+
+class Snapshot:
+    """
+    Reader for a snapshot file.  select() takes the same arguments as DB.select and serves the queries that
+    can be answered with a lookup on name, sdx, or geoid.  Other queries return None and are sent to SQLite
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fl = open(path, 'rb')
+        try:
+            self.mm = mmap.mmap(self.fl.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.fl.close()
+            raise
+        if len(self.mm) < 24 or self.mm[:8] != MAGIC or self.mm[-8:] != MAGIC:
+            self.mm.close()
+            self.fl.close()
+            raise ValueError('Not a snapshot file')
+        footer_len = struct.unpack('<Q', self.mm[-16:-8])[0]
+        footer = json.loads(self.mm[-16 - footer_len:-16].decode('utf-8'))
+        self.build_id = footer['build_id']
+        self.row_counts = footer['tables']
+        self.pool_start = footer['pool'][0]
+
+        self.view = memoryview(self.mm)
+        self.arrays = {}
+        for name, (offset, typecode, count) in footer['arrays'].items():
+            size = array(typecode).itemsize
+            self.arrays[name] = self.view[offset:offset + count * size].cast(typecode)
+        self.pool_index = self.arrays['pool_index']
+        self.columns = {tbl: {col: self.arrays[f'{tbl}.{col}'] for col in STR_COLUMNS + ['lat', 'lon', 'priority']}
+                        for tbl in TABLES}
+        self.search = {}
+        for tbl in TABLES:
+            self.search[tbl] = {'name': _Column(self, self.columns[tbl]['name'])}
+            for col in PERMUTATIONS:
+                self.search[tbl][col] = _Column(self, self.columns[tbl][col], self.arrays[f'{tbl}.{col}_perm'])
+        self.strings = {}
+
+    def close(self):
+        self.columns = {}
+        self.search = {}
+        self.pool_index = None
+        for arr in self.arrays.values():
+            arr.release()
+        self.arrays = {}
+        self.view.release()
+        self.mm.close()
+        self.fl.close()
+
+    def get_row_count(self, tbl='geodata') -> int:
+        return self.row_counts[tbl]
+
+    def get_bytes(self, entry) -> bytes:
+        return self.mm[self.pool_start + self.pool_index[entry]:self.pool_start + self.pool_index[entry + 1]]
+
+    def get_string(self, entry) -> str:
+        res = self.strings.get(entry)
+        if res is None:
+            res = self.get_bytes(entry).decode('utf-8')
+            if len(self.strings) < 100000:
+                # Cache low cardinality values (country, admin IDs, feature codes)
+                self.strings[entry] = res
+        return res
+
+    def get_row(self, tbl, idx) -> ():
+        # Return row in same format as DB.process_query_list
+        cols = self.columns[tbl]
+        return (self.get_bytes(cols['name'][idx]).decode('utf-8'), self.get_string(cols['country'][idx]),
+                self.get_string(cols['admin1_id'][idx]), self.get_string(cols['admin2_id'][idx]),
+                cols['lat'][idx], cols['lon'][idx], self.get_string(cols['f_code'][idx]),
+                self.get_bytes(cols['geoid'][idx]).decode('utf-8'), self.get_string(cols['sdx'][idx]))
+
+    def select(self, select_str, where, from_tbl, args, limit=None, ranked=False):
+        """
+        Run a query from DB.select against the snapshot
+        :param ranked: Return the best limit rows by priority rather than the first limit rows
+        :return: list of rows, or None if query isn't supported
+        """
+        tbl = from_tbl.split('.')[-1]
+        if tbl not in self.columns or ' '.join(select_str.split()) != SELECT_STR:
+            return None
+        terms = parse_where(where, args)
+        if terms is None:
+            return None
+
+        # Find range of rows to check
+        key = None
+        for col in ['name', 'geoid', 'sdx']:
+            for term in terms:
+                if term[0] == col and (term[1] == '=' or col == 'name'):
+                    key = term
+                    break
+            if key is not None:
+                break
+        if key is None:
+            return None
+        col, op, value = key
+        target = value.encode('utf-8')
+        seq = self.search[tbl][col]
+        if op == 'prefix':
+            start, end = bisect.bisect_left(seq, target), bisect.bisect_left(seq, target + _HIGH)
+        else:
+            start, end = bisect.bisect_left(seq, target), bisect.bisect_right(seq, target)
+
+        # Check remaining terms on each row in range
+        res = []
+        cols = self.columns[tbl]
+        for pos in range(start, end):
+            idx = seq.perm[pos] if seq.perm is not None else pos
+            for term_col, term_op, term_value in terms:
+                if term_col == col and term_op == op:
+                    continue
+                if term_col in ['name', 'geoid']:
+                    value = self.get_bytes(cols[term_col][idx]).decode('utf-8')
+                else:
+                    value = self.get_string(cols[term_col][idx])
+                if term_op == 'prefix':
+                    if not value.startswith(term_value):
+                        break
+                elif value != term_value:
+                    break
+            else:
+                res.append(idx)
+                if limit is not None and len(res) >= limit and not ranked:
+                    break
+        if ranked:
+            # Rows are stored in primary key order, so ties are in primary key order
+            priority = cols['priority']
+            res = sorted(res, key=lambda pos: (priority[pos], pos))[:limit]
+        return [self.get_row(tbl, idx) for idx in res]
+
+
+def parse_where(where, args):
+    """
+    Convert a where clause of 'col = ?' and 'col LIKE ?' terms joined by AND to a list of (col, op, value).
+    LIKE is only supported for lower case patterns with a single trailing % (op 'prefix') or no wildcard
+    :return: list of terms or None if where clause isn't supported
+    """
+    terms = []
+    parts = re.split(r'\s+and\s+', where.strip(), flags=re.IGNORECASE)
+    if len(parts) != len(args):
+        return None
+    for part, value in zip(parts, args):
+        match = re.fullmatch(r'(\w+)\s*(=|like)\s*\?', part.strip(), flags=re.IGNORECASE)
+        if match is None or match.group(1) not in STR_COLUMNS or not isinstance(value, str):
+            return None
+        col, op = match.group(1), match.group(2).lower()
+        if op == 'like':
+            # LIKE is case insensitive for ASCII.  Names are stored in lower case, so a lower case pattern
+            # matches the same rows as an exact compare
+            if value != value.lower() or '_' in value or '%' in value[:-1]:
+                return None
+            if value.endswith('%'):
+                op, value = 'prefix', value[:-1]
+                if col != 'name' or len(value) == 0:
+                    return None
+            else:
+                op = '='
+        terms.append((col, op, value))
+    return terms
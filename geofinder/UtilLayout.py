@@ -16,6 +16,7 @@
 #   You should have received a copy of the GNU General Public License
 #   along with this program; if not, write to the Free Software
 #   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+import glob
 import logging
 import os
 import webbrowser
@@ -148,16 +149,23 @@ class UtilLayout:
         for item in self.listbox_list:
             item.write()
 
-        if self.country_list.is_dirty() or self.feature_list.is_dirty() or self.languages_list.is_dirty():
-            # Delete geoname.db so GeoFinder will rebuild it with new country list or feature list
+        if self.feature_list.is_dirty() or self.languages_list.is_dirty():
+            # Delete geoname.db so GeoFinder will rebuild it with new feature list or language list
             if messagebox.askyesno('Configuration Changed',  'Do you want to rebuild the database on next startup?'):
-                for fname in ['geodata.db']:
+                for fname in ['geodata.db', 'geodata.snap']:
                     path = os.path.join(self.cache_dir, fname)
                     self.logger.debug(f'Quit - DELETING FILE {path}')
                     if os.path.exists(path):
                         os.remove(path)
                     else:
                         self.logger.warning(f'Delete file not found {path}')
+                # Lookup memos of the GUI and of each lookup engine worker (lookup_memo_<n>.db) with their WAL files
+                for path in glob.glob(os.path.join(self.cache_dir, 'lookup_memo*.db*')):
+                    self.logger.debug(f'Quit - DELETING FILE {path}')
+                    os.remove(path)
+        elif self.country_list.is_dirty():
+            # GeoFinder adds or removes just the changed countries in the existing database
+            messagebox.showinfo('Configuration Changed', 'The database will be updated for the new country list on next startup')
 
         self.root.quit()
         sys.exit()
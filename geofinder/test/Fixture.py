@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+"""
+Small synthetic geonames.org data directory for unit tests.
+
+Tests that use it run without a display and without downloaded geonames files:
+    python -m unittest discover -s geofinder/test -p 'Test*.py'
+"""
+import os
+import pickle
+import random
+import shutil
+import sqlite3
+import tempfile
+
+from geofinder import Geodata, GeoKeys
+
+# Message boxes go to the log
+GeoKeys.gui_enabled = False
+
+countries = {'ca': 'canada', 'gb': 'united kingdom', 'us': 'united states', 'fr': 'france', 'de': 'germany'}
+languages = {'en': '', 'fr': '', 'de': '', 'it': ''}
+
+# name, lat, lon, feature class, feature code, iso, admin1, admin2, population
+places = {
+    'ns': ('Nova Scotia', 45.0, -63.0, 'A', 'ADM1', 'CA', '07', '', 0),
+    'on': ('Ontario', 49.2, -84.5, 'A', 'ADM1', 'CA', '08', '', 0),
+    'nb': ('New Brunswick', 46.5, -66.0, 'A', 'ADM1', 'CA', '04', '', 0),
+    'pei': ('Prince Edward Island', 46.3, -63.3, 'A', 'ADM1', 'CA', '09', '', 0),
+    'bruce': ('Bruce County', 44.50009, -81.3, 'A', 'ADM2', 'CA', '08', '3541', 0),
+    'halifax_county': ('Halifax County', 44.8, -63.5, 'A', 'ADM2', 'CA', '07', '1209', 0),
+    'halifax': ('Halifax', 44.646, -63.57, 'P', 'PPLA', 'CA', '07', '1209', 400000),
+    'st_andrews_pe': ('St. Andrews', 46.38341, -62.84866, 'P', 'PPL', 'CA', '09', '', 500),
+    'st_andrews_ns': ('St. Andrews', 45.55614, -61.88909, 'P', 'PPL', 'CA', '07', '', 20000),
+    'st_andrews_nb': ('St. Andrews', 45.0737, -67.05312, 'P', 'PPL', 'CA', '04', '1302', 20000),
+    'england': ('England', 52.0, -1.0, 'A', 'ADM1', 'GB', 'ENG', '', 0),
+    'kent': ('Kent', 51.2, 0.7, 'A', 'ADM2', 'GB', 'ENG', 'G5', 0),
+    'dover': ('Dover', 51.13, 1.31, 'P', 'PPL', 'GB', 'ENG', 'G5', 30000),
+    'canterbury': ('Canterbury', 51.28, 1.08, 'P', 'PPL', 'GB', 'ENG', 'G5', 50000),
+    'st_mary': ('St Mary Church', 51.2, 1.0, 'S', 'CH', 'GB', 'ENG', 'G5', 0),
+    'california': ('California', 37.2, -119.5, 'A', 'ADM1', 'US', 'CA', '', 0),
+    'santa_clara': ('Santa Clara County', 37.23, -121.69, 'A', 'ADM2', 'US', 'CA', '085', 0),
+    'palo_alto': ('Palo Alto', 37.44188, -122.14302, 'P', 'PPL', 'US', 'CA', '085', 66000),
+    'san_jose': ('San Jose', 37.33, -121.89, 'P', 'PPLA2', 'US', 'CA', '085', 1000000),
+    'idf': ('Île-de-France', 48.5, 2.5, 'A', 'ADM1', 'FR', '11', '', 0),
+    'paris': ('Paris', 48.85, 2.35, 'P', 'PPLC', 'FR', '11', '75', 2100000),
+    'bavaria': ('Bavaria', 48.9, 11.4, 'A', 'ADM1', 'DE', '02', '', 0),
+    'munich': ('München', 48.137, 11.575, 'P', 'PPLA', 'DE', '02', '091', 1260000),
+}
+
+# Key in places, alternate name, language
+alternate_names = [('munich', 'Munich', 'en'), ('munich', 'Monaco di Baviera', 'it'), ('bavaria', 'Bayern', 'de'),
+                   ('paris', 'Parigi', 'it'), ('england', 'Angleterre', 'fr'), ('dover', 'Douvres', 'fr'),
+                   ('california', 'Kalifornien', 'de'), ('halifax', 'Kjipuktuk', 'mic')]
+
+# Geoname ID for each key in places
+geoids = {key: str(1001 + idx) for idx, key in enumerate(places)}
+
+
+def geoname_line(geoid, name, lat, lon, feat_class, feat_code, iso, admin1, admin2, pop) -> str:
+    # Line in geonames.org allCountries.txt format
+    return '\t'.join([str(geoid), name, name, '', str(lat), str(lon), feat_class, feat_code, iso, '', admin1, admin2,
+                      '', '', str(pop), '', '0', 'tz', '2019-01-01']) + '\n'
+
+
+def make_geoname_dir(directory, filler=1500):
+    """
+    Write allCountries.txt, alternateNamesV2.txt and the country and language lists to directory
+    :param filler: Number of generated places added to the named places.  The DB needs at least 1000 rows
+    """
+    os.makedirs(GeoKeys.get_cache_directory(directory), exist_ok=True)
+    rnd = random.Random(7)
+    syllables = ['ber', 'ton', 'ham', 'ley', 'wick', 'ford', 'bury', 'field', 'mar', 'lin', 'dal', 'ros']
+    geoid = 1001
+    with open(os.path.join(directory, 'allCountries.txt'), 'w', encoding='utf-8') as file:
+        for row in places.values():
+            file.write(geoname_line(geoid, *row))
+            geoid += 1
+        for _ in range(filler):
+            iso, admin1 = rnd.choice([('CA', '07'), ('CA', '08'), ('GB', 'ENG'), ('US', 'CA'), ('FR', '11'),
+                                      ('DE', '02'), ('MX', '01')])
+            name = ''.join(rnd.choice(syllables) for _ in range(rnd.randint(2, 3))).title()
+            feat = rnd.choice(['PPL', 'PPL', 'PPLL', 'CH', 'CMTY', 'PPLX', 'STM'])
+            file.write(geoname_line(geoid, name, round(rnd.uniform(30, 55), 4), round(rnd.uniform(-120, 10), 4), 'P',
+                                    feat, iso, admin1, '', rnd.choice([0, 500, 20000, 200000])))
+            geoid += 1
+
+    with open(os.path.join(directory, 'alternateNamesV2.txt'), 'w', encoding='utf-8') as file:
+        for alt_id, (key, name, lang) in enumerate(alternate_names):
+            file.write(f'{alt_id + 1}\t{geoids[key]}\t{lang}\t{name}\t\t\t\t\t\t\n')
+
+    for name, dct in [('country_list.pkl', countries), ('languages_list.pkl', languages), ('output_list.pkl', {})]:
+        with open(os.path.join(GeoKeys.get_cache_directory(directory), name), 'wb') as file:
+            pickle.dump(dct, file)
+
+
+def make_v2_db(db_path):
+    """
+    Convert a built DB to the version 2 layout:  geodata and admin rowid tables with text columns, altname and
+    version.  The other tables are dropped.  Rows keep their DB IDs
+    """
+    conn = sqlite3.connect(db_path)
+    conn.isolation_level = None
+    conn.execute('BEGIN')
+    for tbl in ['geodata', 'admin']:
+        conn.execute(f"""CREATE TABLE {tbl}_v2    (
+                id           integer primary key autoincrement not null,
+                name     text,
+                country     text,
+                admin1_id     text,
+                admin2_id text,
+                lat      text,
+                lon       text,
+                f_code      text,
+                geoid      text,
+                sdx     text
+                                    );""")
+        conn.execute(f'INSERT INTO {tbl}_v2(id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx) '
+                     f'SELECT id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx FROM {tbl} ORDER BY id')
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'view'").fetchall():
+        conn.execute(f'DROP VIEW {name}')
+    # Virtual tables first.  Their shadow tables are dropped with them
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL%'").fetchall():
+        conn.execute(f'DROP TABLE {name}')
+    for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                              "AND name NOT IN ('altname', 'version', 'geodata_v2', 'admin_v2')").fetchall():
+        conn.execute(f'DROP TABLE {name}')
+    for tbl in ['geodata', 'admin']:
+        conn.execute(f'ALTER TABLE {tbl}_v2 RENAME TO {tbl}')
+    conn.execute('INSERT INTO version(version) VALUES(2)')
+    conn.execute('COMMIT')
+    conn.execute('VACUUM')
+    conn.close()
+
+
+def open_geodata(directory, memo_enabled=True, progress_bar=None, **settings) -> Geodata.Geodata:
+    """
+    Open (and build if needed) the DB for directory
+    :param memo_enabled: False for lookups that don't use or add to the lookup memo
+    :param progress_bar: Object with update_progress(val, msg) and shutdown_requested, e.g. to cancel a build
+    :param settings: GeodataFiles attributes to set before the DB is opened, e.g. snapshot_enabled=False
+    """
+    geodata = Geodata.Geodata(directory_name=directory, progress_bar=progress_bar)
+    geodata.memo_enabled = memo_enabled
+    for key, val in settings.items():
+        setattr(geodata.geo_files, key, val)
+    if geodata.read() or geodata.read_geonames():
+        raise ValueError(f'Cannot open test database in {directory}')
+    return geodata
+
+
+class GeonameDir:
+    """ Temporary geonames directory with a built DB.  Shared by the tests in a class """
+
+    def __init__(self, filler=1500):
+        self.directory = tempfile.mkdtemp(prefix='geofinder_test_')
+        make_geoname_dir(self.directory, filler)
+        self.cache_dir = GeoKeys.get_cache_directory(self.directory)
+        self.db_path = os.path.join(self.cache_dir, 'geodata.db')
+
+    def set_countries(self, iso_list):
+        # Change the supported country list
+        with open(os.path.join(self.cache_dir, 'country_list.pkl'), 'wb') as file:
+            pickle.dump({iso: '' for iso in iso_list}, file)
+
+    def open(self, memo_enabled=True, progress_bar=None, **settings) -> Geodata.Geodata:
+        return open_geodata(self.directory, memo_enabled, progress_bar, **settings)
+
+    def remove(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+
+import unittest
+
+from geofinder import GeoDB, GeoKeys, Loc
+from geofinder.GeoKeys import Entry, Query, Result
+from geofinder.test import Fixture
+
+# Admin rows with duplicate names:  name, iso, admin1, admin2, lat, lon, feature, geoid
+duplicates = [
+    # Second ADM1 with the same name in a country
+    ('nova scotia', 'ca', '99', '', 45.1, -63.1, 'ADM1', '9001'),
+    # Alias for an ADM1 that sorts before its name
+    ('acadia', 'ca', '07', '', 45.0, -63.0, 'ADM1', '1001'),
+    # ADM2 with the same name in the same ADM1, in another ADM1 and in another country
+    ('kent', 'gb', 'ENG', 'G9', 51.3, 0.8, 'ADM2', '9002'),
+    ('kent', 'gb', 'NIR', 'N1', 54.5, -6.5, 'ADM2', '9003'),
+    ('kent', 'ca', '04', '1308', 46.5, -65.0, 'ADM2', '9004'),
+    # ADM2 ID found in two ADM1 of a country
+    ('essex', 'gb', 'NIR', 'G5', 54.6, -6.6, 'ADM2', '9005'),
+    # Country name used by two countries and a second name for a country
+    ('canada', 'us', '', '', 40.0, -100.0, 'ADM0', '9006'),
+    ('great britain', 'gb', '', '', 54.0, -2.0, 'ADM0', '9007'),
+]
+
+
+class TestAdminMaps(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        geodata = cls.geonames.open()
+        geodb = geodata.geo_files.geodb
+        geodb.db.begin()
+        for name, iso, admin1, admin2, lat, lon, feat, geoid in duplicates:
+            geodb.insert(geo_row=geodb.make_georow(name, iso, admin1, admin2, lat, lon, feat, geoid, GeoKeys.get_soundex(name)),
+                         feat_code=feat)
+        geodb.db.commit()
+        geodb.new_build_id()
+        geodata.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open(memo_enabled=False)
+        self.geodb = self.geodata.geo_files.geodb
+        # SQL queries go to SQLite
+        self.geodb.set_snapshot(None)
+        self.geodb.set_hot_tier(None)
+        cur = self.geodb.db.conn.cursor()
+        cur.execute('SELECT name, country, admin1_id, admin2_id, f_code FROM admin')
+        self.admin_rows = cur.fetchall()
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def sql_rows(self, *query_list) -> []:
+        # Rows for the SQL queries the maps replace
+        return self.geodb.db.process_query_list(from_tbl='main.admin', query_list=list(query_list))[0]
+
+    def test_duplicates_loaded(self):
+        maps = self.geodb.load_admin_maps()
+        self.assertEqual('07', maps['admin1_id'][('nova scotia', 'ca')])
+        self.assertEqual('nova scotia', maps['admin1_name'][('ca', '07')])
+        self.assertEqual(['ca', 'us'], maps['country_iso']['canada'])
+        self.assertEqual('united kingdom', maps['country_name']['gb'])
+
+    def test_names(self):
+        # ID to name maps give the name of the first row the SQL query returns
+        for name, iso, admin1, admin2, feat in self.admin_rows:
+            if feat == 'ADM0':
+                rows = self.sql_rows(Query(where="country = ? AND f_code = ? ", args=(iso, 'ADM0'), result=Result.STRONG_MATCH))
+                self.assertEqual(rows[0][Entry.NAME], self.geodb.load_admin_maps()['country_name'][iso], iso)
+            if feat == 'ADM1':
+                rows = self.sql_rows(Query(where="admin1_id = ? AND country = ?  AND f_code = ? ",
+                                           args=(admin1, iso, 'ADM1'), result=Result.STRONG_MATCH))
+                self.assertEqual(rows[0][Entry.NAME], self.geodb.get_admin1_name_direct(admin1, iso), (iso, admin1))
+                place = Loc.Loc()
+                place.country_iso, place.admin1_id = iso, admin1
+                self.assertEqual(rows[0][Entry.NAME], self.geodb.get_admin1_name(place), (iso, admin1))
+            if admin2 != '':
+                for adm1 in [admin1, 'XX']:
+                    rows = self.sql_rows(Query(where="admin2_id = ? AND country = ? AND admin1_id = ?",
+                                               args=(admin2, iso, adm1), result=Result.STRONG_MATCH),
+                                         Query(where="admin2_id = ? AND country = ?", args=(admin2, iso),
+                                               result=Result.PARTIAL_MATCH))
+                    self.assertEqual(rows[0][Entry.NAME], self.geodb.get_admin2_name_direct(adm1, admin2, iso),
+                                     (iso, adm1, admin2))
+                    place = Loc.Loc()
+                    place.country_iso, place.admin1_id, place.admin2_id = iso, adm1, admin2
+                    self.assertEqual(rows[0][Entry.NAME], self.geodb.get_admin2_name(place), (iso, adm1, admin2))
+
+    def test_ids(self):
+        # Name to ID maps give the ID of the first row the SQL query returns
+        for name, iso, admin1, admin2, feat in self.admin_rows:
+            if feat == 'ADM0':
+                # Country name is normalized before the lookup
+                target, modified = GeoKeys.country_normalize(name)
+                rows = self.sql_rows(Query(where="name = ? AND f_code = ? ", args=(target, 'ADM0'), result=Result.STRONG_MATCH))
+                place = Loc.Loc()
+                place.country_name = name
+                self.assertEqual(rows[0][Entry.ISO] if len(rows) > 0 else '', self.geodb.get_country_iso(place), name)
+                self.assertEqual([row[Entry.ISO] for row in rows], self.geodb.load_admin_maps()['country_iso'].get(target, []),
+                                 name)
+            elif feat == 'ADM1':
+                rows = self.sql_rows(Query(where="name = ? AND country = ? AND f_code = ? ", args=(name, iso, 'ADM1'),
+                                           result=Result.STRONG_MATCH))
+                place = Loc.Loc()
+                place.country_iso, place.admin1_name = iso, name
+                self.geodb.get_admin1_id(place)
+                self.assertEqual(rows[0][Entry.ADM1], place.admin1_id, (name, iso))
+            elif feat == 'ADM2':
+                rows = self.sql_rows(Query(where="name = ? AND country = ? AND admin1_id=? AND f_code=?",
+                                           args=(name, iso, admin1, 'ADM2'), result=Result.STRONG_MATCH))
+                place = Loc.Loc()
+                place.country_iso, place.admin1_id, place.admin2_name = iso, admin1, name
+                self.geodb.get_admin2_id(place)
+                self.assertEqual(rows[0][Entry.ADM2], place.admin2_id, (name, iso, admin1))
+
+                rows = self.sql_rows(Query(where="name = ? AND country = ? AND f_code=?", args=(name, iso, 'ADM2'),
+                                           result=Result.STRONG_MATCH))
+                place = Loc.Loc()
+                place.country_iso, place.admin2_name = iso, name
+                self.geodb.get_admin2_id(place)
+                self.assertEqual(rows[0][Entry.ADM2], place.admin2_id, (name, iso))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import unittest
+
+from geofinder import BatchCache, DB, Loc
+from geofinder.GeoKeys import Entry
+from geofinder.Snapshot import SELECT_STR
+from geofinder.test import Fixture
+
+locations = ['halifax, nova scotia, canada', 'st andrews, canada', 'dover, kent, england, united kingdom',
+             'munich, bavaria, germany', 'zzqq, ontario, canada', 'halifax, nova scotia, canada', 'parigi, france']
+
+
+class TestBatchCache(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open(snapshot_enabled=False)
+        # Each lookup goes to the DB
+        self.geodata.lookup_memo.close()
+        self.geodata.lookup_memo = None
+        self.geodb = self.geodata.geo_files.geodb
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def test_select(self):
+        # Queries on a batch name give the SQLite rows.  Other queries aren't answered
+        cache = BatchCache.BatchCache(self.geodb, {'st andrews', 'ontario', 'dover'})
+        db = self.geodb.db
+        for where, args, tbl in [('name = ? AND country = ?', ('st andrews', 'ca'), 'main.geodata'),
+                                 ('name = ? AND country = ? AND admin1_id = ?', ('st andrews', 'ca', '07'), 'main.geodata'),
+                                 ('name = ? AND country = ?', ('ontario', 'ca'), 'main.admin'),
+                                 ('name = ?', ('dover',), 'main.geodata')]:
+            self.assertEqual(sorted(db.select(SELECT_STR, where, tbl, args)), sorted(cache.select(SELECT_STR, where, tbl, args)),
+                             where)
+            # Ranked queries have a defined order
+            rows = cache.select(SELECT_STR, where, tbl, args, limit=2, ranked=True)
+            cur = db.conn.cursor()
+            cur.execute(f'SELECT {SELECT_STR} FROM {tbl} WHERE {where} {DB.RANK_ORDER} LIMIT 2', args)
+            self.assertEqual(cur.fetchall(), rows, where)
+        self.assertEqual([], cache.select(SELECT_STR, 'name = ? AND country = ?', 'main.geodata', ('dover', 'ca')))
+        self.assertIsNone(cache.select(SELECT_STR, 'name = ?', 'main.geodata', ('halifax',)))
+        self.assertIsNone(cache.select(SELECT_STR, 'name LIKE ?', 'main.geodata', ('dov%',)))
+
+    def test_find_locations(self):
+        # Batch lookup gives the same places as single lookups, in entry order
+        expected = []
+        for location in locations:
+            place = Loc.Loc()
+            self.geodata.find_location(location, place, True)
+            expected.append(place)
+        places = self.geodata.find_locations(locations, shutdown=True)
+        self.assertIsNone(self.geodb.db.batch)
+        self.assertEqual(len(locations), len(places))
+        for location, place, single in zip(locations, places, expected):
+            self.assertEqual((single.result_type, [row[Entry.ID] for row in single.georow_list]),
+                             (place.result_type, [row[Entry.ID] for row in place.georow_list]), location)
+
+    def test_event_year(self):
+        # Entries can be (location, event year)
+        places = self.geodata.find_locations([('halifax, nova scotia, canada', 1900), ('dover, kent, england', None)])
+        self.assertEqual(1900, places[0].event_year)
+        self.assertEqual(Fixture.geoids['halifax'], places[0].georow_list[0][Entry.ID])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import unittest
+from unittest import mock
+
+from geofinder import BatchGeoFinder, Geodata, GeoKeys
+from geofinder.test import Fixture
+
+gedcom_places = ['halifax, nova scotia, canada', 'dover, kent, england, united kingdom', 'st andrews, canada',
+                 'paris, france', 'zzqq, ontario, canada', 'halifax, nova scotia, canada']
+
+
+class TestBatchGeoFinder(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        for name in os.listdir(self.geonames.cache_dir):
+            if name.startswith('lookup_memo') or name == 'global_replace.pkl':
+                os.remove(os.path.join(self.geonames.cache_dir, name))
+        self.in_path = os.path.join(self.geonames.directory, 'test.ged')
+        with open(self.in_path, 'w', encoding='utf-8') as file:
+            file.write('0 HEAD\n')
+            for idx, place in enumerate(gedcom_places):
+                file.write(f'0 @I{idx}@ INDI\n1 BIRT\n2 DATE 1900\n2 PLAC {place}\n')
+            file.write('0 TRLR\n')
+
+    def run_batch(self, workers):
+        finder = BatchGeoFinder.BatchGeoFinder(directory=self.geonames.directory, in_path=self.in_path,
+                                               workers=workers, diagnostics=False)
+        self.assertFalse(finder.run())
+        with open(f'{self.in_path}.import.ged', encoding='utf-8') as file:
+            output = file.read()
+        return finder, output
+
+    def test_single_pass(self):
+        # Places are looked up one at a time, not as batches of one
+        with mock.patch.object(Geodata.Geodata, 'find_locations', side_effect=AssertionError('batch lookup')):
+            finder, output = self.run_batch(workers=1)
+        self.assertEqual(4, finder.matched_count)
+        self.assertEqual(2, finder.review_count)
+        # Each distinct place is looked up once, in one read of the file
+        self.assertEqual(5, len(finder.results))
+        self.assertFalse(os.path.exists(f'{self.in_path}.{BatchGeoFinder.scan_suffix}'))
+        self.assertIn('2 PLAC Halifax, Halifax County, Nova Scotia, Canada', output)
+        self.assertIn('2 PLAC zzqq, ontario, canada', output)
+        with open(f'{self.in_path}.review.txt', encoding='utf-8') as file:
+            review = file.read()
+        self.assertIn('st andrews, canada', review)
+
+    def test_workers_match_single_pass(self):
+        # Lookups on a LookupEngine give the same import file.  The main process has no memo
+        single = self.run_batch(workers=1)[1]
+        os.remove(os.path.join(self.geonames.cache_dir, 'global_replace.pkl'))
+        finder, output = self.run_batch(workers=2)
+        self.assertEqual(single, output)
+        self.assertIsNone(finder.geodata.lookup_memo)
+
+    def test_headless_messages(self):
+        # Message boxes go to the log when there is no display
+        self.assertFalse(GeoKeys.gui_enabled)
+        with self.assertLogs('geofinder.GeoKeys', level='WARNING'):
+            self.assertFalse(GeoKeys.show_message('askyesno', 'Error', 'Delete?'))
+
+
+if __name__ == '__main__':
+    unittest.main()
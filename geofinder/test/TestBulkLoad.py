@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from geofinder import GeoDB, GeoKeys
+
+# Message boxes go to the log
+GeoKeys.gui_enabled = False
+
+
+def georow(name, iso, admin1, feat, geoid):
+    return GeoDB.GeoDB.make_georow(name, iso, admin1, '', 40.0, -100.0, feat, geoid, GeoKeys.get_soundex(name))
+
+
+class TestBulkLoad(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix='geofinder_test_')
+        self.geodb = GeoDB.GeoDB(db_path=os.path.join(self.directory, 'geodata.db'), version=4)
+        # Small batches so a load is written in several executemany batches
+        self.geodb.bulk_batch_size = 3
+
+    def tearDown(self) -> None:
+        self.geodb.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def rows(self, tbl) -> []:
+        cur = self.geodb.db.conn.cursor()
+        cur.execute(f'SELECT id, name, geoid FROM {tbl} ORDER BY id')
+        return cur.fetchall()
+
+    def load(self, names, feat='PPL', sort_rows=True):
+        # Bulk load a place for each name.  Geoids are 1, 2, ... in name order
+        self.geodb.begin_bulk_load(sort_rows)
+        for idx, name in enumerate(names):
+            self.assertIsNone(self.geodb.insert(georow(name, 'us', 'CA', feat, str(idx + 1)), feat))
+        self.geodb.end_bulk_load()
+
+    def test_row_ids(self):
+        # IDs are assigned when each batch is written and follow on from the previous batch and the previous load
+        self.load(['a', 'b', 'c', 'd', 'e', 'f', 'g'])
+        self.assertEqual([1, 2, 3, 4, 5, 6, 7], [row[0] for row in self.rows('geodata')])
+        self.assertEqual(8, self.geodb.get_next_id('geodata'))
+        self.load(['h', 'i'])
+        self.assertEqual(list(range(1, 10)), [row[0] for row in self.rows('geodata')])
+
+        # Single row inserts use the same IDs
+        self.geodb.db.begin()
+        self.assertEqual(10, self.geodb.insert(georow('j', 'us', 'CA', 'PPL', '10'), 'PPL'))
+        self.assertEqual(1, self.geodb.insert(georow('california', 'us', 'CA', 'ADM1', '11'), 'ADM1'))
+        self.geodb.db.commit()
+        self.assertEqual(11, self.geodb.get_next_id('geodata'))
+        self.assertEqual(2, self.geodb.get_next_id('admin'))
+
+    def test_sorted_batches(self):
+        # Each geodata batch is sorted by name.  Rows are not moved between batches
+        self.load(['c', 'a', 'b', 'f', 'e', 'd', 'g'])
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'f', 'g'], [row[1] for row in self.rows('geodata')])
+        self.assertEqual(['2', '3', '1', '6', '5', '4', '7'], [row[2] for row in self.rows('geodata')])
+
+        self.load(['z', 'y', 'x'], sort_rows=False)
+        self.assertEqual(['z', 'y', 'x'], [row[1] for row in self.rows('geodata')][-3:])
+
+    def test_admin_order(self):
+        # Admin rows keep insertion order, so a US state name comes before its abbreviation and is the name for the ID
+        self.load(['california', 'ca', 'alta california'], feat='ADM1')
+        self.assertEqual(['california', 'ca', 'alta california'], [row[1] for row in self.rows('admin')])
+        self.assertEqual('california', self.geodb.load_admin_maps()['admin1_name'][('us', 'CA')])
+
+    def test_alternate_names(self):
+        # Alternate names are written with each batch.  Staged names are joined to the geoids loaded in earlier batches
+        self.geodb.begin_bulk_load()
+        for idx, name in enumerate(['a', 'b', 'c', 'd', 'e']):
+            self.geodb.insert(georow(name, 'us', 'CA', 'PPL', str(idx + 1)), 'PPL')
+            self.geodb.insert_alternate_name(name.upper(), str(idx + 1), 'ut8')
+        self.geodb.insert(georow('california', 'us', 'CA', 'ADM1', '6'), 'ADM1')
+        self.geodb.end_bulk_load()
+        cur = self.geodb.db.conn.cursor()
+        cur.execute('SELECT geoid FROM altname ORDER BY geoid')
+        self.assertEqual(['1', '2', '3', '4', '5'], [row[0] for row in cur.fetchall()])
+
+        self.geodb.create_alt_stage()
+        self.geodb.db.begin()
+        self.geodb.insert_alt_stage([(101, '1', 'fr', 'Aa'), (102, '5', 'de', 'Ee'), (103, '6', 'en', 'Golden State'),
+                                     (104, '6', 'fr', 'Californie'), (105, '99', 'fr', 'Missing')])
+        self.assertEqual(3, self.geodb.load_alt_stage(['us']))
+        self.geodb.db.commit()
+
+        # Alias rows follow on from the loaded rows.  English names for ADM entries are only in altid
+        self.assertEqual([(6, 'aa', '1'), (7, 'ee', '5')], self.rows('geodata')[-2:])
+        self.assertEqual([(1, 'california', '6'), (2, 'californie', '6')], self.rows('admin'))
+        cur.execute("SELECT geoid, name FROM altname WHERE lang != 'ut8' ORDER BY geoid, name")
+        self.assertEqual([('1', 'Aa'), ('5', 'Ee'), ('6', 'Californie')], cur.fetchall())
+        cur.execute('SELECT id FROM altid ORDER BY id')
+        self.assertEqual([101, 102, 103, 104], [row[0] for row in cur.fetchall()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+
+import unittest
+
+from geofinder import DB, QueryStats
+from geofinder.GeoKeys import Query, Result
+from geofinder.test import Fixture
+
+SELECT_STR = 'name, country, geoid'
+STRONG = Query(where='name = ? AND country = ?', args=('dover', 'gb'), result=Result.STRONG_MATCH)
+STRONG_NONE = Query(where='name = ? AND country = ?', args=('dover', 'ca'), result=Result.STRONG_MATCH)
+PARTIAL = Query(where='name = ?', args=('canterbury',), result=Result.PARTIAL_MATCH)
+PARTIAL_NONE = Query(where='name = ?', args=('nowhere',), result=Result.PARTIAL_MATCH)
+SOUNDEX = Query(where='name LIKE ?', args=('st a%',), result=Result.SOUNDEX_MATCH)
+
+
+class TestCascade(unittest.TestCase):
+    geonames = None
+    geodata = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geodata = cls.geonames.open()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geodata.close()
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.db = self.geodata.geo_files.geodb.db
+
+    def tearDown(self) -> None:
+        self.db.set_cascade_profile('legacy')
+
+    def run_cascade(self, profile, query_list):
+        # Run the cascade directly, not through the query cache.  Returns rows, result and the stats of each stage
+        self.db.set_cascade_profile(profile)
+        self.db.query_stats = QueryStats.QueryStats()
+        row_list, res = self.db.run_query_list(SELECT_STR, 'main.geodata', query_list)
+        stats = {(item['result'], item['where']): item for item in self.db.query_stats.get_list()}
+        return row_list, res, [stats.get((QueryStats.result_names[query.result], query.where)) for query in query_list]
+
+    def assert_stages(self, stats, runs, skips):
+        # Runs and skips of each stage
+        self.assertEqual(runs, [item['runs'] if item else 0 for item in stats])
+        self.assertEqual(skips, [item['skips'] if item else 0 for item in stats])
+
+    def test_default(self):
+        # Default is the cascade from before profiles: no early stop, fallbacks always run and limit_str rows
+        self.assertEqual('legacy', self.geodata.geo_files.cascade_profile)
+        self.assertEqual('legacy', self.db.cascade_profile)
+        self.assertEqual(DB.CascadePolicy(min_rows=7, stop_on=(), fallback='always', top_k=None), self.db.cascade_policy)
+        self.assertEqual(105, len(self.db.select(SELECT_STR, 'name LIKE ?', 'main.geodata', ('%',))))
+
+    def test_legacy(self):
+        # Every stage runs until 7 rows are found
+        row_list, res, stats = self.run_cascade('legacy', [STRONG, PARTIAL, SOUNDEX])
+        self.assert_stages(stats, [1, 1, 1], [0, 0, 0])
+        self.assertEqual(['dover', 'canterbury', 'st andrews', 'st andrews', 'st andrews'], [row[0] for row in row_list])
+        self.assertEqual(Result.NO_MATCH, res)
+
+        row_list, res, stats = self.run_cascade('legacy', [Query('name LIKE ?', ('%',), Result.PARTIAL_MATCH), STRONG])
+        self.assert_stages(stats, [1, 0], [0, 0])
+        self.assertEqual(Result.PARTIAL_MATCH, res)
+
+    def test_interactive(self):
+        # Stop on a strong match.  Partial matches don't stop and fallbacks run
+        row_list, res, stats = self.run_cascade('interactive', [STRONG, PARTIAL, SOUNDEX])
+        self.assert_stages(stats, [1, 0, 0], [0, 0, 0])
+        self.assertEqual((1, Result.STRONG_MATCH), (len(row_list), res))
+        self.assertEqual(1, stats[0]['stops'])
+
+        row_list, res, stats = self.run_cascade('interactive', [STRONG_NONE, PARTIAL, SOUNDEX])
+        self.assert_stages(stats, [1, 1, 1], [0, 0, 0])
+        self.assertEqual((4, Result.NO_MATCH), (len(row_list), res))
+
+    def test_batch(self):
+        # Stop on any name match.  Fallbacks only run when nothing was found
+        row_list, res, stats = self.run_cascade('batch', [STRONG_NONE, PARTIAL, SOUNDEX])
+        self.assert_stages(stats, [1, 1, 0], [0, 0, 0])
+        self.assertEqual((1, Result.PARTIAL_MATCH), (len(row_list), res))
+
+        row_list, res, stats = self.run_cascade('batch', [STRONG_NONE, PARTIAL_NONE, SOUNDEX])
+        self.assert_stages(stats, [1, 1, 1], [0, 0, 0])
+        self.assertEqual(3, len(row_list))
+
+    def test_strict(self):
+        # Fallbacks never run
+        row_list, res, stats = self.run_cascade('strict', [STRONG_NONE, PARTIAL_NONE, SOUNDEX])
+        self.assert_stages(stats, [1, 1, 0], [0, 0, 1])
+        self.assertEqual(([], Result.NO_MATCH), (row_list, res))
+
+    def test_no_wildcards(self):
+        # Lookups without wildcards skip fallbacks in every profile
+        self.db.lookup_wildcards = False
+        try:
+            for profile in DB.cascade_profiles:
+                row_list, res, stats = self.run_cascade(profile, [STRONG_NONE, PARTIAL_NONE, SOUNDEX])
+                self.assert_stages(stats, [1, 1, 0], [0, 0, 1])
+        finally:
+            self.db.lookup_wildcards = True
+
+    def test_unknown_profile(self):
+        self.db.set_cascade_profile('batch')
+        with self.assertLogs('geofinder.DB', level='WARNING'):
+            self.db.set_cascade_profile('fastest')
+        self.assertEqual('batch', self.db.cascade_profile)
+
+
+class TestQueryStats(unittest.TestCase):
+    def test_stats(self):
+        # Runs, hits, rows, stops and skips for each stage.  Slowest stage first
+        stats = QueryStats.QueryStats()
+        strong = ('geodata', 'name = ?', Result.STRONG_MATCH)
+        soundex = ('geodata', 'sdx  =\n ?', Result.SOUNDEX_MATCH)
+        stats.add(strong, 0, 0.001, False)
+        stats.add(strong, 3, 0.002, True)
+        stats.add(soundex, 5, 0.010, False)
+        stats.add_skip(soundex)
+        self.assertEqual([{'table': 'geodata', 'where': 'sdx = ?', 'result': 'SOUNDEX_MATCH', 'runs': 1, 'hits': 1,
+                           'rows': 5, 'ms': 10.0, 'ms_per_run': 10.0, 'stops': 0, 'skips': 1},
+                          {'table': 'geodata', 'where': 'name = ?', 'result': 'STRONG_MATCH', 'runs': 2, 'hits': 1,
+                           'rows': 3, 'ms': 3.0, 'ms_per_run': 1.5, 'stops': 1, 'skips': 0}], stats.get_list())
+        lines = stats.get_stats().split('\n')
+        self.assertEqual(3, len(lines))
+        self.assertIn('STRONG_MATCH [name = ?]  2  50.0%  3.0  1.500  1  0', lines[2])
+
+        stats.clear()
+        self.assertEqual([], stats.get_list())
+
+    def test_skip_only(self):
+        # A stage that was only skipped has no runs
+        stats = QueryStats.QueryStats()
+        stats.add_skip(('admin', 'name = ?', Result.WILDCARD_MATCH))
+        item = stats.get_list()[0]
+        self.assertEqual((0, 0.0, 1), (item['runs'], item['ms_per_run'], item['skips']))
+        self.assertIn('0  0.0%  0.0  0.000  0  1', stats.get_stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
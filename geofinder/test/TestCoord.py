@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from geofinder import Gedcom, Geodata, GeoKeys, Loc
+from geofinder.GeoKeys import Entry, Result
+from geofinder.test import Fixture
+
+
+class TestGedcomCoord(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix='geofinder_test_')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_coords(self, text) -> []:
+        # Coordinate for each PLAC entry in GEDCOM text
+        path = os.path.join(self.directory, 'test.ged')
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        handler = Gedcom.Gedcom(in_path=path, out_suffix='', cache_d=self.directory, progress=None, geodata=None)
+        coords = []
+        while True:
+            entry, eof, rec_id = handler.get_next_place()
+            if eof:
+                break
+            coords.append(handler.get_coord())
+        handler.close()
+        return coords
+
+    def test_map(self):
+        # MAP can follow other PLAC subordinate lines.  MAP of a later structure isn't used
+        text = '0 @I1@ INDI\n1 BIRT\n2 PLAC Halifax\n3 MAP\n4 LATI N44.646\n4 LONG W63.57\n' \
+               '1 DEAT\n2 PLAC Dover\n3 FORM City, County\n3 NOTE Town\n4 CONC hall\n3 MAP\n4 LONG E1.31\n4 LATI N51.13\n' \
+               '1 BURI\n2 PLAC Paris\n2 DATE 1900\n' \
+               '1 RESI\n2 PLAC Munich\n2 MAP\n3 LATI N48.1\n3 LONG E11.5\n' \
+               '1 EVEN\n2 PLAC Nowhere\n3 MAP\n4 LATI N48.1\n3 NOTE no longitude\n0 TRLR\n'
+        self.assertEqual([(44.646, -63.57), (51.13, 1.31), None, None, None], self.read_coords(text))
+
+
+class TestConfirmByCoord(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open()
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def lookup(self) -> Loc.Loc:
+        # Three St. Andrews in Canada.  Not a strong match without a coordinate
+        place = Loc.Loc()
+        self.geodata.find_location_tiered('st andrews, canada', place, True)
+        self.assertNotEqual(Result.STRONG_MATCH, place.result_type)
+        self.assertEqual(3, len(place.georow_list))
+        return place
+
+    def test_confirm(self):
+        # Closest match within the radius is used
+        place = self.lookup()
+        ns = Fixture.places['st_andrews_ns']
+        self.geodata.confirm_by_coord(place, (ns[1] + 0.01, ns[2]))
+        self.assertEqual(Result.STRONG_MATCH, place.result_type)
+        self.assertEqual([Fixture.geoids['st_andrews_ns']], [row[Entry.ID] for row in place.georow_list])
+
+    def test_score_gate(self):
+        # A match that doesn't score well enough for a strong match isn't promoted by distance alone
+        place = self.lookup()
+        place.georow_list = [row[:Entry.SCORE] + (Geodata.STRONG_MATCH_SCORE,) + row[Entry.SCORE + 1:]
+                             for row in place.georow_list]
+        ns = Fixture.places['st_andrews_ns']
+        self.geodata.confirm_by_coord(place, (ns[1], ns[2]))
+        self.assertNotEqual(Result.STRONG_MATCH, place.result_type)
+        self.assertEqual(3, len(place.georow_list))
+
+    def test_radius(self):
+        place = self.lookup()
+        self.geodata.confirm_by_coord(place, (10.0, 10.0))
+        self.assertNotEqual(Result.STRONG_MATCH, place.result_type)
+
+    def test_distance(self):
+        self.assertAlmostEqual(111.2, GeoKeys.get_distance(45.0, -63.0, 46.0, -63.0), places=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import http.client
+import json
+import threading
+import unittest
+import urllib.parse
+
+from geofinder import GeoServer
+from geofinder.LookupEngine import open_geodata
+from geofinder.test import Fixture
+
+
+class TestGeoServer(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = open_geodata(self.geonames.directory, memo_enabled=False)
+        self.server = GeoServer.GeoServer(self.geodata, batch_size=2)
+        self.httpd = self.server.make_server('127.0.0.1', 0)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        self.httpd.shutdown()
+        self.thread.join()
+        self.httpd.server_close()
+        self.geodata.close()
+
+    def request(self, method, path, body=None, headers=None):
+        # Returns (status, response body)
+        conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=30)
+        try:
+            if headers is None:
+                conn.request(method, path, body=body)
+            else:
+                conn.putrequest(method, path)
+                for key, val in headers.items():
+                    conn.putheader(key, val)
+                conn.endheaders(body)
+            response = conn.getresponse()
+            return response.status, response.read().decode('utf-8')
+        finally:
+            conn.close()
+
+    def get_json(self, path):
+        status, text = self.request('GET', path)
+        return status, json.loads(text)
+
+    def post_batch(self, lines):
+        status, text = self.request('POST', '/batch', body='\n'.join(lines).encode('utf-8'))
+        return status, [json.loads(line) for line in text.splitlines()]
+
+    def test_lookup(self):
+        status, result = self.get_json('/lookup?' + urllib.parse.urlencode({'place': 'halifax, nova scotia, canada',
+                                                                           'year': 1900}))
+        self.assertEqual(200, status)
+        self.assertEqual(('STRONG_MATCH', Fixture.geoids['halifax']), (result['result'], result['geoid']))
+        self.assertEqual(Fixture.geoids['halifax'], result['candidates'][0]['geoid'])
+
+        status, result = self.get_json('/geoid?id=' + Fixture.geoids['dover'])
+        self.assertEqual((200, Fixture.geoids['dover']), (status, result['geoid']))
+
+    def test_connections(self):
+        # Requests are handled on a fixed pool of threads.  DB connections don't grow with the number of requests
+        db = self.geodata.geo_files.geodb.db
+        errors = []
+
+        def run(base):
+            for idx in range(100):
+                status, result = self.get_json('/lookup?' + urllib.parse.urlencode({'place': f'halifax {base} {idx}'}))
+                if status != 200:
+                    errors.append(status)
+
+        threads = [threading.Thread(target=run, args=(base,)) for base in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertLessEqual(len(db.pool), self.server.threads + 1)
+        self.assertLessEqual(len([thread for thread in threading.enumerate() if thread.name.startswith('geoserver')]),
+                             self.server.threads)
+
+    def test_bad_requests(self):
+        for path, code in [('/lookup', 400), ('/lookup?place=dover&year=abc', 400), ('/geoid', 400), ('/other', 404)]:
+            status, result = self.get_json(path)
+            self.assertEqual(code, status, path)
+            self.assertIn('error', result)
+        self.assertEqual(404, self.request('POST', '/lookup', body=b'')[0])
+
+    def test_health_metrics(self):
+        status, result = self.get_json('/health')
+        self.assertEqual(('ok', True), (result['status'], result['rows'] > 1000))
+        self.get_json('/lookup?place=paris%2C+france')
+        self.get_json('/lookup')
+        status, result = self.get_json('/metrics')
+        self.assertEqual(200, status)
+        self.assertEqual((1, 1), (result['lookups'], result['errors']))
+        self.assertEqual(3, result['requests'])
+
+    def test_batch(self):
+        # Results are in input order, with the ids of the input lines.  Blank lines are skipped
+        lines = ['"dover, kent, england, united kingdom"', '', json.dumps({'place': 'paris, france', 'id': 'p1'}),
+                 json.dumps({'place': 'munich, bavaria, germany', 'year': 1950}), '"zzqq, ontario, canada"']
+        status, results = self.post_batch(lines)
+        self.assertEqual(200, status)
+        self.assertEqual(['dover, kent, england, united kingdom', 'paris, france', 'munich, bavaria, germany',
+                          'zzqq, ontario, canada'], [result['place'] for result in results])
+        self.assertEqual('p1', results[1]['id'])
+        self.assertEqual(Fixture.geoids['munich'], results[2]['geoid'])
+
+    def test_batch_errors(self):
+        # Bad lines are reported before any results
+        status, results = self.post_batch(['"dover"', '{"year": 1900}'])
+        self.assertEqual(400, status)
+        self.assertIn('Line 2', results[0]['error'])
+
+        for headers, code in [({'Content-Length': 'abc'}, 400), ({'Content-Length': '-5'}, 400), ({}, 411),
+                              ({'Content-Length': str(self.server.max_body + 1)}, 413)]:
+            status, text = self.request('POST', '/batch', headers=headers)
+            self.assertEqual(code, status, headers)
+            self.assertIn('error', json.loads(text))
+
+    def test_internal_error(self):
+        # Failed lookup gives a 500 error
+        def fail(*args):
+            raise RuntimeError('lookup failed')
+
+        self.server.lookup = fail
+        with self.assertLogs('geofinder.GeoServer', level='ERROR'):
+            status, result = self.get_json('/lookup?place=dover')
+        self.assertEqual((500, 'Internal error: lookup failed'), (status, result['error']))
+        self.assertEqual(1, self.server.errors)
+
+    def test_stream_error(self):
+        # A lookup that fails after results have been sent ends the stream with an error line
+        lookup_batch = self.server.lookup_batch
+        calls = []
+
+        def fail_second(items):
+            calls.append(items)
+            if len(calls) > 1:
+                raise RuntimeError('lookup failed')
+            return lookup_batch(items)
+
+        self.server.lookup_batch = fail_second
+        with self.assertLogs('geofinder.GeoServer', level='ERROR'):
+            status, results = self.post_batch(['"dover"', '"paris, france"', '"halifax, canada"'])
+        self.assertEqual(200, status)
+        self.assertEqual(['dover', 'paris, france'], [result['place'] for result in results[:2]])
+        self.assertEqual({'error': 'Internal error: lookup failed'}, results[2])
+        self.assertEqual(1, self.server.errors)
+
+
+if __name__ == '__main__':
+    unittest.main()
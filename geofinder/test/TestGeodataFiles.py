@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import sqlite3
+import unittest
+from unittest import mock
+
+from geofinder import GeoDB, Prefilter
+from geofinder.test import Fixture
+
+
+def table_rows(db_path, sql) -> []:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+class CancelProgress:
+    # Progress bar that requests a cancel once the build is part way through a file
+    def __init__(self, fname, percent):
+        self.fname = fname
+        self.percent = percent
+        self.shutdown_requested = False
+
+    def update_progress(self, val, msg):
+        if self.fname in msg and val >= self.percent:
+            self.shutdown_requested = True
+
+
+class TestGeodataFiles(unittest.TestCase):
+    serial = None
+
+    @classmethod
+    def setUpClass(cls):
+        # Serial build to compare against
+        cls.serial = Fixture.GeonameDir()
+        cls.serial.open(build_workers=1).close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.serial.remove()
+
+    def assert_same_db(self, db_path):
+        # Row ids depend on insert order so they aren't compared
+        columns = 'geoid, name, country, admin1_id, admin2_id, lat, lon, f_code, sdx, priority'
+        for sql in [f'SELECT {columns} FROM geodata ORDER BY geoid, name',
+                    f'SELECT {columns} FROM admin ORDER BY geoid, name',
+                    'SELECT name, lang, geoid FROM altname ORDER BY geoid, name']:
+            self.assertEqual(table_rows(self.serial.db_path, sql), table_rows(db_path, sql), sql)
+
+    def test_parallel_build(self):
+        # Small shards so the file is split across workers and more shards are submitted than can be in flight
+        geonames = Fixture.GeonameDir()
+        try:
+            geodata = geonames.open(build_workers=2, parallel_threshold=0, shard_size=8 * 1024,
+                                    checkpoint_size=32 * 1024)
+            self.assertGreater(geodata.geo_files.build_rows, 1000)
+            geodata.close()
+            self.assert_same_db(geonames.db_path)
+        finally:
+            geonames.remove()
+
+    def test_cancel_build(self):
+        # Build cancelled part way through allCountries.txt is resumed from its checkpoint and matches a full build
+        for workers in [1, 2]:
+            with self.subTest(workers=workers):
+                settings = {'build_workers': workers, 'parallel_threshold': 0, 'shard_size': 8 * 1024,
+                            'checkpoint_size': 16 * 1024}
+                geonames = Fixture.GeonameDir()
+                try:
+                    # Small chunks so the serial read reports progress several times in the file
+                    with mock.patch.object(Prefilter, 'CHUNK_SIZE', 4 * 1024):
+                        geodata = geonames.open(progress_bar=CancelProgress('allCountries.txt', 30), **settings)
+                    # Build state can be read while the cancelled DB is still open
+                    file_pos, rows, done = table_rows(geonames.db_path, "SELECT file_pos, rows, done FROM build_state "
+                                                                        "WHERE fname = 'allCountries.txt'")[0]
+                    geodata.close()
+                    size = os.path.getsize(os.path.join(geonames.directory, 'allCountries.txt'))
+                    self.assertTrue(0 < file_pos < size, file_pos)
+                    self.assertGreater(rows, 0)
+                    self.assertFalse(done)
+                    self.assertEqual([(-1,)], table_rows(geonames.db_path, 'SELECT version FROM version ORDER BY id DESC LIMIT 1'))
+
+                    with self.assertLogs('geofinder.GeodataFiles', level='INFO') as logs:
+                        geonames.open(**settings).close()
+                    self.assertIn('Resuming database build', '\n'.join(logs.output))
+                    self.assert_same_db(geonames.db_path)
+                finally:
+                    geonames.remove()
+
+    def test_update_countries(self):
+        # Removing and adding countries updates the derived tables in place.  They match a full build
+        full = Fixture.GeonameDir()
+        changed = Fixture.GeonameDir()
+        try:
+            full.set_countries(['ca', 'gb', 'us', 'mx'])
+            full.open(build_workers=1).close()
+            changed.open(build_workers=1).close()
+            changed.set_countries(['ca', 'gb', 'us', 'mx'])
+            with self.assertLogs('geofinder.GeoDB', level='INFO') as logs:
+                geodata = changed.open(build_workers=1)
+            geodb = geodata.geo_files.geodb
+            self.assertEqual(sorted(GeoDB.derived_tables), sorted(geodb.get_current_derived()))
+            geodata.close()
+            self.assertFalse([line for line in logs.output if 'Place titles done' in line or 'Index name_fts done' in line])
+
+            for sql in ['SELECT geoid, name, title, match_title FROM place_title ORDER BY geoid, name',
+                        'SELECT name FROM name_fts ORDER BY name', 'SELECT name FROM name_trigram ORDER BY name',
+                        'SELECT geoid, min_lat, min_lon FROM geodata_rtree ORDER BY geoid, min_lat',
+                        'SELECT geoid, min_lat, min_lon FROM admin_rtree ORDER BY geoid, min_lat']:
+                self.assertEqual(table_rows(full.db_path, sql), table_rows(changed.db_path, sql), sql)
+        finally:
+            full.remove()
+            changed.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import unittest
+
+from geofinder import GeoDB, Loc
+from geofinder.GeoKeys import Entry
+from geofinder.test import Fixture
+
+
+class TestGeodataUpdate(unittest.TestCase):
+    def setUp(self) -> None:
+        self.geonames = Fixture.GeonameDir()
+        self.geonames.open().close()
+        self.geodata = None
+
+    def tearDown(self) -> None:
+        if self.geodata is not None:
+            self.geodata.close()
+        self.geonames.remove()
+
+    def apply(self, fname, lines):
+        # Write a geonames update file and open the DB, which applies it
+        with open(os.path.join(self.geonames.directory, fname), 'w', encoding='utf-8') as file:
+            file.writelines(lines)
+        self.geodata = self.geonames.open()
+        return self.geodata.geo_files.geodb
+
+    def count_rows(self, tbl, geoid) -> int:
+        cur = self.geodata.geo_files.geodb.db.conn.cursor()
+        cur.execute(f'SELECT COUNT(*) FROM {tbl} WHERE geoid = ?', (geoid,))
+        return cur.fetchall()[0][0]
+
+    def test_delete(self):
+        # All rows for the geoid are removed: primary name, alias (Douvres), altname and altid
+        dover = Fixture.geoids['dover']
+        self.geodata = self.geonames.open()
+        self.assertEqual(2, len(self.geodata.geo_files.geodb.get_geoid_rows(dover)))
+        self.assertEqual(1, self.count_rows('altid', dover))
+        self.geodata.close()
+
+        geodb = self.apply('deletes-2020-01-02.txt', [f'{dover}\tDover\tduplicate\n'])
+        self.assertEqual([], geodb.get_geoid_rows(dover))
+        for tbl in ['altname', 'altid']:
+            self.assertEqual(0, self.count_rows(tbl, dover), tbl)
+        self.assertIn('deletes-2020-01-02.txt', geodb.get_applied_updates())
+
+        place = Loc.Loc()
+        self.geodata.find_location('dover, kent, england, united kingdom', place, True)
+        self.assertNotIn(dover, [row[Entry.ID] for row in place.georow_list])
+
+    def test_modification(self):
+        # Row is replaced and the alternate name alias moves with it
+        dover = Fixture.geoids['dover']
+        geodb = self.apply('modifications-2020-01-02.txt',
+                           [Fixture.geoname_line(dover, 'Dover', 51.2, 1.3, 'P', 'PPL', 'GB', 'ENG', 'G5', 1)])
+        rows = geodb.get_geoid_rows(dover)
+        self.assertEqual(['dover', 'douvres'], [row[Entry.NAME] for tbl, row_id, row in rows])
+        self.assertEqual([51.2, 51.2], [row[Entry.LAT] for tbl, row_id, row in rows])
+
+    def check_derived(self, geodb) -> {}:
+        # Derived tables match the geodata and admin rows.  Returns the place_title table
+        self.assertEqual(list(GeoDB.derived_tables), geodb.get_current_derived())
+        self.assertTrue(geodb.titles_current)
+        cur = geodb.db.conn.cursor()
+        rows = []
+        for tbl in ['admin', 'geodata']:
+            cur.execute(f'SELECT name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx FROM {tbl}')
+            rows.extend(cur.fetchall())
+        cur.execute('SELECT geoid, name, title, match_title FROM place_title')
+        table = {(geoid, name): (title, match_title) for geoid, name, title, match_title in cur.fetchall()}
+        built = {(row[Entry.ID], row[Entry.NAME]): geodb.get_row_titles(row) for row in rows}
+        self.assertEqual(built, table)
+        self.assertEqual(built, geodb.get_titles(rows))
+
+        for tbl, base in GeoDB.base_table.items():
+            # Each row has the entry for its ID and the R*Tree has no other entries
+            cur.execute(f'SELECT (SELECT COUNT(*) FROM {base}), (SELECT COUNT(*) FROM {tbl}_rtree), '
+                        f'(SELECT COUNT(*) FROM {base} b JOIN {tbl}_rtree r ON r.id = b.id AND r.geoid = b.geoid '
+                        f'AND r.min_lat <= b.lat AND r.max_lat >= b.lat AND r.min_lon <= b.lon AND r.max_lon >= b.lon)')
+            count, rtree_count, match_count = cur.fetchall()[0]
+            self.assertEqual((count, count), (rtree_count, match_count), tbl)
+        names = {row[Entry.NAME] for row in rows}
+        for tbl in GeoDB.name_index_tokenizer:
+            cur.execute(f'SELECT name FROM {tbl}')
+            self.assertEqual(sorted(names), sorted(row[0] for row in cur.fetchall()), tbl)
+        return table
+
+    def test_derived_not_rebuilt(self):
+        # Derived table rows are updated for the changed geoids.  The tables are not rebuilt
+        geoids = Fixture.geoids
+        with open(os.path.join(self.geonames.directory, 'modifications-2020-01-02.txt'), 'w', encoding='utf-8') as file:
+            file.write(Fixture.geoname_line(geoids['dover'], 'Dover Port', 51.3, 1.4, 'P', 'PPL', 'GB', 'ENG', 'G5', 1))
+            file.write(Fixture.geoname_line('9002', 'Newtown', 50.5, -2.5, 'P', 'PPL', 'GB', 'ENG', 'G5', 10))
+        with open(os.path.join(self.geonames.directory, 'deletes-2020-01-02.txt'), 'w', encoding='utf-8') as file:
+            file.write(f'{geoids["canterbury"]}\tCanterbury\tduplicate\n')
+        with self.assertLogs(level='INFO') as logs:
+            self.geodata = self.geonames.open()
+        messages = '\n'.join(logs.output)
+        self.assertIn('Applied deletes-2020-01-02.txt', messages)
+        for msg in ['Place titles done', 'Index name_fts done', 'Index name_trigram done', 'Spatial index done']:
+            self.assertNotIn(msg, messages)
+
+        geodb = self.geodata.geo_files.geodb
+        self.check_derived(geodb)
+        cur = geodb.db.conn.cursor()
+        cur.execute('SELECT name FROM name_trigram WHERE name LIKE ?', ('%r port%',))
+        self.assertEqual([('dover port',)], cur.fetchall())
+        self.assertEqual(['9002'], [row[Entry.ID] for row in geodb.reverse_lookup(50.5, -2.5, 1.0)])
+
+    def test_titles(self):
+        # Titles are refreshed for the changed entries and the places in a renamed admin area
+        geoids = Fixture.geoids
+        self.apply('modifications-2020-01-02.txt',
+                   [Fixture.geoname_line(geoids['kent'], 'Kent County', 51.2, 0.7, 'A', 'ADM2', 'GB', 'ENG', 'G5', 0),
+                    Fixture.geoname_line(geoids['dover'], 'Dover Port', 51.2, 1.3, 'P', 'PPL', 'GB', 'ENG', 'G5', 1)])
+        self.geodata.close()
+        self.apply('deletes-2020-01-02.txt', [f'{geoids["st_mary"]}\tSt Mary\tduplicate\n'])
+        self.geodata.close()
+        geodb = self.apply('alternateNamesModifications-2020-01-02.txt',
+                           [f'9001\t{geoids["england"]}\tde\tEngland Land\t\t\t\t\t\t\n'])
+
+        table = self.check_derived(geodb)
+        self.assertIn('Kent County', table[(geoids['canterbury'], 'canterbury')][0])
+
+    def test_query_cache_cleared_on_commit(self):
+        # Writes in a transaction leave cached results until the commit
+        self.geodata = self.geonames.open()
+        geodb = self.geodata.geo_files.geodb
+        self.geodata.find_location('canterbury, kent, england, united kingdom', Loc.Loc(), True)
+        count = len(geodb.db.query_cache.entries)
+        self.assertGreater(count, 0)
+
+        geodb.db.begin()
+        geodb.delete_place(Fixture.geoids['st_mary'])
+        self.assertEqual(count, len(geodb.db.query_cache.entries))
+        geodb.db.commit()
+        self.assertEqual(0, len(geodb.db.query_cache.entries))
+
+
+if __name__ == '__main__':
+    unittest.main()
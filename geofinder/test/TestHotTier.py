@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import threading
+import unittest
+
+from geofinder import HotTier, Loc
+from geofinder.GeoKeys import Entry, Result
+from geofinder.Snapshot import SELECT_STR
+from geofinder.test import Fixture
+
+
+class TestHotTier(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open(hot_tier_features=HotTier.DEFAULT_FEATURES, snapshot_enabled=False)
+        self.geodb = self.geodata.geo_files.geodb
+        self.tier = self.geodb.hot_tier
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def sql_rows(self, where, args, tbl):
+        # Same query against SQLite, limited to the tier's feature codes
+        if tbl == 'main.geodata':
+            codes = ', '.join(f"'{feat}'" for feat in self.tier.features)
+            where = f'{where} AND f_code IN ({codes})'
+        return self.geodb.db.select(SELECT_STR, where, tbl, args)
+
+    def test_select(self):
+        # Tier returns the SQLite rows that it holds.  SQLite order is undefined for unranked queries
+        self.assertGreater(self.tier.get_row_count('admin'), 0)
+        for where, args, tbl in [('name = ? AND country = ?', ('halifax', 'ca'), 'main.geodata'),
+                                 ('name LIKE ? AND country = ?', ('m%', 'de'), 'main.geodata'),
+                                 ('name LIKE ?', ('%ova%',), 'main.admin'),
+                                 ('name = ? AND country = ? AND admin1_id = ?', ('ontario', 'ca', '08'), 'main.admin')]:
+            rows = self.tier.select(SELECT_STR, where, tbl, args)
+            self.assertEqual(sorted(self.sql_rows(where, args, tbl)), sorted(rows), where)
+        self.assertEqual([], self.tier.select(SELECT_STR, 'name = ?', 'main.geodata', ('dover',)))
+        self.assertIsNone(self.tier.select(SELECT_STR, 'lat > ?', 'main.geodata', (1.0,)))
+        self.assertIsNone(self.tier.select('geoid', 'name = ?', 'main.geodata', ('dover',)))
+
+    def test_ranked_limit(self):
+        # Ranked query gives the best rows by priority rather than the first rows
+        rows = self.tier.select(SELECT_STR, 'name LIKE ?', 'main.admin', ('%',), limit=3, ranked=True)
+        self.assertEqual(3, len(rows))
+        self.assertEqual(sorted(self.tier.priority['admin'])[:3],
+                         [self.tier.priority['admin'][self.tier.rows['admin'].index(row)] for row in rows])
+
+    def test_parse_where(self):
+        self.assertEqual([('name', 'prefix', 'st'), ('country', '=', 'ca')],
+                         HotTier.parse_where('name LIKE ? AND country = ?', ('st%', 'ca')))
+        self.assertIsNone(HotTier.parse_where('name = ? OR country = ?', ('a', 'ca')))
+        self.assertIsNone(HotTier.parse_where('id = ?', (1,)))
+
+    def test_hits(self):
+        # Large place is found in the tier.  Small place misses the tier and is found in the DB
+        for location, geoid in [('munich, bavaria, germany', 'munich'), ('dover, kent, england, united kingdom', 'dover')]:
+            place = Loc.Loc()
+            self.geodata.find_location_tiered(location, place, True)
+            self.assertEqual(Result.STRONG_MATCH, place.result_type, location)
+            self.assertEqual(Fixture.geoids[geoid], place.georow_list[0][Entry.ID], location)
+        self.assertEqual((1, 1), (self.tier.hits, self.tier.misses))
+        self.assertEqual(0.5, self.tier.get_hit_rate())
+
+    def test_threads(self):
+        # Counters and index builds from several threads
+        def count():
+            for idx in range(2000):
+                self.tier.add_result(idx % 2 == 0)
+                self.tier.get_index('geodata', 'admin2_id')
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((4000, 4000), (self.tier.hits, self.tier.misses))
+
+
+if __name__ == '__main__':
+    unittest.main()
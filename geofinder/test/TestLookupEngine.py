@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import unittest
+
+from geofinder import LookupEngine
+from geofinder.GeoKeys import Entry, Result
+from geofinder.test import Fixture
+
+locations = ['halifax, nova scotia, canada', 'st andrews, canada', 'dover, kent, england, united kingdom',
+             ('munich, bavaria, germany', 1950), 'zzqq, ontario, canada', 'paris, france', 'canterbury, kent, england',
+             'palo alto, california, united states']
+
+
+def get_ids(places) -> []:
+    return [(place.result_type, [row[Entry.ID] for row in place.georow_list]) for place in places]
+
+
+class TestRoute(unittest.TestCase):
+    def make_engine(self, workers) -> LookupEngine.LookupEngine:
+        # Engine with no processes, for routing only
+        engine = LookupEngine.LookupEngine.__new__(LookupEngine.LookupEngine)
+        engine.workers = workers
+        engine.home = {}
+        return engine
+
+    def test_route(self):
+        # Each item goes to one worker.  A country goes to its home worker up to that worker's share
+        engine = self.make_engine(3)
+        items = [LookupEngine.get_item(f'place{idx}, {country}') for idx, country in
+                 enumerate(['canada'] * 6 + ['france'] * 2 + ['germany'])]
+        routes = engine.route(items)
+        self.assertEqual(list(range(len(items))), sorted(idx for worker, indices in routes for idx in indices))
+        self.assertTrue(all(len(indices) <= 3 for worker, indices in routes))
+        canada = [worker for worker, indices in routes if 0 in indices][0]
+        self.assertEqual(engine.home['canada'], canada)
+
+        # Same home on the next request
+        self.assertEqual([(canada, [0])], engine.route([LookupEngine.get_item('halifax, canada')]))
+
+    def test_get_item(self):
+        self.assertEqual(('dover', 0, None), LookupEngine.get_item('dover'))
+        self.assertEqual(('dover', 1900, None), LookupEngine.get_item(('dover', '1900')))
+        self.assertEqual(('dover', 0, (51.1, 1.3)), LookupEngine.get_item(('dover', None, (51.1, 1.3))))
+        self.assertEqual('canada', LookupEngine.get_country_key('Halifax, Nova Scotia, Canada '))
+
+
+class TestLookupEngine(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = LookupEngine.open_geodata(self.geonames.directory, memo_enabled=False)
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def test_find_entries(self):
+        # Entries with a coordinate are looked up once, with the coordinate
+        calls = []
+        find_locations = self.geodata.find_locations
+
+        def count_calls(entries, shutdown=False):
+            calls.extend(entries)
+            return find_locations(entries, shutdown)
+
+        self.geodata.find_locations = count_calls
+        ns = Fixture.places['st_andrews_ns']
+        places = LookupEngine.find_entries(self.geodata, [('dover, kent, england', 0, None),
+                                                          ('st andrews, canada', 0, (ns[1], ns[2]))])
+        self.assertEqual([('dover, kent, england', 0)], calls)
+        self.assertEqual(Result.STRONG_MATCH, places[1].result_type)
+        self.assertEqual(Fixture.geoids['st_andrews_ns'], places[1].georow_list[0][Entry.ID])
+
+    def test_engine(self):
+        # Workers give the same results as a single process, in input order
+        expected = get_ids(LookupEngine.find_entries(self.geodata, [LookupEngine.get_item(entry) for entry in locations]))
+        engine = LookupEngine.LookupEngine(self.geonames.directory, 2, profile='interactive', chunk_size=2)
+        try:
+            self.assertEqual(expected, get_ids(engine.find_locations(locations)))
+            self.assertEqual([], engine.find_locations([]))
+        finally:
+            engine.close()
+
+    def test_worker_exit(self):
+        # A request fails if a worker has exited rather than waiting for ever
+        engine = LookupEngine.LookupEngine(self.geonames.directory, 2, profile='interactive', timeout=30)
+        engine.poll_interval = 0.1
+        try:
+            self.assertEqual(1, len(engine.find_locations(['paris, france'])))
+            engine.processes[0].terminate()
+            engine.processes[0].join()
+            with self.assertLogs('geofinder.LookupEngine', level='ERROR'):
+                with self.assertRaisesRegex(RuntimeError, 'exited'):
+                    engine.find_locations(locations)
+            # Later requests fail at once
+            with self.assertRaisesRegex(RuntimeError, 'exited'):
+                engine.find_locations(['paris, france'])
+        finally:
+            engine.close(timeout=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from geofinder import Loc, LookupMemo
+from geofinder.GeoKeys import Result
+from geofinder.test import Fixture
+
+
+class TestLookupMemo(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix='geofinder_test_')
+        self.path = os.path.join(self.directory, 'lookup_memo.db')
+        self.memo = LookupMemo.LookupMemo(self.path, 'build 1', [1700, 1800])
+
+    def tearDown(self) -> None:
+        if self.memo is not None:
+            self.memo.close()
+        for fname in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, fname))
+        os.rmdir(self.directory)
+
+    @staticmethod
+    def make_place() -> Loc.Loc:
+        place = Loc.Loc()
+        place.city1 = 'halifax'
+        place.country_iso = 'ca'
+        place.result_type = Result.STRONG_MATCH
+        place.georow_list = [('halifax', 'ca', '07', '1209', 44.646, -63.57, 'PPLA', '1007', 0)]
+        place.id = '@P1@'
+        return place
+
+    def count_rows(self) -> int:
+        # Count from a separate connection.  Each put is committed
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM memo').fetchall()[0][0]
+        finally:
+            conn.close()
+
+    def test_put_get(self):
+        # Only result fields are stored.  Caller's record id and event year are left alone
+        key = self.memo.get_key(' halifax, canada ', 1850, True)
+        self.memo.put(key, self.make_place())
+        self.assertEqual(1, self.count_rows())
+
+        place = Loc.Loc()
+        place.id = '@P2@'
+        place.event_year = 1850
+        self.assertTrue(self.memo.get(key, place))
+        self.assertEqual(('halifax', Result.STRONG_MATCH, '@P2@', 1850),
+                         (place.city1, place.result_type, place.id, place.event_year))
+        self.assertEqual(self.make_place().georow_list, place.georow_list)
+        self.assertFalse(self.memo.get(self.memo.get_key('halifax, canada', 1850, False), place))
+        self.assertEqual((1, 1), (self.memo.hits, self.memo.misses))
+
+    def test_result_attributes(self):
+        # Every Loc field except the caller's is stored
+        self.assertEqual(sorted(set(Loc.Loc().__dict__) - {'logger', 'event_year', 'id'}),
+                         sorted(LookupMemo.RESULT_ATTRIBUTES))
+
+    def test_key(self):
+        # Years with the same result for every start year check share a key
+        memo = self.memo
+        self.assertEqual(memo.get_key('a', 1600, True), memo.get_key('a', 1620, True))
+        self.assertNotEqual(memo.get_key('a', 1600, True), memo.get_key('a', 1750, True))
+        self.assertNotEqual(memo.get_key('a', 0, True), memo.get_key('a', 1600, True))
+        self.assertNotEqual(memo.get_key('a', 0, True), memo.get_key('a', 0, False))
+
+    def test_fingerprint(self):
+        # Entries are kept for the same fingerprint and removed when it changes
+        key = self.memo.get_key('halifax, canada', 0, True)
+        self.memo.put(key, self.make_place())
+        self.memo.close()
+        self.memo = LookupMemo.LookupMemo(self.path, 'build 1', [1700, 1800])
+        self.assertTrue(self.memo.get(key, Loc.Loc()))
+        self.memo.close()
+        self.memo = LookupMemo.LookupMemo(self.path, 'build 2', [1700, 1800])
+        self.assertFalse(self.memo.get(key, Loc.Loc()))
+
+    def test_error(self):
+        # Memo errors are counted and the lookup goes on without the memo
+        key = self.memo.get_key('halifax, canada', 0, True)
+        conn = sqlite3.connect(self.path)
+        conn.execute('DROP TABLE memo')
+        conn.close()
+        self.memo.put(key, self.make_place())
+        self.assertFalse(self.memo.get(key, Loc.Loc()))
+        self.assertEqual(2, self.memo.errors)
+
+
+class TestLookupMemoGeodata(unittest.TestCase):
+    def setUp(self) -> None:
+        self.geonames = Fixture.GeonameDir()
+        self.geodata = self.geonames.open()
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+        self.geonames.remove()
+
+    def test_find_location(self):
+        # Memo hit gives the same place as the DB lookup
+        location = 'st andrews, nova scotia, canada'
+        self.assertIsNotNone(self.geodata.lookup_memo)
+        first = Loc.Loc()
+        self.geodata.find_location(location, first, False)
+        second = Loc.Loc()
+        second.id = '@P2@'
+        self.geodata.find_location(location, second, False)
+        self.assertEqual(1, self.geodata.lookup_memo.hits)
+        self.assertEqual('@P2@', second.id)
+        for name in LookupMemo.RESULT_ATTRIBUTES:
+            # NaN lat and lon don't compare equal
+            if name not in ['lat', 'lon']:
+                self.assertEqual(getattr(first, name), getattr(second, name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import unittest
+
+from geofinder import Loc
+from geofinder.GeoKeys import Entry
+from geofinder.test import Fixture
+from geofinder.test.TestGeodataFiles import table_rows
+
+queries = ['halifax, nova scotia, canada', 'dover, kent, england, united kingdom', 'douvres, england', 'paris, france',
+           'parigi', 'munich, bavaria, germany', 'bruce county, ontario, canada', 'santa clara county, california, usa',
+           'st andrews, prince edward island, canada', 'kent, england', 'california, united states']
+
+
+class TestMigrate(unittest.TestCase):
+    fresh = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.fresh = Fixture.GeonameDir()
+        cls.fresh.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.fresh.remove()
+
+    def test_migrate_v3(self):
+        # Version 2 DB is converted in place (not rebuilt) and gives the same lookup results as a fresh build
+        geonames = Fixture.GeonameDir()
+        try:
+            geonames.open().close()
+            Fixture.make_v2_db(geonames.db_path)
+            for fname in os.listdir(geonames.cache_dir):
+                if fname.startswith('geodata.snap') or fname.startswith('lookup_memo'):
+                    os.remove(os.path.join(geonames.cache_dir, fname))
+
+            with self.assertLogs(level='INFO') as logs:
+                migrated = geonames.open(memo_enabled=False)
+            messages = '\n'.join(logs.output)
+            self.assertIn('Converting database to version 3', messages)
+            self.assertNotIn('geonames files done', messages)
+
+            fresh = self.fresh.open(memo_enabled=False)
+            try:
+                for query in queries:
+                    fresh_place = Loc.Loc()
+                    fresh.find_location(query, fresh_place, True)
+                    place = Loc.Loc()
+                    migrated.find_location(query, place, True)
+                    self.assertGreater(len(fresh_place.georow_list), 0, query)
+                    self.assertEqual([row[Entry.ID] for row in fresh_place.georow_list],
+                                     [row[Entry.ID] for row in place.georow_list], query)
+                    self.assertEqual(fresh_place.result_type, place.result_type, query)
+            finally:
+                fresh.close()
+                migrated.close()
+
+            # Rows keep their DB IDs.  Priority has no population for converted rows so it isn't compared
+            columns = 'id, name, country, admin1_id, admin2_id, lat, lon, f_code, geoid, sdx'
+            for sql in [f'SELECT {columns} FROM geodata ORDER BY id', f'SELECT {columns} FROM admin ORDER BY id',
+                        'SELECT name, lang, geoid FROM altname ORDER BY geoid, name']:
+                self.assertEqual(table_rows(self.fresh.db_path, sql), table_rows(geonames.db_path, sql), sql)
+        finally:
+            geonames.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import unittest
+
+from geofinder import DB
+from geofinder.GeoKeys import Entry
+from geofinder.Snapshot import SELECT_STR
+from geofinder.test import Fixture
+
+
+class TestNameIndex(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open()
+        self.db = self.geodata.geo_files.geodb.db
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def word_match(self, text, tbl='main.geodata', where='name LIKE ?', args=()):
+        # Geoids from word_match with and without the name_trigram index
+        index_rows = self.db.word_match(SELECT_STR, where, tbl, (text, *args))
+        self.db.trigram_index = False
+        try:
+            like_rows = self.db.word_match(SELECT_STR, where, tbl, (text, *args))
+        finally:
+            self.db.trigram_index = True
+        return sorted(row[Entry.ID] for row in index_rows), sorted(row[Entry.ID] for row in like_rows)
+
+    def test_same_as_like(self):
+        # The index gives the same rows as the LIKE scan
+        self.assertTrue(self.db.trigram_index)
+        for text, tbl, where, args in [('county', 'main.admin', 'name LIKE ?', ()),
+                                       ('andrews', 'main.geodata', 'name LIKE ?', ()),
+                                       ('andr', 'main.geodata', 'name LIKE ? AND country = ?', ('ca',)),
+                                       ('st andr', 'main.geodata', 'name LIKE ? AND country = ?', ('ca',)),
+                                       ('church mary', 'main.geodata', 'name LIKE ? AND country = ?', ('gb',)),
+                                       ('ber wick', 'main.geodata', 'name LIKE ? AND country = ?', ('gb',)),
+                                       ('edward isl', 'main.admin', 'name LIKE ?', ()),
+                                       ('clara county', 'main.admin', 'name LIKE ?', ())]:
+            index, like = self.word_match(text, tbl, where, args)
+            self.assertGreater(len(like), 0, text)
+            self.assertEqual(like, index, text)
+
+    def test_substring(self):
+        # A word also matches inside a word
+        st_andrews = sorted(Fixture.geoids[key] for key in ['st_andrews_pe', 'st_andrews_ns', 'st_andrews_nb'])
+        self.assertEqual((st_andrews, st_andrews), self.word_match('ndrews'))
+
+    def test_common_words(self):
+        # A word with 20 or more rows is dropped unless a row also matches another word
+        self.assertEqual(([], []), self.word_match('ber', where='name LIKE ? AND country = ?', args=('gb',)))
+        rows = self.db.word_match(SELECT_STR, 'name LIKE ? AND country = ?', 'main.geodata', ('ber wick', 'gb'))
+        self.assertGreater(len(rows), 0)
+        for row in rows:
+            self.assertTrue('ber' in row[Entry.NAME] and 'wick' in row[Entry.NAME], row)
+
+    def test_limit(self):
+        # The limit is per word and applies after the country term
+        self.assertEqual(105, self.db.get_limit())
+        self.db.set_params(order_str='', limit_str='LIMIT 5')
+        try:
+            for text, count in [('ber', 5), ('ber wick', 10)]:
+                rows = self.db.word_match(SELECT_STR, 'name LIKE ? AND country = ?', 'main.geodata', (text, 'gb'))
+                self.assertLessEqual(len(rows), count, text)
+                self.assertEqual({'gb'}, {row[Entry.ISO] for row in rows}, text)
+            self.assertEqual(5, len(self.db.word_match(SELECT_STR, 'name LIKE ? AND country = ?', 'main.geodata',
+                                                       ('ber', 'gb'))))
+        finally:
+            self.db.set_params(order_str='', limit_str='LIMIT 105')
+
+    def test_tokens(self):
+        self.assertEqual(['st', 'andrews'], DB.get_tokens('St. Andrews'))
+        self.assertEqual('"st andr"*', DB.get_fts_phrase(['st', 'andr']))
+
+
+if __name__ == '__main__':
+    unittest.main()
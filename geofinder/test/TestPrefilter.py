@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import tempfile
+import unittest
+
+from geofinder import Prefilter
+from geofinder.test import Fixture
+
+
+class TestPrefilter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix='geofinder_test_')
+        self.path = os.path.join(self.directory, 'places.txt')
+        self.lines = [Fixture.geoname_line(1001 + idx, *row).rstrip('\n') for idx, row in enumerate(Fixture.places.values())]
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write('\n'.join(self.lines))
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+        os.rmdir(self.directory)
+
+    def scan(self, pattern, start=0, end=None, chunk_size=None) -> []:
+        res = []
+        for pos, line_count, lines in Prefilter.scan_file(self.path, pattern, start, end, chunk_size):
+            res.extend(lines)
+        return res
+
+    def test_geoname_pattern(self):
+        # Country codes are case insensitive.  Feature codes must match exactly
+        pattern = Prefilter.geoname_pattern({'gb': ''}, {'PPL': '', 'ADM2': ''})
+        names = [text.split('\t')[1] for line_num, text in self.scan(pattern)]
+        self.assertEqual(['Kent', 'Dover', 'Canterbury'], names)
+        self.assertEqual([], self.scan(Prefilter.geoname_pattern({}, {'PPL': ''})))
+
+    def test_line_numbers(self):
+        # Last line has no line ending and is still found.  Line numbers count from 1
+        pattern = Prefilter.geoname_pattern({'de': ''}, {'PPLA': ''})
+        self.assertEqual([(len(self.lines), self.lines[-1])], self.scan(pattern))
+
+    def test_byte_ranges(self):
+        # Each line is returned by the one range that holds its first byte, for any split and chunk size
+        pattern = Prefilter.geoname_pattern({'ca': '', 'us': ''}, {'PPL': '', 'PPLA': '', 'ADM1': ''})
+        full = [text for line_num, text in self.scan(pattern)]
+        fsize = os.path.getsize(self.path)
+        for step in [1, 37, 500, fsize]:
+            parts = []
+            for start in range(0, fsize, step):
+                parts.extend(text for line_num, text in self.scan(pattern, start, start + step, chunk_size=64))
+            self.assertEqual(full, parts, step)
+
+    def test_altname_pattern(self):
+        pattern = Prefilter.altname_pattern(['fr', 'it'])
+        self.assertIsNotNone(pattern.search(b'1\t1013\tfr\tDouvres\t\t\n'))
+        self.assertIsNone(pattern.search(b'2\t1013\tfra\tDouvres\t\t\n'))
+        self.assertIsNone(pattern.search(b'3\t1013\ten\tDover\t\t\n'))
+
+
+if __name__ == '__main__':
+    unittest.main()
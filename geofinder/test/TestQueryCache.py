@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import threading
+import unittest
+
+from geofinder import Loc, QueryCache
+from geofinder.GeoKeys import Query, Result
+from geofinder.test import Fixture
+
+
+class TestQueryCache(unittest.TestCase):
+    def test_lru(self):
+        # Least recently used entry is removed first
+        cache = QueryCache.QueryCache(max_entries=2, max_bytes=1024 * 1024)
+        cache.put('a', 1, [])
+        cache.put('b', 2, [])
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3, [])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual([1, 3], [cache.get('a'), cache.get('c')])
+        self.assertEqual((3, 1), (cache.hits, cache.misses))
+
+    def test_size(self):
+        # Entries are removed to stay under max_bytes.  An entry over max_bytes isn't stored
+        rows = [('name', 'ca', 1.0)] * 10
+        size = QueryCache.QueryCache.get_size('a', rows)
+        cache = QueryCache.QueryCache(max_entries=100, max_bytes=size * 2)
+        for key in ['a', 'b', 'c']:
+            cache.put(key, key, rows)
+        self.assertEqual(['b', 'c'], list(cache.entries))
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        cache.put('d', 'd', rows * 3)
+        self.assertIsNone(cache.get('d'))
+
+        # Replacing an entry doesn't count its old size
+        cache.put('c', 'c2', rows)
+        self.assertEqual(size * 2, cache.size)
+        cache.clear()
+        self.assertEqual((0, 0), (len(cache.entries), cache.size))
+
+    def test_disabled(self):
+        cache = QueryCache.QueryCache(max_entries=0, max_bytes=1024)
+        cache.put('a', 1, [])
+        self.assertIsNone(cache.get('a'))
+
+    def test_threads(self):
+        cache = QueryCache.QueryCache(max_entries=50, max_bytes=1024 * 1024)
+
+        def run(base):
+            for idx in range(2000):
+                cache.put((base, idx % 80), idx, [])
+                cache.get((base, (idx + 1) % 80))
+
+        threads = [threading.Thread(target=run, args=(base,)) for base in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(50, len(cache.entries))
+        self.assertEqual(8000, cache.hits + cache.misses)
+        self.assertEqual(sum(item[1] for item in cache.entries.values()), cache.size)
+
+
+class TestProcessQuery(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open()
+        self.db = self.geodata.geo_files.geodb.db
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def query(self, name):
+        query_list = [Query(where='name = ? AND country = ?', args=(name, 'ca'), result=Result.STRONG_MATCH)]
+        return self.db.process_query('geoid', 'main.geodata', query_list)
+
+    def test_cached_result(self):
+        # Second query is a cache hit with the same rows.  Callers can change the returned list.  The default
+        # cascade only sets a result code once 7 rows are found
+        rows, res = self.query('st andrews')
+        self.assertEqual((3, Result.NO_MATCH), (len(rows), res))
+        rows.clear()
+        hits = self.db.query_cache.hits
+        self.assertEqual(3, len(self.query('st andrews')[0]))
+        self.assertEqual(hits + 1, self.db.query_cache.hits)
+
+    def test_key(self):
+        # Settings that change results are part of the key
+        self.query('halifax')
+        misses = self.db.query_cache.misses
+        self.db.use_wildcards = not self.db.use_wildcards
+        try:
+            self.query('halifax')
+        finally:
+            self.db.use_wildcards = not self.db.use_wildcards
+        self.assertEqual(misses + 1, self.db.query_cache.misses)
+
+    def test_lookup_uses_cache(self):
+        place = Loc.Loc()
+        self.geodata.find_location('halifax, nova scotia, canada', place, True)
+        self.assertGreater(len(self.db.query_cache.entries), 0)
+        self.assertIn('Query cache hits=', self.db.query_cache.get_stats())
+
+
+if __name__ == '__main__':
+    unittest.main()
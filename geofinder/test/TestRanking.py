@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+
+import os
+import sqlite3
+import unittest
+
+from geofinder import DB, GeoDB, Loc
+from geofinder.GeoKeys import Entry
+from geofinder.test import Fixture
+
+locations = ['halifax, nova scotia, canada', 'st andrews, nova scotia, canada', 'st andrews, canada',
+             'dover, kent, england, united kingdom', 'paris, france', 'munich, bavaria, germany',
+             'palo alto, california, united states', 'parigi, france', 'ontario, canada']
+
+# geodata and admin views of a version 3 DB
+v3_view_sql = """CREATE VIEW {tbl} AS
+    SELECT g.id AS id, g.name AS name, c.name AS country, g.admin1_id AS admin1_id, g.admin2_id AS admin2_id,
+        g.lat AS lat, g.lon AS lon, f.name AS f_code, g.geoid AS geoid, g.sdx AS sdx
+    FROM {base} g JOIN country_code c ON c.code = g.country JOIN feature_code f ON f.code = g.f_code"""
+
+
+def make_v3(geonames):
+    # Convert the fixture DB to version 3: no priority column
+    conn = sqlite3.connect(geonames.db_path)
+    try:
+        for tbl, base in GeoDB.base_table.items():
+            conn.execute(f'DROP VIEW {tbl}')
+            conn.execute(f'ALTER TABLE {base} DROP COLUMN priority')
+            conn.execute(v3_view_sql.format(tbl=tbl, base=base))
+        conn.execute('DELETE FROM version')
+        conn.execute('INSERT INTO version(version) VALUES(3)')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def lookup(geodata, location) -> []:
+    # IDs of the matches for location, best first
+    place = Loc.Loc()
+    geodata.find_location(location, place, False)
+    return [row[Entry.ID] for row in place.georow_list]
+
+
+class TestRanking(unittest.TestCase):
+    geonames = None
+    baseline = None
+
+    @classmethod
+    def setUpClass(cls):
+        # Matches with the legacy cascade.  No ranking
+        cls.geonames = Fixture.GeonameDir()
+        geodata = cls.geonames.open(cascade_profile='legacy')
+        cls.baseline = {location: lookup(geodata, location) for location in locations}
+        geodata.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def test_rank_priority(self):
+        # Lower is better.  Feature first, then population
+        self.assertLess(GeoDB.rank_priority('PPLC', 0), GeoDB.rank_priority('PPL', 10000000))
+        self.assertLess(GeoDB.rank_priority('PPL', 20000), GeoDB.rank_priority('PPL', 500))
+        self.assertEqual(GeoDB.rank_priority('PPL', 0), GeoDB.rank_priority('PPL', None))
+
+    def test_priority_column(self):
+        # Priority is from the geonames population.  Alternate name rows have the priority of their entry
+        geodata = self.geonames.open()
+        try:
+            geodb = geodata.geo_files.geodb
+            self.assertEqual(GeoDB.rank_priority('PPL', 30000), geodb.get_geoid_priority(Fixture.geoids['dover']))
+            cur = geodb.db.conn.cursor()
+            cur.execute('SELECT DISTINCT f_code, priority FROM geodata WHERE geoid = ?', (Fixture.geoids['munich'],))
+            rows = cur.fetchall()
+            self.assertEqual(1, len(rows))
+            self.assertEqual(GeoDB.rank_priority(rows[0][0], 1260000), rows[0][1])
+        finally:
+            geodata.close()
+
+    def test_ranked_profiles(self):
+        # Ranked queries find the same best match as the legacy cascade
+        for profile in ['interactive', 'batch', 'strict']:
+            geodata = self.geonames.open(cascade_profile=profile)
+            try:
+                for location in locations:
+                    ids = lookup(geodata, location)
+                    self.assertEqual(self.baseline[location][:1], ids[:1], (profile, location))
+                    self.assertLessEqual(set(ids), set(self.baseline[location]), (profile, location))
+            finally:
+                geodata.close()
+
+    def test_top_k(self):
+        # Truncation keeps the best rows.  Snapshot and SQLite return the same rows
+        geodata = self.geonames.open()
+        db = geodata.geo_files.geodb.db
+        db.cascade_policy = DB.CascadePolicy(min_rows=7, stop_on=(), fallback='always', top_k=2)
+        try:
+            args = ('st andrews', 'ca')
+            rows = db.select('geoid', 'name = ? AND country = ?', 'main.geodata', args)
+            self.assertEqual(sorted([(Fixture.geoids['st_andrews_ns'],), (Fixture.geoids['st_andrews_nb'],)]),
+                             sorted(rows))
+            db.snapshot = None
+            self.assertEqual(rows, db.select('geoid', 'name = ? AND country = ?', 'main.geodata', args))
+            self.assertEqual(2, len(db.select('geoid', 'name LIKE ?', 'main.geodata', ('%',))))
+        finally:
+            geodata.close()
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self) -> None:
+        self.geonames = Fixture.GeonameDir()
+        geodata = self.geonames.open()
+        self.expected = {location: lookup(geodata, location) for location in locations}
+        geodata.close()
+        make_v3(self.geonames)
+
+    def tearDown(self) -> None:
+        self.geonames.remove()
+
+    def test_v3_to_v4(self):
+        # V3 DB is converted in place without a display.  Rows get the priority of their feature
+        with self.assertLogs('geofinder.GeoDB', level='INFO') as logs:
+            geodata = self.geonames.open()
+        try:
+            self.assertIn('Converting database to version 4', '\n'.join(logs.output))
+            geodb = geodata.geo_files.geodb
+            self.assertEqual(4, geodb.get_db_version())
+            cur = geodb.db.conn.cursor()
+            cur.execute('SELECT DISTINCT f_code, priority FROM geodata WHERE geoid = ?', (Fixture.geoids['dover'],))
+            self.assertEqual([('PPL', GeoDB.rank_priority('PPL', 0))], cur.fetchall())
+            cur.execute('SELECT COUNT(*) FROM geodata WHERE priority IS NULL')
+            self.assertEqual(0, cur.fetchall()[0][0])
+            self.assertIsNotNone(geodb.db.snapshot)
+            for location in locations:
+                self.assertEqual(self.expected[location], lookup(geodata, location), location)
+        finally:
+            geodata.close()
+
+        # Converted once
+        with self.assertLogs('geofinder.GeoDB', level='INFO') as logs:
+            self.geonames.open().close()
+        self.assertNotIn('Converting database', '\n'.join(logs.output))
+
+    def test_read_only(self):
+        # Read only opens don't convert the DB
+        with self.assertLogs('geofinder.GeodataFiles', level='ERROR') as logs:
+            self.assertRaises(ValueError, self.geonames.open, read_only=True)
+        self.assertIn('V4 is required', logs.output[0])
+        conn = sqlite3.connect(self.geonames.db_path)
+        try:
+            self.assertEqual([(3,)], conn.execute('SELECT version FROM version').fetchall())
+        finally:
+            conn.close()
+        self.assertTrue(os.path.exists(self.geonames.db_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
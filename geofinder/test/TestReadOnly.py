@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import sqlite3
+import threading
+import unittest
+
+from geofinder import Loc
+from geofinder.GeoKeys import Entry
+from geofinder.test import Fixture
+
+locations = ['halifax, nova scotia, canada', 'st andrews, canada', 'dover, kent, england, united kingdom',
+             'munich, bavaria, germany', 'palo alto, california, united states', 'parigi, france']
+
+
+class TestReadOnly(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open(read_only=True)
+        self.db = self.geodata.geo_files.geodb.db
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def lookup(self, location, shutdown=False) -> Loc.Loc:
+        place = Loc.Loc()
+        self.geodata.find_location(location, place, shutdown)
+        return place
+
+    def test_threads(self):
+        # Lookups on several threads give the same results as on one thread
+        expected = {location: [row[Entry.ID] for row in self.lookup(location).georow_list] for location in locations}
+        errors = []
+        conns = []
+
+        def run(shutdown):
+            conns.append(self.db.conn)
+            for location in locations * 5:
+                ids = [row[Entry.ID] for row in self.lookup(location, shutdown).georow_list]
+                if ids != expected[location] and not shutdown:
+                    errors.append((location, ids))
+
+        threads = [threading.Thread(target=run, args=(idx % 2 == 0,)) for idx in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        # Each thread had its own connection.  It was closed when the thread ended
+        self.assertEqual(5, len({id(conn) for conn in conns + [self.db.conn]}))
+        self.assertEqual([self.db.main_conn], self.db.pool)
+
+    def test_thread_exit(self):
+        # Short lived threads don't leave connections open
+        conns = []
+
+        def run():
+            conns.append(self.db.conn)
+            self.db.select('geoid', 'name = ?', 'main.geodata', ('halifax',))
+
+        for _ in range(3):
+            threads = [threading.Thread(target=run) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([self.db.main_conn], self.db.pool)
+        self.assertEqual(60, len(conns))
+        self.assertRaises(sqlite3.ProgrammingError, conns[0].execute, 'SELECT 1')
+
+    def test_shutdown_wildcards(self):
+        # Shutdown turns off wildcards for that lookup only.  The shared DB setting is unchanged
+        self.lookup('halifax, nova scotia, canada', shutdown=True)
+        self.assertTrue(self.db.use_wildcards)
+        self.assertTrue(self.db.lookup_wildcards)
+        keys = [self.geodata.lookup_memo.get_key('halifax, canada', 0, wildcards) for wildcards in [True, False]]
+        self.assertNotEqual(keys[0], keys[1])
+
+        # Per thread setting
+        self.db.lookup_wildcards = False
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.db.lookup_wildcards))
+        thread.start()
+        thread.join()
+        self.db.lookup_wildcards = True
+        self.assertEqual([True], other)
+
+    def test_no_shared_place_state(self):
+        # Copying a row to a place leaves nothing on the shared GeoDB
+        geodb = self.geodata.geo_files.geodb
+        before = set(vars(geodb))
+        self.lookup('munich, bavaria, germany')
+        self.assertEqual(before, set(vars(geodb)))
+        self.assertFalse(hasattr(geodb, 'place_type'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+import os
+import unittest
+
+from geofinder import Loc, Snapshot
+from geofinder.GeoKeys import Entry
+from geofinder.test import Fixture
+
+
+class TestSnapshot(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        cls.geonames.open().close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        self.geodata = self.geonames.open()
+        self.geodb = self.geodata.geo_files.geodb
+        self.snap_path = os.path.join(self.geonames.cache_dir, 'geodata.snap')
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def assert_same_rows(self, where, args, tbl='main.geodata'):
+        # Snapshot gives the same rows as SQLite
+        db = self.geodb.db
+        self.assertIsNotNone(db.snapshot.select(Snapshot.SELECT_STR, where, tbl, args, db.get_limit()), where)
+        snap_rows = db.select(Snapshot.SELECT_STR, where, tbl, args)
+        snapshot = db.snapshot
+        db.snapshot = None
+        try:
+            sql_rows = db.select(Snapshot.SELECT_STR, where, tbl, args)
+        finally:
+            db.snapshot = snapshot
+        self.assertEqual(sql_rows, snap_rows, where)
+
+    def test_queries(self):
+        self.assertIsNotNone(self.geodb.db.snapshot)
+        self.assert_same_rows('name = ? AND country = ?', ('st andrews', 'ca'))
+        self.assert_same_rows('name LIKE ? AND country = ?', ('st%', 'ca'))
+        self.assert_same_rows('geoid = ?', (Fixture.geoids['dover'],))
+        self.assert_same_rows('name = ? AND country = ? AND admin1_id = ?', ('ontario', 'ca', '08'), tbl='main.admin')
+        self.assertIsNone(self.geodb.db.snapshot.select(Snapshot.SELECT_STR, 'lat > ?', 'main.geodata', (1.0,)))
+
+    def test_stale(self):
+        self.assertIsNone(Snapshot.open_snapshot(self.snap_path, 'other build'))
+        snapshot = Snapshot.open_snapshot(self.snap_path, self.geodb.get_build_id())
+        self.assertIsNotNone(snapshot)
+        snapshot.close()
+
+    def test_deleted_country(self):
+        # A country change closes the snapshot.  Deleted rows are not returned before or after it is exported again
+        paris = Fixture.geoids['paris']
+        self.geodb.delete_country('fr')
+        self.assertIsNone(self.geodb.db.snapshot)
+        place = Loc.Loc()
+        self.geodata.find_location('paris, france', place, True)
+        self.assertNotIn(paris, [row[Entry.ID] for row in place.georow_list])
+        self.geodata.close()
+
+        self.geonames.set_countries(['ca', 'gb', 'us', 'de'])
+        try:
+            self.geodata = self.geonames.open()
+            self.geodb = self.geodata.geo_files.geodb
+            self.assertIsNotNone(self.geodb.db.snapshot)
+            self.assertEqual([], self.geodb.db.snapshot.select(Snapshot.SELECT_STR, 'geoid = ?', 'main.geodata', (paris,)))
+        finally:
+            self.geonames.set_countries(Fixture.countries)
+
+
+if __name__ == '__main__':
+    unittest.main()
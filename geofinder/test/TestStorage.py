@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+
+import sqlite3
+import threading
+import unittest
+
+from geofinder import DB, Loc
+from geofinder.GeoKeys import Entry
+from geofinder.test import Fixture
+
+locations = ['halifax, nova scotia, canada', 'st andrews, canada', 'dover, kent, england, united kingdom',
+             'munich, bavaria, germany', 'palo alto, california, united states', 'parigi, france', 'bert*, ontario, canada']
+
+
+def lookup(geodata, location) -> []:
+    # IDs of the matches for location
+    place = Loc.Loc()
+    geodata.find_location(location, place, False)
+    return [row[Entry.ID] for row in place.georow_list]
+
+
+class TestStorage(unittest.TestCase):
+    geonames = None
+    expected = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        geodata = cls.geonames.open()
+        cls.expected = {location: lookup(geodata, location) for location in locations}
+        geodata.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def open(self, storage, **settings):
+        # Read only DB with storage profile.  No snapshot or memo, so lookups go to SQLite
+        return self.geonames.open(memo_enabled=False, read_only=True, storage_profile=storage, snapshot_enabled=False,
+                                  **settings)
+
+    def test_same_results(self):
+        # Every profile gives the same lookup results
+        for storage in DB.storage_profiles:
+            geodata = self.open(storage)
+            try:
+                self.assertEqual(storage, geodata.geo_files.geodb.db.storage)
+                for location in locations:
+                    self.assertEqual(self.expected[location], lookup(geodata, location), (storage, location))
+            finally:
+                geodata.close()
+
+    def test_memory_threads(self):
+        # Connections on other threads use the same in memory copy.  It is loaded once
+        geodata = self.open('memory')
+        db = geodata.geo_files.geodb.db
+        try:
+            load_time = db.load_time
+            errors = []
+
+            def run():
+                for location in locations:
+                    if lookup(geodata, location) != self.expected[location]:
+                        errors.append(location)
+
+            threads = [threading.Thread(target=run) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([], errors)
+            self.assertEqual([db.main_conn], db.pool)
+            self.assertEqual(load_time, db.load_time)
+        finally:
+            geodata.close()
+
+        # Memory is released when the last connection closes
+        conn = sqlite3.connect(db.memory_uri, uri=True)
+        try:
+            self.assertEqual([], conn.execute('SELECT name FROM sqlite_master').fetchall())
+        finally:
+            conn.close()
+
+    def test_memory_requires_read_only(self):
+        # Writes to an in memory DB would be lost.  Read/write opens use mmap instead
+        with self.assertLogs('geofinder.DB', level='INFO') as logs:
+            geodata = self.geonames.open(storage_profile='memory')
+        try:
+            self.assertEqual('mmap', geodata.geo_files.geodb.db.storage)
+            self.assertIsNone(geodata.geo_files.geodb.db.memory_uri)
+            self.assertIn('requires read only mode', '\n'.join(logs.output))
+        finally:
+            geodata.close()
+
+    def test_unknown_profile(self):
+        with self.assertLogs('geofinder.DB', level='WARNING'):
+            geodata = self.open('ssd')
+        try:
+            self.assertEqual('disk', geodata.geo_files.geodb.db.storage)
+        finally:
+            geodata.close()
+
+    def test_stats(self):
+        # Pragmas are set from the profile.  Resident size is the in memory copy or the memory mapped part of the file
+        for storage, profile in DB.storage_profiles.items():
+            geodata = self.open(storage)
+            try:
+                db = geodata.geo_files.geodb.db
+                stats = db.get_storage_stats()
+                self.assertEqual(storage, stats['storage'])
+                self.assertEqual(-profile.cache_kb, db.conn.execute('PRAGMA cache_size').fetchall()[0][0])
+                self.assertEqual(round(profile.cache_kb / 1024, 1), stats['cache_mb'])
+                self.assertGreater(stats['db_mb'], 0)
+                if storage == 'disk':
+                    self.assertEqual(0, stats['resident_mb'])
+                else:
+                    self.assertEqual(stats['db_mb'], stats['resident_mb'])
+                if profile.in_memory:
+                    self.assertGreater(db.load_time, 0)
+                    self.assertTrue(db.memory_uri.startswith('file:geofinder_'))
+                else:
+                    self.assertEqual(0.0, stats['load_seconds'])
+            finally:
+                geodata.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
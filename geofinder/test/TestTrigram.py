@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  Copyright (c) 2019.       Mike Herbert
+#
+#   This program is free software; you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation; either version 2 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program; if not, write to the Free Software
+#   Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+
+
+import unittest
+
+from geofinder import DB
+from geofinder.Snapshot import SELECT_STR
+from geofinder.test import Fixture
+
+# Names are stored normalized to ASCII.  Rows with other names check that the index matches them the same way
+unicode_rows = [('münchen', 'de', '02', '', 48.1, 11.6, 'PPL', '9001', 'm525'),
+                ('MÜNCHEN', 'de', '02', '', 48.1, 11.6, 'PPL', '9002', 'm525'),
+                ('straße am see', 'de', '02', '', 48.0, 11.0, 'PPL', '9003', 's360'),
+                ('москва', 'de', '02', '', 48.0, 11.0, 'PPL', '9004', ''),
+                ('île-de-france', 'fr', '11', '', 48.5, 2.5, 'ADM1', '9005', 'i431')]
+
+patterns = [('main.geodata', 'name LIKE ?', ('%ston',)),
+            ('main.geodata', 'name LIKE ?', ('%rost%',)),
+            ('main.geodata', 'name LIKE ? AND country = ?', ('%wick%', 'gb')),
+            ('main.geodata', 'country = ? AND name LIKE ?', ('gb', '%wick%')),
+            ('main.geodata', 'name LIKE ? AND country = ?', ('b_rton%', 'ca')),
+            ('main.geodata', 'name LIKE ?', ('%dre_s',)),
+            ('main.geodata', 'name LIKE ?', ('st andrews',)),
+            ('main.geodata', 'name LIKE ?', ('%ünch%',)),
+            ('main.geodata', 'name LIKE ?', ('%ÜNCH%',)),
+            ('main.geodata', 'name LIKE ?', ('m_nchen',)),
+            ('main.geodata', 'name LIKE ?', ('%aße%',)),
+            ('main.geodata', 'name LIKE ?', ('%моск%',)),
+            ('main.geodata', 'name LIKE ?', ('%МОСК%',)),
+            ('main.admin', 'name LIKE ?', ('île%',)),
+            ('main.admin', 'name LIKE ?', ('%county',)),
+            ('main.admin', 'name LIKE ? AND country = ?', ('%de-fr%', 'fr'))]
+
+
+class TestTrigram(unittest.TestCase):
+    geonames = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.geonames = Fixture.GeonameDir()
+        geodata = cls.geonames.open()
+        geodb = geodata.geo_files.geodb
+        geodb.db.begin()
+        for row in unicode_rows:
+            geodb.insert(geo_row=row, feat_code=row[6])
+        geodb.db.commit()
+        geodb.new_build_id(keep=['titles', 'name_fts', 'place_rtree'])
+        geodb.update_trigram_index(True)
+        geodata.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.geonames.remove()
+
+    def setUp(self) -> None:
+        # No snapshot, so queries go to SQLite
+        self.geodata = self.geonames.open(memo_enabled=False, snapshot_enabled=False)
+        self.db = self.geodata.geo_files.geodb.db
+
+    def tearDown(self) -> None:
+        self.geodata.close()
+
+    def test_same_rows(self):
+        # Queries through the index give the same rows as the LIKE scan
+        self.assertTrue(self.db.trigram_index)
+        for tbl, where, args in patterns:
+            self.assertNotEqual(where, DB.DB.use_trigram_index(where, args), args)
+            index_rows = self.db.select(SELECT_STR, where, tbl, args)
+            self.db.trigram_index = False
+            try:
+                like_rows = self.db.select(SELECT_STR, where, tbl, args)
+            finally:
+                self.db.trigram_index = True
+            self.assertEqual(sorted(like_rows), sorted(index_rows), args)
+        # LIKE only ignores case for ASCII letters.  The index gives the same rows
+        self.assertEqual(1, len(self.db.select(SELECT_STR, 'name LIKE ?', 'main.geodata', ('%ünch%',))))
+        self.assertEqual(1, len(self.db.select(SELECT_STR, 'name LIKE ?', 'main.geodata', ('%моск%',))))
+
+    def test_rewrite(self):
+        # Only name LIKE terms with 3 characters in a row without a wildcard use the index
+        self.assertEqual('country = ? AND  name IN (SELECT name FROM name_trigram WHERE name LIKE ?) ',
+                         DB.DB.use_trigram_index('country = ? AND name LIKE ?', ('gb', '%wick%')))
+        for where, args in [('name LIKE ?', ('%st%',)), ('name LIKE ?', ('s_t%',)), ('name = ?', ('dover',)),
+                            ('country LIKE ? AND name = ?', ('%gbr%', 'dover'))]:
+            self.assertEqual(where, DB.DB.use_trigram_index(where, args))
+
+    def test_disabled(self):
+        # Turning the index off drops the table.  Turning it on builds it again
+        self.geodata.close()
+        self.geodata = self.geonames.open(memo_enabled=False, trigram_index_enabled=False)
+        self.assertFalse(self.geodata.geo_files.geodb.db.trigram_index)
+        self.assertFalse(self.geodata.geo_files.geodb.db.table_exists('name_trigram'))
+        self.geodata.close()
+        self.geodata = self.geonames.open(memo_enabled=False)
+        self.assertTrue(self.geodata.geo_files.geodb.db.trigram_index)
+        self.assertTrue(self.geodata.geo_files.geodb.db.table_exists('name_trigram'))
+
+
+if __name__ == '__main__':
+    unittest.main()